@@ -0,0 +1,13 @@
+import os
+from django.apps import AppConfig
+
+
+class ImageGeneratorConfig(AppConfig):
+    name = "image_generator"
+
+    def ready(self):
+        # runserver 自动重载时真正处理请求的子进程带有 RUN_MAIN；其他管理命令（migrate、run_workers 等）不预热，
+        # gunicorn / uvicorn 下由 wsgi.py / asgi.py 调用
+        if os.environ.get('RUN_MAIN') == 'true':
+            from . import ocr
+            ocr.warm_up_in_background()
@@ -0,0 +1,5 @@
+"""
+日记流程的分阶段基准测试，全部在本地替身上运行（Leonardo 替身服务器、Gemini 替身、合成的 Vision 响应），
+不需要任何 API key。入口是 python manage.py bench_pipeline，结果以 JSON 输出，
+可以与上一次的结果比较，出现性能回退时命令以非零状态退出。
+"""
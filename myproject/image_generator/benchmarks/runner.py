@@ -0,0 +1,97 @@
+import time
+import json
+import logging
+from dataclasses import dataclass, field
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """一个被测阶段：setup(env) 只执行一次，run(env) 每次迭代执行一次"""
+    name: str
+    run: object
+    setup: object = None
+    iterations: int = 20
+    items: int = 1  # 每次迭代处理的条目数（场景数、活动数等），用于计算吞吐量
+
+
+@dataclass
+class StageResult:
+    name: str
+    iterations: int
+    samples: list = field(default_factory=list)  # 每次迭代耗时（秒）
+    wall_time: float = 0.0
+    api_calls: dict = field(default_factory=dict)  # 每次迭代的平均调用次数，按上游区分
+    items: int = 1
+
+    def to_dict(self):
+        return {
+            'iterations': self.iterations,
+            'p50_ms': round(percentile(self.samples, 50) * 1000, 3),
+            'p95_ms': round(percentile(self.samples, 95) * 1000, 3),
+            'p99_ms': round(percentile(self.samples, 99) * 1000, 3),
+            'mean_ms': round(sum(self.samples) / len(self.samples) * 1000, 3),
+            'api_calls_per_op': self.api_calls,
+            'throughput_ops_s': round(self.iterations / self.wall_time, 3) if self.wall_time else None,
+            'throughput_items_s': round(self.iterations * self.items / self.wall_time, 3) if self.wall_time else None,
+        }
+
+
+def percentile(samples, pct):
+    """线性插值的百分位数"""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def run_stage(stage, env, iterations=None):
+    """执行一个阶段，返回 StageResult；env.call_counts() 返回各上游的累计调用次数"""
+    iterations = iterations or stage.iterations
+    if stage.setup:
+        stage.setup(env)
+
+    result = StageResult(stage.name, iterations, items=stage.items)
+    calls_before = env.call_counts()
+    started = time.perf_counter()
+    for i in range(iterations):
+        op_started = time.perf_counter()
+        stage.run(env)
+        result.samples.append(time.perf_counter() - op_started)
+    result.wall_time = time.perf_counter() - started
+    calls_after = env.call_counts()
+
+    result.api_calls = {
+        upstream: round((calls_after.get(upstream, 0) - calls_before.get(upstream, 0)) / iterations, 2)
+        for upstream in calls_after
+    }
+    logger.info(f"Stage {stage.name}: {result.to_dict()}")
+    return result
+
+
+def compare(current, baseline, tolerance):
+    """与基线结果比较，返回回退描述的列表（为空表示通过）
+    p95 超过基线 (1 + tolerance) 倍，或任一上游的调用次数增加，都视为回退
+    """
+    regressions = []
+    for name, stage in current['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base:
+            continue
+        if stage['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {stage['p95_ms']}ms > baseline {base['p95_ms']}ms (+{tolerance:.0%})")
+        for upstream, calls in stage['api_calls_per_op'].items():
+            base_calls = base.get('api_calls_per_op', {}).get(upstream)
+            if base_calls is not None and calls > base_calls:
+                regressions.append(f"{name}: {upstream} calls/op {calls} > baseline {base_calls}")
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,160 @@
+import time
+import threading
+from types import SimpleNamespace
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory
+
+from .runner import Stage
+from .. import cloudvision, jobs, ocr, progress, prompt_generation, views
+from ..image_generation import create_dataset, generate_with_image_id, wait_for_generation, upload_images_to_dataset
+from ..models import UserProfile
+from ..progress import ProgressReporter
+
+
+DIARY_TEXT = (
+    "今天早上我和妹妹去公园跑步，然后一起在湖边喂鸭子。中午我们在家做了番茄炒蛋。"
+    "下午我在阳台上画了一幅水彩画，晚上和朋友去看了一场电影。"
+)
+
+BENCH_USERNAME = "bench_user"
+BENCH_DESCRIPTION = "8-year-old girl with black hair, pigtail hairstyle"
+
+
+class StandinGeminiModel:
+    """Gemini GenerativeModel 的替身，按固定延迟返回若干行场景描述"""
+
+    def __init__(self, latency=0.0, scenes=6):
+        self.latency = latency
+        self.scenes = scenes
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _response(self):
+        with self._lock:
+            self.calls += 1
+        lines = [f'"scene {i}: running through a sunlit park, laughing with friends"' for i in range(self.scenes)]
+        return SimpleNamespace(text="\n".join(lines))
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        return self._response()
+
+    async def generate_content_async(self, prompt):
+        import asyncio
+        await asyncio.sleep(self.latency)
+        return self._response()
+
+
+def build_vision_response(text=DIARY_TEXT * 4, words_per_paragraph=12, paragraphs_per_block=3):
+    """合成一个与 document_text_detection 结构相同的响应，每个字符是一个 symbol"""
+    words = [
+        SimpleNamespace(symbols=[SimpleNamespace(text=char) for char in text[i:i + 2]])
+        for i in range(0, len(text), 2)
+    ]
+    paragraphs = [
+        SimpleNamespace(words=words[i:i + words_per_paragraph])
+        for i in range(0, len(words), words_per_paragraph)
+    ]
+    blocks = [
+        SimpleNamespace(paragraphs=paragraphs[i:i + paragraphs_per_block])
+        for i in range(0, len(paragraphs), paragraphs_per_block)
+    ]
+    return SimpleNamespace(
+        full_text_annotation=SimpleNamespace(pages=[SimpleNamespace(blocks=blocks)]),
+        error=SimpleNamespace(message=""),
+    )
+
+
+def build_diary_image(size=(3024, 4032)):
+    """合成一张手机照片大小的 JPEG"""
+    import io
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    for y in range(100, size[1] - 100, 80):
+        draw.line((100, y, size[0] - 100, y), fill='gray', width=3)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=95)
+    return output.getvalue()
+
+
+class BenchEnv:
+    """各阶段共享的替身和数据"""
+
+    def __init__(self, standin, gemini):
+        self.standin = standin
+        self.gemini = gemini
+        self.vision_response = build_vision_response()
+        self.diary_image = build_diary_image()
+        self.scenes = [f"scene {i}: flying a kite on a windy hill" for i in range(5)]
+        self.gallery_dataset_id = None
+
+    def call_counts(self):
+        with self.standin.state.lock:
+            leonardo = sum(self.standin.state.calls.values())
+        return {'leonardo': leonardo, 'gemini': self.gemini.calls}
+
+
+############ stages ############
+
+def run_ocr_text_assembly(env):
+    ocr.format_paragraph(cloudvision.words_from_response(env.vision_response))
+
+
+def run_ocr_fake(env):
+    # 读取、预处理和拼接的开销，识别本身由 fake 后端替代
+    ocr.parse_diary(env.diary_image, backend='fake')
+
+
+def run_scene_split(env):
+    prompt_generation.process_diary_text(DIARY_TEXT)
+
+
+def setup_user_profile(env):
+    UserProfile.objects.update_or_create(
+        username=BENCH_USERNAME,
+        defaults={'description': BENCH_DESCRIPTION, 'seed_image_id': 'bench-seed-image'},
+    )
+
+
+def run_scene_fanout(env):
+    dataset_id = create_dataset(f"bench_diary_{time.time()}")
+    views.generate_images_background(env.scenes, dataset_id, 'bench-model', BENCH_USERNAME, use_cache=False)
+
+
+def run_dataset_build(env):
+    # 任务只用来承载进度记录，不交给 worker 执行
+    payload = {'dataset_name': f"bench_dataset_{time.time()}", 'seed_image_id': 'bench-seed-image',
+               'describe_user': BENCH_DESCRIPTION}
+    job = jobs.enqueue('create_dataset', payload)
+    progress.create(job, total=len(views.DATASET_ACTIVITIES))
+    views.create_dataset_background(progress=ProgressReporter(job.id), **payload)
+
+
+def setup_gallery(env):
+    dataset_id = create_dataset("bench_gallery")
+    for scene in env.scenes:
+        result = wait_for_generation(generate_with_image_id('bench-seed-image', scene, 1, use_cache=False))
+        upload_images_to_dataset(dataset_id, result.image_ids)
+    env.gallery_dataset_id = dataset_id
+
+
+def run_diary_gallery(env):
+    request = RequestFactory().get(f"/display-diary-scenes/{env.gallery_dataset_id}/")
+    request.session = SessionStore()
+    request.session['generated_scenes'] = env.scenes
+    request._messages = FallbackStorage(request)
+    views.display_diary_scenes(request, env.gallery_dataset_id)
+
+
+def default_stages(env):
+    return [
+        Stage('ocr_text_assembly', run_ocr_text_assembly, iterations=200),
+        Stage('ocr_fake', run_ocr_fake, iterations=20),
+        Stage('scene_split', run_scene_split, iterations=50),
+        Stage('scene_fanout', run_scene_fanout, setup=setup_user_profile, iterations=3, items=len(env.scenes)),
+        Stage('dataset_build', run_dataset_build, setup=setup_user_profile, iterations=2, items=9),
+        Stage('diary_gallery', run_diary_gallery, setup=setup_gallery, iterations=30),
+    ]
@@ -0,0 +1,214 @@
+"""
+进度事件的服务端推送（Server-Sent Events）。
+每个任务在当前进程里最多一个 JobBroadcaster：一个后台线程按 PROGRESS_STREAM_INTERVAL 读取 JobProgress，
+把新事件分发给所有订阅者（浏览器标签页），无论多少个客户端都只有这一个轮询，也不会请求 Leonardo。
+没有订阅者时线程退出。
+"""
+
+import json
+import queue
+import logging
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from . import metrics
+from .models import Job, JobProgress
+from .progress import snapshot
+
+
+logger = logging.getLogger(__name__)
+
+# 进度状态或任务状态到达这些值时推送 done 并结束
+FINISHED_PROGRESS = ('complete', 'failed', 'cancelled')
+FINISHED_JOBS = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+
+# 订阅者队列里的结束标记
+CLOSE = object()
+
+
+def format_event(event, data, event_id=None):
+    """按 text/event-stream 格式编码一条事件"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class JobBroadcaster:
+    def __init__(self, job_id, interval=None):
+        self.job_id = job_id
+        self.interval = interval or getattr(settings, 'PROGRESS_STREAM_INTERVAL', 1)
+        self.subscribers = {}
+        self.latest = None
+        self.finished = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"progress-{job_id}", daemon=True)
+
+    def subscribe(self, last_seq=0):
+        """订阅事件，先补发 seq 大于 last_seq 且仍在日志里的事件（浏览器断线重连时带 Last-Event-ID）"""
+        subscriber = queue.Queue()
+        with self._lock:
+            if self.latest is not None:
+                for message in self._messages(self.latest, None, last_seq):
+                    subscriber.put(message)
+                last_seq = max(last_seq, self.latest['seq'])
+            if self.finished:
+                subscriber.put(CLOSE)
+            else:
+                # 每个订阅者记住自己已收到的最大 seq
+                self.subscribers[subscriber] = last_seq
+        self._wake.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.pop(subscriber, None)
+
+    def _retire(self):
+        """已结束或没有订阅者时从注册表移除并返回 True
+        与 subscribe() 在同一把注册表锁下判断，新订阅者不会落到正在退出的线程上
+        """
+        with _broadcasters_lock:
+            with self._lock:
+                if not self.finished and self.subscribers:
+                    return False
+            if _broadcasters.get(self.job_id) is self:
+                del _broadcasters[self.job_id]
+            return True
+
+    def _messages(self, current, previous, last_seq):
+        """根据新旧两次快照生成要推送的消息"""
+        summary = {key: current[key] for key in ('status', 'current_activity', 'completed', 'total', 'dataset_id')}
+        messages = []
+        for event in current['events']:
+            if event['seq'] > last_seq:
+                messages.append(format_event(event['event'] or 'message', {**summary, **event}, event['seq']))
+        # 只有计数或当前活动变化、没有新事件时，推送一条不带 id 的 progress
+        if not messages and (previous is None or any(previous[key] != summary[key] for key in summary)):
+            messages.append(format_event('progress', summary))
+        if current['finished']:
+            messages.append(format_event('done', summary))
+        return messages
+
+    def _read(self):
+        row = JobProgress.objects.select_related('job').filter(job_id=self.job_id).first()
+        if row is not None:
+            current = snapshot(row)
+            job_state = row.job.state
+        else:
+            job = Job.objects.filter(id=self.job_id).values('state').first()
+            if job is None:
+                return None
+            current = {'job_id': self.job_id, 'dataset_id': None, 'status': job['state'].lower(),
+                       'current_activity': '', 'completed': 0, 'total': 0, 'seq': 0, 'events': []}
+            job_state = job['state']
+        # 任务被 worker 标记为结束但进度没有写到终态时（如进程崩溃），也要结束推送
+        current['finished'] = current['status'] in FINISHED_PROGRESS or job_state in FINISHED_JOBS
+        return current
+
+    def _publish(self, current):
+        with self._lock:
+            previous = self.latest
+            self.latest = current
+            deliveries = []
+            for subscriber, last_seq in self.subscribers.items():
+                deliveries.append((subscriber, self._messages(current, previous, last_seq)))
+                self.subscribers[subscriber] = max(last_seq, current['seq'])
+            if current['finished']:
+                self.finished = True
+                self.subscribers.clear()
+        for subscriber, messages in deliveries:
+            for message in messages:
+                subscriber.put(message)
+            if current['finished']:
+                subscriber.put(CLOSE)
+
+    def _run(self):
+        streams.inc()
+        try:
+            while not self._retire():
+                try:
+                    current = self._read()
+                    if current is None:
+                        current = {'job_id': self.job_id, 'dataset_id': None, 'status': 'failed',
+                                   'current_activity': '', 'completed': 0, 'total': 0, 'seq': 0,
+                                   'events': [], 'finished': True}
+                    self._publish(current)
+                except Exception as e:
+                    logger.error(f"Error reading progress of job {self.job_id}: {str(e)}")
+                finally:
+                    close_old_connections()
+                if self.finished:
+                    continue
+                self._wake.wait(self.interval)
+                self._wake.clear()
+        finally:
+            streams.dec()
+
+
+streams = metrics.gauge("progress_broadcasters", "Jobs whose progress is being streamed from this process")
+
+_broadcasters = {}
+_broadcasters_lock = threading.Lock()
+
+
+def subscribe(job_id, last_seq=0):
+    """订阅一个任务的进度，返回 (broadcaster, 队列)；同一任务的订阅者共用一个 broadcaster"""
+    with _broadcasters_lock:
+        broadcaster = _broadcasters.get(job_id)
+        if broadcaster is None:
+            broadcaster = _broadcasters[job_id] = JobBroadcaster(job_id)
+            start = True
+        else:
+            start = False
+        subscriber = broadcaster.subscribe(last_seq)
+    if start:
+        broadcaster.thread.start()
+    return broadcaster, subscriber
+
+
+def stream(job_id, last_seq=0, heartbeat=None):
+    """生成 text/event-stream 的内容，客户端断开时生成器被关闭并退订"""
+    heartbeat = heartbeat or getattr(settings, 'PROGRESS_STREAM_HEARTBEAT', 15)
+    broadcaster, subscriber = subscribe(job_id, last_seq)
+    try:
+        # 告诉浏览器断线后多久重连
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                message = subscriber.get(timeout=heartbeat)
+            except queue.Empty:
+                # 注释行，保持连接不被代理断开
+                yield ": keepalive\n\n"
+                continue
+            if message is CLOSE:
+                return
+            yield message
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def astream(job_id, last_seq=0, heartbeat=None):
+    """stream() 的异步版本，供 ASGI 使用
+    Django 在 ASGI 下会把同步迭代器整个读完再发送，推送就失去了意义；这里在线程池里等待队列，不阻塞事件循环
+    """
+    heartbeat = heartbeat or getattr(settings, 'PROGRESS_STREAM_HEARTBEAT', 15)
+    broadcaster, subscriber = subscribe(job_id, last_seq)
+    get = sync_to_async(subscriber.get, thread_sensitive=False)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                message = await get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if message is CLOSE:
+                return
+            yield message
+    finally:
+        broadcaster.unsubscribe(subscriber)
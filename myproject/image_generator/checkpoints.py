@@ -0,0 +1,59 @@
+import logging
+import threading
+from django.utils import timezone
+from .models import Job, JobStep
+
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoints:
+    """一个任务的步骤检查点
+    每一步推进时（提交生成、生成完成、上传完成）写入 JobStep，任务重试或 worker 重启后重新执行时，
+    从这里读出每一步做到了哪里；任务级别的状态（如已创建的数据集ID）用 remember() 合并进 Job.payload，
+    下一次执行时作为参数传给处理函数。
+    job_id 为 None 时只在内存中记录（直接调用后台函数时使用，如基准测试）
+    """
+
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+        self._lock = threading.Lock()
+        self._steps = {}
+        if job_id is not None:
+            self._steps = {step.step_index: step for step in JobStep.objects.filter(job_id=job_id)}
+
+    def get(self, index):
+        """第 index 步的 JobStep，还没开始时返回一个未保存的 PENDING 记录"""
+        with self._lock:
+            step = self._steps.get(index)
+        return step or JobStep(job_id=self.job_id, step_index=index)
+
+    def save(self, index, **fields):
+        """更新第 index 步的检查点"""
+        with self._lock:
+            step = self._steps.setdefault(index, JobStep(job_id=self.job_id, step_index=index))
+            for name, value in fields.items():
+                setattr(step, name, value)
+        if self.job_id is not None:
+            # 每一步只由一个线程推进，不需要 update_or_create 的事务（SQLite 上并发写事务容易报 database is locked）
+            if not JobStep.objects.filter(job_id=self.job_id, step_index=index).update(updated_at=timezone.now(), **fields):
+                JobStep.objects.create(job_id=self.job_id, step_index=index, **fields)
+        return step
+
+    def count(self, status):
+        with self._lock:
+            return sum(step.status == status for step in self._steps.values())
+
+    @property
+    def resumed(self):
+        """是否有上一次执行留下的检查点"""
+        with self._lock:
+            return bool(self._steps)
+
+    def remember(self, **fields):
+        """把任务级别的状态合并进 Job.payload，重新执行时作为参数传入"""
+        if self.job_id is None:
+            return
+        job = Job.objects.get(id=self.job_id)
+        job.payload = {**job.payload, **fields}
+        job.save(update_fields=['payload', 'updated_at'])
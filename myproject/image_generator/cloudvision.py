@@ -1,23 +1,159 @@
 #https://console.cloud.google.com/iam-admin/serviceaccounts/details/118058091341323201172/permissions?orgonly=true&project=ninth-bonito-438016-m5&supportedpurview=organizationId
+import io
 import os
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from django.conf import settings
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# 未设置时不要写入 None（会直接抛 TypeError），SDK 会自行查找默认凭据
+if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """返回当前进程共享的 ImageAnnotatorClient
+    第一次使用时才导入 SDK 并建立 gRPC 通道和认证，之后所有线程共用（client 是线程安全的）；
+    fork 出来的 worker 会重新创建自己的 client
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                from google.cloud import vision
+                _client = vision.ImageAnnotatorClient()
+                _client_pid = pid
+                logger.info("Created Google Vision client")
+    return _client
+
+
+# 异步 client 的 gRPC 通道绑定在创建它的事件循环上，按循环分别缓存
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """返回当前事件循环共享的 ImageAnnotatorAsyncClient"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        from google.cloud import vision
+        client = _async_clients[loop] = vision.ImageAnnotatorAsyncClient()
+    return client
+
+
+def warm_up(timeout=None):
+    """提前创建 client 并等待 gRPC 通道就绪，第一次 OCR 请求就只剩 API 本身的耗时
+    在 worker 启动时调用（见 apps.py 和 run_workers），失败只记录日志
+    """
+    timeout = timeout or getattr(settings, 'VISION_TIMEOUT', 30)
+    try:
+        client = get_client()
+        import grpc
+        grpc.channel_ready_future(client.transport.grpc_channel).result(timeout=timeout)
+        logger.info("Google Vision client warmed up")
+    except Exception as e:
+        logger.warning(f"Google Vision warm-up failed: {str(e)}")
+
+
+def read_content(source):
+    """把 OCR 的输入统一成 bytes：可以是 bytes、文件对象（如 Django 的 UploadedFile）或文件路径"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'read'):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return source.read()
+    with open(source, "rb") as image_file:
+        return image_file.read()
+
+
+preprocess_duration = metrics.histogram(
+    "vision_preprocess_seconds", "Time spent downsizing and re-encoding images before OCR",
+)
+payload_bytes = metrics.counter(
+    "vision_payload_bytes_total", "Image bytes received for OCR and sent to Vision", ("stage",),
+)
+
+
+def preprocess(content):
+    """OCR 之前的图片预处理：按 EXIF 方向旋转、转灰度、把长边缩到 VISION_MAX_EDGE 以内并重新编码
+    手机拍的日记动辄 5-12 MB，上传和 API 耗时主要由图片大小决定；文字识别不需要这么高的分辨率和颜色。
+    VISION_PREPROCESS=False 时原样返回；无法解码或处理后反而更大（且没有旋转、缩放）时也返回原图
+    """
+    payload_bytes.inc(len(content), stage="received")
+    if not getattr(settings, 'VISION_PREPROCESS', True):
+        payload_bytes.inc(len(content), stage="sent")
+        return content
+
+    started_at = time.perf_counter()
+    try:
+        from PIL import ExifTags, Image, ImageOps
+
+        with Image.open(io.BytesIO(content)) as original:
+            original_size = original.size
+            transformed = original.getexif().get(ExifTags.Base.Orientation, 1) != 1
+            image = ImageOps.exif_transpose(original)
+            if getattr(settings, 'VISION_GRAYSCALE', True):
+                image = image.convert('L')
+            elif image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+
+            max_edge = getattr(settings, 'VISION_MAX_EDGE', 2048)
+            if max(image.size) > max_edge:
+                image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+                transformed = True
+
+            output = io.BytesIO()
+            if getattr(settings, 'VISION_IMAGE_FORMAT', 'JPEG').upper() == 'PNG':
+                image.save(output, 'PNG', optimize=True)
+            else:
+                image.save(output, 'JPEG', quality=getattr(settings, 'VISION_JPEG_QUALITY', 85), optimize=True)
+            processed = output.getvalue()
+    except Exception as e:
+        logger.warning(f"Image pre-processing failed, sending the original: {str(e)}")
+        payload_bytes.inc(len(content), stage="sent")
+        return content
+
+    elapsed = time.perf_counter() - started_at
+    preprocess_duration.observe(elapsed)
+    if len(processed) >= len(content) and not transformed:
+        processed = content
+    payload_bytes.inc(len(processed), stage="sent")
+    logger.info(
+        f"Pre-processed OCR image {original_size[0]}x{original_size[1]} -> {image.size[0]}x{image.size[1]}, "
+        f"{len(content)} -> {len(processed)} bytes ({100 * (1 - len(processed) / len(content)):.0f}% smaller) "
+        f"in {elapsed * 1000:.0f}ms"
+    )
+    return processed
+
+
+# language code: https://cloud.google.com/vision/docs/languages
+# default is english, image_context={"language_hints": ["zh"] = chinese, "es" = spanish
+IMAGE_CONTEXT = {"language_hints": ["zh"]}
+
+
+def request_options():
+    return {
+        "image_context": IMAGE_CONTEXT,
+        # 单次请求的截止时间，超时由 SDK 抛出 DeadlineExceeded
+        "timeout": getattr(settings, 'VISION_TIMEOUT', 30),
+    }
 
-# from https://cloud.google.com/vision/docs/handwriting?hl=zh-cn
-def detect_document(path):
-    """从图片中提取文字"""
-    from google.cloud import vision
-
-    client = vision.ImageAnnotatorClient()
-
-    with open(path, "rb") as image_file:
-        content = image_file.read()
-
-    image = vision.Image(content=content)
-
-    # language code: https://cloud.google.com/vision/docs/languages
-    # default is english, image_context={"language_hints": ["zh"] = chinese, "es" = spanish
-    response = client.document_text_detection(image=image, image_context={"language_hints": ["zh"]}) 
 
+# from https://cloud.google.com/vision/docs/handwriting?hl=zh-cn
+def words_from_response(response):
+    """把 document_text_detection 的结果展开成单词列表"""
     # to store whole text
     paragraph_text = []  
 
@@ -47,22 +183,6 @@ def detect_document(path):
     return paragraph_text
 
 
-def format_paragraph(words):
-    # Join the list of words into a single string with spaces
-    paragraph = ''.join(words)
-    return paragraph
-
-
-def parse_diary(image_path):
-    """主函数，调用上述两个函数处理日记图片"""
-    words = detect_document(image_path)
-    extracted_text = format_paragraph(words)
-    return extracted_text
-
-
-
 # for debugging
-# test_doc_path = "./diary_chinese.png.jpg"
-# text = detect_document(test_doc_path)
-# formatted_paragraph = format_paragraph(text)
-# print(formatted_paragraph)
+# from .ocr import parse_diary
+# print(parse_diary("./diary_chinese.png.jpg", backend="google"))
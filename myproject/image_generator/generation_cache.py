@@ -0,0 +1,65 @@
+import json
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from . import metrics
+from .models import GenerationCache
+
+
+logger = logging.getLogger(__name__)
+
+# 决定生成结果的字段，其余字段（如 public）不影响图片内容
+KEY_FIELDS = ("modelId", "controlnets", "prompt", "width", "height", "presetStyle", "alchemy", "num_images")
+
+def cache_key(payload):
+    """对生成请求体中影响结果的字段做 sha256"""
+    relevant = {name: payload.get(name) for name in KEY_FIELDS}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+def enabled():
+    return getattr(settings, 'GENERATION_CACHE_ENABLED', True)
+
+
+def lookup(payload):
+    """查找相同参数的生成记录
+    已完成的直接返回（无需生成和轮询）；仍在进行中的返回同一个 generation，避免重复付费
+    """
+    key = cache_key(payload)
+    # 超过轮询截止时间还没完成的记录视为已失效
+    stale_before = timezone.now() - timedelta(seconds=getattr(settings, 'GENERATION_POLL_TIMEOUT', 300))
+    entry = GenerationCache.objects.filter(key=key).first()
+    if entry is None or (entry.status != 'COMPLETE' and entry.created_at < stale_before):
+        metrics.generation_cache_lookups.inc(result='miss')
+        return None
+
+    GenerationCache.objects.filter(pk=entry.pk).update(hit_count=F('hit_count') + 1)
+    metrics.generation_cache_lookups.inc(result='hit')
+    logger.info(f"Generation cache hit for {entry.generation_id} ({entry.status})")
+    return entry
+
+
+def remember_submission(payload, generation_id):
+    """记录刚提交的生成任务，完成后由 remember_result 补上图片"""
+    GenerationCache.objects.update_or_create(
+        key=cache_key(payload),
+        defaults={
+            'model_id': payload.get('modelId', ''),
+            'prompt': payload.get('prompt', ''),
+            'generation_id': generation_id,
+            'status': 'PENDING',
+            'images': [],
+        }
+    )
+
+
+def remember_result(generation_id, status, images):
+    """生成结束后更新缓存；失败的记录直接删除，下次重新生成"""
+    entries = GenerationCache.objects.filter(generation_id=generation_id)
+    if status == 'COMPLETE' and images:
+        entries.update(status='COMPLETE', images=images, updated_at=timezone.now())
+    else:
+        entries.delete()
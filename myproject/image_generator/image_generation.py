@@ -1,40 +1,64 @@
 import requests
 import json
 import time
-import os
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from . import generation_cache, metrics
+from .leonardo_client import get_client, get_async_client, should_retry
+from .polling import PollTimeout, generation_polling, generation_key
 
 
-leonardo_api_key = os.getenv("LEONARDO_API_KEY")
-authorization = "Bearer %s" % leonardo_api_key
-
 logger = logging.getLogger(__name__)
 
+AVATAR_MODEL_ID = "b24e16ff-06e3-43eb-8d33-4416c2d75876"
+PRESET_STYLE = "DYNAMIC"
+
+# 生成任务的终态，轮询到这两个状态之一就停止
+FINISHED_STATUSES = ("COMPLETE", "FAILED")
+
 
 ############### generate the initial avatar #################
 
-def generate(prompt, num_images):
-    """生成初始用户头像
-    在 generate_avatars() view 中被调用
-    返回 generation_id
-    """
-    url = "https://cloud.leonardo.ai/api/rest/v1/generations"
-    payload = {
+def _avatar_payload(prompt, num_images):
+    """头像生成的请求体，同步和异步版本共用"""
+    return {
         "alchemy": True,
         "height": 768,
-        "modelId": "b24e16ff-06e3-43eb-8d33-4416c2d75876",
+        "modelId": AVATAR_MODEL_ID,
         "num_images": num_images,
-        "presetStyle": "DYNAMIC",
+        "presetStyle": PRESET_STYLE,
         "prompt": prompt,
         "width": 1024
     }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": authorization
-    }
-    response = requests.post(url, json=payload, headers=headers, timeout=30)
+
+
+def _generation_status(response_dict):
+    return (response_dict.get('generations_by_pk') or {}).get('status', '')
+
+
+def _generated_images(response_dict):
+    """从 generations_by_pk 响应中取出图片的 url 和 id"""
+    generated_images = (response_dict.get('generations_by_pk') or {}).get('generated_images', [])
+    return [
+        {
+            'url': image_data['url'],
+            'id': image_data['id']
+        }
+        for image_data in generated_images
+    ]
+
+
+def generate(prompt, num_images):
+    """生成初始用户头像
+    在 generate_avatars() view 中被调用
+    返回 generation_id
+    """
+    payload = _avatar_payload(prompt, num_images)
+    response = get_client().post("generations", json=payload)
     response_dict = json.loads(response.text)
     generation_id = response_dict.get("sdGenerationJob", {}).get("generationId")
     return generation_id
@@ -45,36 +69,10 @@ def display_images(generation_id):
     在 display_generated_images() view 中被调用
     返回包含图片URL的列表
     """
-    url = f"https://cloud.leonardo.ai/api/rest/v1/generations/{generation_id}"
-    headers = {
-        "accept": "application/json",
-        "authorization": authorization
-    }
-    
-    # Poll for image generation completion (with timeout)
-    max_attempts = 12  # 1 minute maximum wait
-    for _ in range(max_attempts):
-        response = requests.get(url, headers=headers)
-        response_dict = json.loads(response.text)
-        
-        status = response_dict.get('generations_by_pk', {}).get('status', '')
-        if status == "COMPLETE":
-            # Get generated images
-            generated_images = response_dict.get('generations_by_pk', {}).get('generated_images', [])
-            # Return list of image data with URLs and IDs
-            return [
-                {
-                    'url': image_data['url'],
-                    'id': image_data['id']
-                }
-                for image_data in generated_images
-            ]
-        elif status == "FAILED":
-            return []
-            
-        time.sleep(5)  # Wait before checking again
-    
-    return []  # Return empty list if timeout
+    # Poll for image generation completion (1 minute maximum wait)
+    result = wait_for_generation(generation_id, timeout=60)
+    # Return list of image data with URLs and IDs, empty if failed or timed out
+    return result.images
 
 
 
@@ -87,18 +85,11 @@ def create_dataset(name):
     在 create_dataset_background() 中被调用
     返回 dataset_id
     """
-    url = "https://cloud.leonardo.ai/api/rest/v1/datasets"
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": authorization
-    }
-    
     payload = {
         "name": name
     }
     
-    response = requests.post(url, json=payload, headers=headers)
+    response = get_client().post("datasets", json=payload)
     print(f"Dataset creation response: {response.json()}")  # Debug log
     
     if response.status_code == 200 and 'insert_datasets_one' in response.json():
@@ -107,50 +98,65 @@ def create_dataset(name):
     return None
 
 
-def generate_with_image_id(seed_image_id, prompt, num_images):
-    """基于选定的头像生成其他场景图片"""
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": authorization
-    }
+def _seed_image_payload(seed_image_id, prompt, num_images):
+    """以头像为风格参考的生成请求体"""
+    payload = _avatar_payload(prompt, num_images)
+    payload["controlnets"] = [
+        {
+            "initImageId": seed_image_id,
+            "initImageType": "GENERATED",
+            "preprocessorId": 67, #Style Reference Id
+            "strengthType": "Low",
+        }
+    ]
+    return payload
 
-    url = "https://cloud.leonardo.ai/api/rest/v1/generations"
 
-    payload = {
-        "alchemy": True,
-        "height": 768,
-        "modelId": "b24e16ff-06e3-43eb-8d33-4416c2d75876",
-        "num_images": num_images,
-        "presetStyle": "DYNAMIC",
-        "prompt": prompt,
-        "width": 1024,
-        "controlnets": [
-            {
-                "initImageId": seed_image_id,
-                "initImageType": "GENERATED",
-                "preprocessorId": 67, #Style Reference Id
-                "strengthType": "Low",
-            }
-        ]
-    }
+def _generation_id_from_response(response_data):
+    """从 POST /generations 的响应中取出 generationId，格式不对时返回 None"""
+    logger.info(f"Generation response: {response_data}")  # 添加日志
+
+    if 'sdGenerationJob' not in response_data:
+        logger.error(f"Unexpected API response format: {response_data}")
+        return None
+
+    generation_id = response_data['sdGenerationJob'].get('generationId')
+    if not generation_id:
+        logger.error("No generationId in response")
+        return None
+
+    return generation_id
+
+
+def _generation_from_cache(payload):
+    """命中生成缓存时返回已有的 generation_id，否则返回 None"""
+    entry = generation_cache.lookup(payload)
+    if entry is None:
+        return None
+    if entry.status == 'COMPLETE':
+        # 预先放入结果缓存，随后的 wait_for_generation 不会再请求 API
+        _cache_generation_response(entry.generation_id, {
+            'generations_by_pk': {'status': 'COMPLETE', 'generated_images': entry.images}
+        })
+    return entry.generation_id
+
+
+def generate_with_image_id(seed_image_id, prompt, num_images, use_cache=True):
+    """基于选定的头像生成其他场景图片
+    use_cache=False 时跳过生成缓存，强制重新生成
+    """
+    payload = _seed_image_payload(seed_image_id, prompt, num_images)
+    use_cache = use_cache and generation_cache.enabled()
+    if use_cache and (cached_id := _generation_from_cache(payload)):
+        return cached_id
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_client().post("generations", json=payload)
         response.raise_for_status()  # 检查 HTTP 错误
         
-        response_data = response.json()
-        logger.info(f"Generation response: {response_data}")  # 添加日志
-        
-        if 'sdGenerationJob' not in response_data:
-            logger.error(f"Unexpected API response format: {response_data}")
-            return None
-            
-        generation_id = response_data['sdGenerationJob'].get('generationId')
-        if not generation_id:
-            logger.error("No generationId in response")
-            return None
-            
+        generation_id = _generation_id_from_response(response.json())
+        if generation_id and use_cache:
+            generation_cache.remember_submission(payload, generation_id)
         return generation_id
         
     except requests.exceptions.RequestException as e:
@@ -164,20 +170,136 @@ def generate_with_image_id(seed_image_id, prompt, num_images):
         return None
 
 
+@dataclass
+class GenerationResult:
+    """一次生成任务的最终结果，全部取自最后一次轮询的响应"""
+    generation_id: str
+    status: str  # COMPLETE / FAILED / TIMEOUT
+    images: list = field(default_factory=list)  # [{'url': ..., 'id': ...}]
+    started_at: float = 0.0  # 开始等待的时间（time.time()）
+    finished_at: float = 0.0
+    polls: int = 0  # 实际发出的 GET 次数，命中缓存时为 0
+
+    @property
+    def image_ids(self):
+        return [image['id'] for image in self.images]
+
+    @property
+    def urls(self):
+        return [image['url'] for image in self.images]
+
+    @property
+    def elapsed(self):
+        return self.finished_at - self.started_at
+
+    @property
+    def complete(self):
+        return self.status == "COMPLETE"
+
+
+# 已结束的 generation 响应在进程内缓存一小段时间，
+# 轮询结束后再查状态/图片ID不会重复请求同一个 URL
+GENERATION_RESULT_TTL = getattr(settings, 'GENERATION_RESULT_TTL', 120)
+_result_cache = {}
+_result_cache_lock = threading.Lock()
+
+
+def _cache_generation_response(generation_id, response_dict):
+    if _generation_status(response_dict) not in FINISHED_STATUSES:
+        return
+    now = time.monotonic()
+    with _result_cache_lock:
+        _result_cache[generation_id] = (now, response_dict)
+        if len(_result_cache) > 512:
+            for key, (cached_at, _) in list(_result_cache.items()):
+                if now - cached_at >= GENERATION_RESULT_TTL:
+                    del _result_cache[key]
+
+
+def _cached_generation_response(generation_id):
+    with _result_cache_lock:
+        entry = _result_cache.get(generation_id)
+        if entry is None:
+            return None
+        cached_at, response_dict = entry
+        if time.monotonic() - cached_at >= GENERATION_RESULT_TTL:
+            del _result_cache[generation_id]
+            return None
+        return response_dict
+
+
+def fetch_generation(generation_id):
+    """GET /generations/{id}，返回响应字典，请求失败返回 None
+    已结束的生成直接从缓存返回
+    """
+    cached = _cached_generation_response(generation_id)
+    if cached is not None:
+        return cached
+
+    response = get_client().get(f"generations/{generation_id}")
+    if response.status_code != 200:
+        return None
+    response_dict = response.json()
+    _cache_generation_response(generation_id, response_dict)
+    return response_dict
+
+
+def wait_for_generation(generation_id, model_id=AVATAR_MODEL_ID, preset_style=PRESET_STYLE, timeout=None,
+                        cancel=None):
+    """按自适应间隔轮询直到生成结束，返回 GenerationResult
+    状态、图片ID和URL都来自最后一次响应，之后无需再请求
+    超过截止时间时 status 为 'TIMEOUT'；任务被取消时 cancel（jobs.CancelToken）抛出的异常直接向上传播
+    """
+    started_at = time.time()
+    polls = 0
+
+    def fetch():
+        nonlocal polls
+        if _cached_generation_response(generation_id) is None:
+            polls += 1
+        return fetch_generation(generation_id) or {}
+
+    metrics.work_queue_depth.inc(queue="generation_wait")
+    try:
+        response_dict = generation_polling.poll(
+            fetch,
+            is_done=lambda d: _generation_status(d) in FINISHED_STATUSES,
+            key=generation_key(model_id, preset_style),
+            timeout=timeout,
+            # 直接命中缓存的不算一次真实耗时
+            record=lambda d: _generation_status(d) == "COMPLETE" and polls > 0,
+            cancel=cancel,
+        )
+    except PollTimeout:
+        logger.error(f"Timed out waiting for generation {generation_id}")
+        return GenerationResult(generation_id, "TIMEOUT", started_at=started_at,
+                                finished_at=time.time(), polls=polls)
+    finally:
+        metrics.work_queue_depth.dec(queue="generation_wait")
+
+    status = _generation_status(response_dict)
+    logger.info(f"Generation {generation_id} finished with status {status} after {polls} polls")
+    images = _generated_images(response_dict) if status == "COMPLETE" else []
+    if polls:
+        generation_cache.remember_result(generation_id, status, images)
+    return GenerationResult(
+        generation_id,
+        status,
+        images=images,
+        started_at=started_at,
+        finished_at=time.time(),
+        polls=polls,
+    )
+
+
 def check_generation_status(generation_id):
     """检查图片生成状态
     在 create_dataset_background() 中被调用
     返回状态（'COMPLETE'/'FAILED'等）
     """
-    url = f"https://cloud.leonardo.ai/api/rest/v1/generations/{generation_id}"
-    headers = {
-        "accept": "application/json",
-        "authorization": authorization
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        response_dict = response.json()
-        status = response_dict.get('generations_by_pk', {}).get('status', '')
+    response_dict = fetch_generation(generation_id)
+    if response_dict is not None:
+        status = _generation_status(response_dict)
         print(f"Current status for generation {generation_id}: {status}")
         return status
     return None
@@ -188,21 +310,9 @@ def get_generated_image_ids(generation_id):
     在 create_dataset_background() 中被调用
     返回 image_ids 列表
     """
-    url = f"https://cloud.leonardo.ai/api/rest/v1/generations/{generation_id}"
-    headers = {
-        "accept": "application/json",
-        "authorization": authorization
-    }
-    # Fetch the generated images
-    response = requests.get(url, headers=headers)
-    response_dict = response.json()
-    # Get the generated image IDs
-    generated_images = response_dict.get('generations_by_pk', {}).get('generated_images', [])
-    image_ids = []
-    for image_data in generated_images:
-        image_id = image_data['id']
-        image_ids.append(image_id)
-    return image_ids
+    # 轮询刚结束时直接读缓存，不再重复请求
+    response_dict = fetch_generation(generation_id) or {}
+    return [image['id'] for image in _generated_images(response_dict)]
 
 
 
@@ -211,20 +321,12 @@ def upload_image_to_dataset(dataset_id, image_id):
     在 create_dataset_background() 中被调用
     返回上传是否成功
     """
-    url = f"https://cloud.leonardo.ai/api/rest/v1/datasets/{dataset_id}/upload/gen"
-    
     payload = {
         "generatedImageId": image_id
     }
     
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": authorization
-    }
-    
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
+        response = get_client().post(f"datasets/{dataset_id}/upload/gen", json=payload)
         print(f"Upload response for image {image_id}: {response.text}")
         
         if response.status_code == 200:
@@ -239,31 +341,94 @@ def upload_image_to_dataset(dataset_id, image_id):
         return False
 
 
+@dataclass
+class UploadOutcome:
+    """单张图片上传到数据集的结果"""
+    image_id: str
+    success: bool
+    attempts: int
+    status_code: int = None
+    error: str = None
+
+
+# 把已经生成的图片加入数据集不扣费，重复上传也没有副作用，网关错误可以放心重试
+UPLOAD_RETRY_STATUSES = {500, 502, 503, 504}
+
+
+def _upload_with_retry(dataset_id, image_id, max_retries):
+    """LeonardoClient.request 只对 POST 重试 429 和带 Retry-After 的 503（见 should_retry），
+    其余 5xx 和连接错误在这里按指数退避重试；客户端已经重试过的响应不再重试，避免两层重试叠加
+    """
+    outcome = UploadOutcome(image_id, False, 0)
+    for attempt in range(max_retries + 1):
+        outcome.attempts = attempt + 1
+        try:
+            response = get_client().post(
+                f"datasets/{dataset_id}/upload/gen",
+                json={"generatedImageId": image_id}
+            )
+            outcome.status_code = response.status_code
+            if response.status_code == 200:
+                outcome.success = True
+                outcome.error = None
+                return outcome
+            outcome.error = response.text
+            if response.status_code not in UPLOAD_RETRY_STATUSES or should_retry('POST', response):
+                return outcome
+        except requests.exceptions.RequestException as e:
+            outcome.error = str(e)
+        if attempt < max_retries:
+            logger.warning(f"Upload of image {image_id} failed ({outcome.status_code}), retrying")
+            time.sleep(2 ** attempt)
+    return outcome
+
+
+def upload_images_to_dataset(dataset_id, image_ids, max_workers=None, max_retries=2):
+    """并发地把多张生成图片上传到数据集，每张图片单独重试
+    返回与 image_ids 顺序一致的 UploadOutcome 列表
+    """
+    image_ids = list(image_ids)
+    if not image_ids:
+        return []
+    max_workers = max_workers or getattr(settings, 'DATASET_UPLOAD_CONCURRENCY', 4)
+
+    def upload(image_id):
+        try:
+            return _upload_with_retry(dataset_id, image_id, max_retries)
+        finally:
+            metrics.work_queue_depth.dec(queue="dataset_upload")
+
+    metrics.work_queue_depth.inc(len(image_ids), queue="dataset_upload")
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(image_ids))) as executor:
+        outcomes = list(executor.map(upload, image_ids))
+
+    failed = [outcome.image_id for outcome in outcomes if not outcome.success]
+    logger.info(f"Uploaded {len(outcomes) - len(failed)}/{len(outcomes)} images to dataset {dataset_id}")
+    if failed:
+        logger.error(f"Failed to upload images {failed} to dataset {dataset_id}")
+    return outcomes
+
+
+def _dataset_images(response_dict):
+    """提取 datasets_by_pk 中每个图片的URL"""
+    images = response_dict.get('datasets_by_pk', {}).get('dataset_images', [])
+    image_urls = []
+    for image in images:
+        image_url = image.get('url')
+        if image_url:
+            image_urls.append({
+                'url': image_url,
+                'id': image.get('id')
+            })
+    return image_urls
+
+
 def display_all_images_in_dataset(dataset_id):
     """获取数据集中所有图片的URL"""
-    url = f"https://cloud.leonardo.ai/api/rest/v1/datasets/{dataset_id}"
-    
-    headers = {
-        "accept": "application/json",
-        "authorization": authorization
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
+        response = get_client().get(f"datasets/{dataset_id}")
         if response.status_code == 200:
-            dataset = response.json().get('datasets_by_pk', {})
-            images = dataset.get('dataset_images', [])
-            
-            # 提取每个图片的URL
-            image_urls = []
-            for image in images:
-                image_url = image.get('url')
-                if image_url:
-                    image_urls.append({
-                        'url': image_url,
-                        'id': image.get('id')
-                    })
-            
+            image_urls = _dataset_images(response.json())
             logger.info(f"Found {len(image_urls)} images in dataset {dataset_id}")
             return image_urls
             
@@ -294,8 +459,6 @@ def train_custom_model(dataset_id, describe_user, max_retries=3):
     
     logger.info(f"Dataset check passed: {dataset_status}")
 
-    url = "https://cloud.leonardo.ai/api/rest/v1/models"
-    
     # 简化模型名称，避免特殊字符
     model_name = f"custom_model_{int(time.time())}"
     
@@ -308,12 +471,6 @@ def train_custom_model(dataset_id, describe_user, max_retries=3):
         "nsfw": False,
     }
     
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": authorization
-    }
-    
     logger.info(f"Starting model training with payload: {json.dumps(payload, indent=2)}")
     
     for attempt in range(max_retries):
@@ -322,7 +479,7 @@ def train_custom_model(dataset_id, describe_user, max_retries=3):
             if attempt > 0:
                 time.sleep(15 * (attempt + 1))
             
-            response = requests.post(url, json=payload, headers=headers)
+            response = get_client().post("models", json=payload)
             logger.info(f"Attempt {attempt + 1}: Training response status code: {response.status_code}")
             logger.info(f"Training response body: {response.text}")
             
@@ -338,15 +495,12 @@ def train_custom_model(dataset_id, describe_user, max_retries=3):
                         'model_id': model_id,
                         'training_id': training_id
                     }
-            elif response.status_code == 500:
-                error_msg = response.json().get('error', 'Unknown error')
-                logger.warning(f"Server error on attempt {attempt + 1}: {error_msg}")
-                
-                # 如果是配额或限制相关的错误，立即返回
-                if 'quota' in error_msg.lower() or 'limit' in error_msg.lower():
-                    logger.error("API quota or limit reached")
-                    return None
-                    
+            elif response.status_code in (402, 429):
+                # 客户端已经按 Retry-After 重试过，仍被限流或额度不足时直接放弃
+                logger.error(f"API quota or rate limit reached (status {response.status_code})")
+                return None
+            elif response.status_code >= 500:
+                logger.warning(f"Server error on attempt {attempt + 1}: {response.text}")
                 continue
                 
         except Exception as e:
@@ -364,15 +518,8 @@ def get_model_status(model_id):
     用于检查模型是否训练完成
     返回模型状态
     """
-    url = f"https://cloud.leonardo.ai/api/rest/v1/models/{model_id}"
-    
-    headers = {
-        "accept": "application/json",
-        "authorization": authorization
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
+        response = get_client().get(f"models/{model_id}")
         if response.status_code == 200:
             model_info = response.json().get("custom_models_by_pk", {})
             status = model_info.get("status")
@@ -384,35 +531,32 @@ def get_model_status(model_id):
         return None
 
 
-def generate_with_custom_model(model_id, prompt, num_images=1):
+def generate_with_custom_model(model_id, prompt, num_images=1, use_cache=True):
     """使用训练好的模型生成图片
     在处理日记场景时使用
     返回 generation_id
     """
-    url = "https://cloud.leonardo.ai/api/rest/v1/generations"
-    
     payload = {
         "prompt": prompt,
         "modelId": model_id,
         "num_images": num_images,
         "width": 768,
         "height": 768,
-        "presetStyle": "DYNAMIC",
+        "presetStyle": PRESET_STYLE,
         "public": False
     }
-    
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "authorization": authorization
-    }
+    use_cache = use_cache and generation_cache.enabled()
+    if use_cache and (cached_id := _generation_from_cache(payload)):
+        return cached_id
     
     try:
         logger.info(f"Generating image with prompt: {prompt}")  # 添加日志
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_client().post("generations", json=payload)
         if response.status_code == 200:
             generation_id = response.json().get('sdGenerationJob', {}).get('generationId')
             logger.info(f"Successfully generated image with ID: {generation_id}")
+            if generation_id and use_cache:
+                generation_cache.remember_submission(payload, generation_id)
             return generation_id
         logger.error(f"Failed to generate image. Status code: {response.status_code}")
         return None
@@ -425,18 +569,8 @@ def generate_with_custom_model(model_id, prompt, num_images=1):
 
 def get_number_of_images_in_dataset(dataset_id):
 
-    # Define the URL, dynamically inserting the dataset_id
-    url = f"https://cloud.leonardo.ai/api/rest/v1/datasets/{dataset_id}"
-
-    # Define the headers, make sure to include authorization if required
-    headers = {
-    "accept": "application/json",
-    "content-type": "application/json",
-    "authorization": authorization
-    }
-
     # Make the GET request to retrieve the dataset
-    response = requests.get(url, headers=headers)
+    response = get_client().get(f"datasets/{dataset_id}")
 
     # Check if the request was successful
     if response.status_code == 200:
@@ -463,29 +597,18 @@ def format_json_response(response):
     return formatted_response
 
 
-def wait_for_image_generation(generation_id):
+def wait_for_image_generation(generation_id, timeout=None):
     """Wait for image generation to complete"""
-    while True:
-        status = check_generation_status(generation_id)
-        if status == "COMPLETE":
-            return True
-        elif status == "FAILED":
-            print(f"Image generation failed for ID: {generation_id}")
-            return False
-        time.sleep(5)  # Wait before checking again
+    if wait_for_generation(generation_id, timeout=timeout).complete:
+        return True
+    print(f"Image generation failed for ID: {generation_id}")
+    return False
 
 
 def check_dataset_status(dataset_id):
     """检查数据集状态"""
-    url = f"https://cloud.leonardo.ai/api/rest/v1/datasets/{dataset_id}"
-    
-    headers = {
-        "accept": "application/json",
-        "authorization": authorization
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
+        response = get_client().get(f"datasets/{dataset_id}")
         response_data = response.json()
         logger.info(f"Dataset status response: {json.dumps(response_data)}")
         
@@ -500,3 +623,171 @@ def check_dataset_status(dataset_id):
     except Exception as e:
         logger.error(f"Error checking dataset status: {str(e)}")
     return None
+
+
+################ async variants ##################
+# 供 ASGI 下的异步视图使用，等待期间不占用线程
+
+
+async def agenerate(prompt, num_images):
+    """generate() 的异步版本"""
+    response = await get_async_client().post("generations", json=_avatar_payload(prompt, num_images))
+    return response.json().get("sdGenerationJob", {}).get("generationId")
+
+
+async def adisplay_images(generation_id):
+    """display_images() 的异步版本"""
+    result = await await_generation(generation_id, timeout=60)
+    return result.images
+
+
+async def acreate_dataset(name):
+    """create_dataset() 的异步版本"""
+    response = await get_async_client().post("datasets", json={"name": name})
+    response_dict = response.json()
+    logger.info(f"Dataset creation response: {response_dict}")
+
+    if response.status_code == 200 and 'insert_datasets_one' in response_dict:
+        return response_dict['insert_datasets_one']['id']
+    return None
+
+
+async def agenerate_with_image_id(seed_image_id, prompt, num_images, use_cache=True):
+    """generate_with_image_id() 的异步版本"""
+    payload = _seed_image_payload(seed_image_id, prompt, num_images)
+    use_cache = use_cache and generation_cache.enabled()
+    if use_cache and (cached_id := await sync_to_async(_generation_from_cache)(payload)):
+        return cached_id
+    try:
+        response = await get_async_client().post("generations", json=payload)
+        response.raise_for_status()
+        generation_id = _generation_id_from_response(response.json())
+        if generation_id and use_cache:
+            await sync_to_async(generation_cache.remember_submission)(payload, generation_id)
+        return generation_id
+    except Exception as e:
+        logger.error(f"Error in agenerate_with_image_id: {str(e)}")
+        return None
+
+
+async def afetch_generation(generation_id):
+    """fetch_generation() 的异步版本，与同步版本共用结果缓存"""
+    cached = _cached_generation_response(generation_id)
+    if cached is not None:
+        return cached
+
+    response = await get_async_client().get(f"generations/{generation_id}")
+    if response.status_code != 200:
+        return None
+    response_dict = response.json()
+    _cache_generation_response(generation_id, response_dict)
+    return response_dict
+
+
+async def await_generation(generation_id, model_id=AVATAR_MODEL_ID, preset_style=PRESET_STYLE, timeout=None):
+    """wait_for_generation() 的异步版本"""
+    started_at = time.time()
+    polls = 0
+
+    async def fetch():
+        nonlocal polls
+        if _cached_generation_response(generation_id) is None:
+            polls += 1
+        return await afetch_generation(generation_id) or {}
+
+    metrics.work_queue_depth.inc(queue="generation_wait")
+    try:
+        response_dict = await generation_polling.apoll(
+            fetch,
+            is_done=lambda d: _generation_status(d) in FINISHED_STATUSES,
+            key=generation_key(model_id, preset_style),
+            timeout=timeout,
+            # 直接命中缓存的不算一次真实耗时
+            record=lambda d: _generation_status(d) == "COMPLETE" and polls > 0,
+        )
+    except PollTimeout:
+        logger.error(f"Timed out waiting for generation {generation_id}")
+        return GenerationResult(generation_id, "TIMEOUT", started_at=started_at,
+                                finished_at=time.time(), polls=polls)
+    finally:
+        metrics.work_queue_depth.dec(queue="generation_wait")
+
+    status = _generation_status(response_dict)
+    images = _generated_images(response_dict) if status == "COMPLETE" else []
+    if polls:
+        await sync_to_async(generation_cache.remember_result)(generation_id, status, images)
+    return GenerationResult(
+        generation_id,
+        status,
+        images=images,
+        started_at=started_at,
+        finished_at=time.time(),
+        polls=polls,
+    )
+
+
+async def acheck_generation_status(generation_id):
+    """check_generation_status() 的异步版本"""
+    response_dict = await afetch_generation(generation_id)
+    if response_dict is not None:
+        status = _generation_status(response_dict)
+        logger.info(f"Current status for generation {generation_id}: {status}")
+        return status
+    return None
+
+
+async def aupload_image_to_dataset(dataset_id, image_id):
+    """upload_image_to_dataset() 的异步版本"""
+    try:
+        response = await get_async_client().post(
+            f"datasets/{dataset_id}/upload/gen",
+            json={"generatedImageId": image_id}
+        )
+        if response.status_code == 200:
+            return True
+        logger.error(f"Failed to upload image {image_id}. Status code: {response.status_code}, {response.text}")
+        return False
+    except Exception as e:
+        logger.error(f"Error uploading image: {str(e)}")
+        return False
+
+
+async def adisplay_all_images_in_dataset(dataset_id):
+    """display_all_images_in_dataset() 的异步版本"""
+    try:
+        response = await get_async_client().get(f"datasets/{dataset_id}")
+        if response.status_code == 200:
+            return _dataset_images(response.json())
+    except Exception as e:
+        logger.error(f"Error getting dataset images: {str(e)}")
+    return []
+
+
+async def aget_model_status(model_id):
+    """get_model_status() 的异步版本"""
+    try:
+        response = await get_async_client().get(f"models/{model_id}")
+        if response.status_code == 200:
+            status = response.json().get("custom_models_by_pk", {}).get("status")
+            logger.info(f"Model {model_id} status: {status}")
+            return status
+        return None
+    except Exception as e:
+        logger.error(f"Error checking model status: {str(e)}")
+        return None
+
+
+async def acheck_dataset_status(dataset_id):
+    """check_dataset_status() 的异步版本"""
+    try:
+        response = await get_async_client().get(f"datasets/{dataset_id}")
+        response_data = response.json()
+        if response.status_code == 200 and 'datasets_by_pk' in response_data:
+            image_count = len(response_data['datasets_by_pk'].get('dataset_images', []))
+            return {
+                'status': 'ready',
+                'image_count': image_count
+            }
+    except Exception as e:
+        logger.error(f"Error checking dataset status: {str(e)}")
+    return None
@@ -0,0 +1,344 @@
+"""
+基于数据库的任务队列，替代在 web 进程里直接起 threading.Thread。
+- 视图只调用 enqueue() 写入一行 Job 后立即返回
+- manage.py run_workers 用 claim() 领取任务，在线程池中执行 run()
+- 任务类型通过 @register("job_type") 注册，处理函数接收 Job（参数在 job.payload 中）
+- 用户可以通过 cancel() 取消任务；处理函数用 CancelToken 在场景之间、轮询之间检查取消和截止时间
+- 由其他循环推进的任务（如训练状态由 TrainingScheduler 检查）用 external() 建成 WAITING 状态，
+  worker 不会领取，只用来承载进度，结束时调用 finish()
+任务在数据库里持久化，重启后仍在；领取时加行锁 + 比较并交换，多个 worker 进程不会重复执行。
+"""
+
+import os
+import time
+import socket
+import logging
+import threading
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from . import metrics
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+job_duration = metrics.histogram("job_duration_seconds", "Time spent running each job attempt", ("job_type",))
+job_runs = metrics.counter("job_runs_total", "Job attempts by outcome", ("job_type", "outcome"))
+
+
+class Reschedule(Exception):
+    """处理函数抛出此异常表示“还没完成，delay 秒后再执行一次”，不计入失败次数
+    用于训练状态这类需要长时间等待的任务，等待期间不占用 worker
+    """
+
+    def __init__(self, delay, payload=None):
+        super().__init__(f"rescheduled in {delay:.0f}s")
+        self.delay = delay
+        self.payload = payload
+
+
+class Incomplete(Exception):
+    """处理函数抛出此异常表示部分步骤没有完成（如有图片没上传）
+    和其他失败一样按 JOB_RETRY_BACKOFF 重新排队，重新执行时从检查点继续，用完 max_attempts 后标记为 FAILED
+    """
+
+
+class JobCancelled(Exception):
+    """任务被用户取消，处理函数不应捕获后继续执行"""
+
+
+class DeadlineExceeded(JobCancelled):
+    """任务超过了截止时间"""
+
+
+class CancelToken:
+    """处理函数协作式检查取消的凭据
+    check() 在取消或超过截止时间时抛出异常；取消标记从数据库读取，最多每 JOB_CANCEL_CHECK_INTERVAL 秒读一次，
+    多个线程共用一个 token。job_id 为 None 时只检查截止时间（直接调用后台函数时使用）
+    """
+
+    def __init__(self, job_id=None, deadline=None, check_interval=None):
+        self.job_id = job_id
+        self.deadline = deadline
+        self.check_interval = check_interval or getattr(settings, 'JOB_CANCEL_CHECK_INTERVAL', 2)
+        self._cancelled = threading.Event()
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_job(cls, job):
+        return cls(job.id, job.deadline)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        if self._cancelled.is_set():
+            return True
+        if self.job_id is None:
+            return False
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._checked_at = time.monotonic()
+                if Job.objects.filter(id=self.job_id, cancel_requested_at__isnull=False).exists():
+                    self._cancelled.set()
+        return self._cancelled.is_set()
+
+    def remaining(self):
+        """距截止时间的秒数，没有截止时间时返回 None"""
+        if self.deadline is None:
+            return None
+        return (self.deadline - timezone.now()).total_seconds()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Job {self.job_id} passed its deadline")
+
+    def sleep(self, seconds):
+        """分段睡眠，期间每 check_interval 秒检查一次，取消后最多延迟这么久就抛出异常"""
+        end = time.monotonic() + seconds
+        while True:
+            self.check()
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            self._cancelled.wait(min(remaining, self.check_interval))
+
+
+def register(job_type, max_attempts=1, timeout=None):
+    """注册任务处理函数
+    timeout 是任务从第一次开始执行算起的最长时间（秒），重试不重新计时，默认 JOB_TIMEOUT
+    """
+    def decorator(func):
+        _handlers[job_type] = (func, max_attempts, timeout)
+        return func
+    return decorator
+
+
+def handler_for(job_type):
+    return _handlers[job_type][0]
+
+
+def enqueue(job_type, payload=None, delay=0):
+    """把任务写入队列，返回 Job"""
+    if job_type not in _handlers:
+        raise ValueError(f"Unknown job type: {job_type}")
+    job = Job.objects.create(
+        job_type=job_type,
+        payload=payload or {},
+        max_attempts=_handlers[job_type][1],
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+    logger.info(f"Enqueued job {job.id} ({job_type})")
+    return job
+
+
+def external(job_type, payload=None):
+    """创建一个由外部循环推进的任务，不需要注册处理函数"""
+    job = Job.objects.create(job_type=job_type, payload=payload or {}, state='WAITING')
+    logger.info(f"Created job {job.id} ({job_type}), waiting on an external scheduler")
+    return job
+
+
+def cancel(job_id):
+    """请求取消任务
+    还在排队或等待外部调度的任务直接标记为 CANCELLED，返回 'CANCELLED'；
+    正在运行的任务由处理函数在下一次 check() 时结束，返回 'RUNNING'；任务不存在或已结束时返回 None
+    """
+    now = timezone.now()
+    requested = Job.objects.filter(
+        id=job_id, state__in=['QUEUED', 'RUNNING', 'WAITING'], cancel_requested_at__isnull=True,
+    ).update(cancel_requested_at=now)
+    if not requested:
+        return None
+    logger.info(f"Cancellation requested for job {job_id}")
+    if Job.objects.filter(id=job_id, state__in=['QUEUED', 'WAITING']).update(
+        state='CANCELLED', error='Cancelled before it ran', finished_at=now,
+    ):
+        return 'CANCELLED'
+    return 'RUNNING'
+
+
+def finish(job_id, state, result=None, error=''):
+    """结束一个 WAITING 任务，已经结束的任务不受影响"""
+    return Job.objects.filter(id=job_id, state='WAITING').update(
+        state=state,
+        result=result,
+        error=error,
+        finished_at=timezone.now(),
+    )
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(worker, limit=1):
+    """领取最多 limit 个到期的 QUEUED 任务，标记为 RUNNING 并返回
+    支持的数据库上用 SELECT ... FOR UPDATE SKIP LOCKED 避免 worker 之间互相阻塞；
+    之后再用带状态条件的 UPDATE 做一次比较并交换，SQLite 等不支持行锁的数据库也不会重复领取
+    """
+    now = timezone.now()
+    claimed = []
+    with transaction.atomic():
+        candidates = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(state='QUEUED', run_after__lte=now)
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        for job_id in candidates:
+            updated = Job.objects.filter(id=job_id, state='QUEUED').update(
+                state='RUNNING',
+                locked_by=worker,
+                locked_at=now,
+                attempts=F('attempts') + 1,
+            )
+            if updated:
+                claimed.append(job_id)
+    return list(Job.objects.filter(id__in=claimed).order_by('run_after', 'id'))
+
+
+def run(job):
+    """执行一个已领取的任务并记录结果；失败时按退避重新排队，直到用完 max_attempts"""
+    try:
+        func = handler_for(job.job_type)
+    except KeyError:
+        _finish(job, 'FAILED', error=f"Unknown job type: {job.job_type}")
+        return
+
+    if job.cancel_requested_at is not None:
+        _finish(job, 'CANCELLED', error='Cancelled before it ran')
+        return
+    if job.deadline is None:
+        # 截止时间从第一次执行开始算，重试沿用同一个截止时间
+        timeout = _handlers[job.job_type][2] or getattr(settings, 'JOB_TIMEOUT', 1800)
+        job.deadline = timezone.now() + timedelta(seconds=timeout)
+        Job.objects.filter(id=job.id).update(deadline=job.deadline)
+
+    logger.info(f"Running job {job.id} ({job.job_type}), attempt {job.attempts}/{job.max_attempts}")
+    started_at = time.perf_counter()
+    outcome = 'succeeded'
+    try:
+        result = func(job)
+    except DeadlineExceeded as e:
+        outcome = 'deadline_exceeded'
+        logger.error(f"Job {job.id} ({job.job_type}) passed its deadline")
+        _finish(job, 'FAILED', error=str(e))
+        return
+    except JobCancelled as e:
+        outcome = 'cancelled'
+        _finish(job, 'CANCELLED', error=str(e))
+        return
+    except Reschedule as e:
+        outcome = 'rescheduled'
+        Job.objects.filter(id=job.id, locked_by=job.locked_by).update(
+            state='QUEUED',
+            payload=job.payload if e.payload is None else e.payload,
+            attempts=F('attempts') - 1,
+            run_after=timezone.now() + timedelta(seconds=e.delay),
+            locked_by=None,
+            locked_at=None,
+        )
+        return
+    except Exception as e:
+        outcome = 'failed'
+        logger.error(f"Job {job.id} ({job.job_type}) failed: {str(e)}")
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            backoff = getattr(settings, 'JOB_RETRY_BACKOFF', 30) * 2 ** (job.attempts - 1)
+            Job.objects.filter(id=job.id, locked_by=job.locked_by).update(
+                state='QUEUED',
+                error=error,
+                run_after=timezone.now() + timedelta(seconds=backoff),
+                locked_by=None,
+                locked_at=None,
+            )
+        else:
+            _finish(job, 'FAILED', error=error)
+        return
+    finally:
+        job_duration.observe(time.perf_counter() - started_at, job_type=job.job_type)
+        job_runs.inc(job_type=job.job_type, outcome=outcome)
+
+    _finish(job, 'SUCCEEDED', result=result)
+
+
+def _finish(job, state, result=None, error=''):
+    Job.objects.filter(id=job.id).update(
+        state=state,
+        result=result,
+        error=error,
+        finished_at=timezone.now(),
+        locked_by=None,
+        locked_at=None,
+    )
+    logger.info(f"Job {job.id} ({job.job_type}) {state.lower()}")
+
+
+def _requeue(stale, error):
+    """把一批 RUNNING 任务放回队列，用完重试次数的标记为 FAILED；处理函数重新执行时从检查点继续"""
+    requeued = stale.filter(attempts__lt=F('max_attempts')).update(
+        state='QUEUED', locked_by=None, locked_at=None, run_after=timezone.now()
+    )
+    failed = stale.update(
+        state='FAILED', error=error, finished_at=timezone.now(),
+        locked_by=None, locked_at=None,
+    )
+    return requeued, failed
+
+
+def requeue_stale(timeout=None):
+    """把锁定超过 timeout 秒仍在 RUNNING 的任务放回队列（worker 崩溃或被杀掉的情况）"""
+    timeout = timeout or getattr(settings, 'JOB_LOCK_TIMEOUT', 3600)
+    stale_before = timezone.now() - timedelta(seconds=timeout)
+    stale = Job.objects.filter(state='RUNNING', locked_at__lt=stale_before)
+    requeued, failed = _requeue(stale, 'Worker lost while running job')
+    if requeued or failed:
+        logger.warning(f"Requeued {requeued} stale jobs, failed {failed} that ran out of attempts")
+    return requeued
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover_orphans(worker):
+    """worker 启动时立即收回本机上已退出的进程留下的 RUNNING 任务，不必等 JOB_LOCK_TIMEOUT
+    容器重启后 PID 可能与之前相同，锁在自己 PID 上的任务在启动时也一定是遗留的
+    """
+    host, _, own_pid = worker.rpartition(':')
+    orphaned = []
+    for job_id, locked_by in Job.objects.filter(state='RUNNING', locked_by__startswith=f"{host}:").values_list('id', 'locked_by'):
+        pid = locked_by.rpartition(':')[2]
+        if not pid.isdigit() or pid == own_pid or not _process_alive(int(pid)):
+            orphaned.append(job_id)
+    if not orphaned:
+        return 0
+    requeued, failed = _requeue(Job.objects.filter(id__in=orphaned, state='RUNNING'), 'Worker exited while running job')
+    logger.warning(f"Recovered {requeued} jobs left by exited workers on {host}, failed {failed}")
+    return requeued
+
+
+def queue_depths():
+    counts = Job.objects.filter(state__in=['QUEUED', 'RUNNING', 'WAITING']).values_list('state').annotate(n=Count('id'))
+    return {(state,): n for state, n in counts}
+
+
+metrics.gauge_function("job_queue_depth", "Queued, running and externally driven persistent jobs", queue_depths, labels=("state",))
@@ -0,0 +1,236 @@
+import os
+import time
+import asyncio
+import threading
+import weakref
+import logging
+import functools
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from . import metrics
+from .ratelimit import get_limiter, parse_retry_after
+
+
+logger = logging.getLogger(__name__)
+
+LEONARDO_API_BASE = "https://cloud.leonardo.ai/api/rest/v1"
+
+# GET 没有副作用，遇到这些状态码都可以重试
+RETRY_STATUSES = {429, 502, 503, 504}
+# 这些状态码说明上游过载，需要收紧并发
+OVERLOAD_STATUSES = {429, 500, 502, 503, 504}
+
+
+def should_retry(method, response):
+    """是否重试这次响应
+    POST（生成、训练会扣费）只在确定没有被处理时重试：429，或带 Retry-After 的 503；
+    502/504 是网关超时，上游可能已经开始处理，重试可能重复生成、重复训练
+    """
+    if method.upper() == 'GET':
+        return response.status_code in RETRY_STATUSES
+    return response.status_code == 429 or (response.status_code == 503 and 'Retry-After' in response.headers)
+
+
+class LeonardoClient:
+    """Leonardo REST API 的共享客户端
+    持有一个带连接池和 keep-alive 的 requests.Session，
+    所有请求共用同一组 headers 和默认超时。
+    urllib3 的连接池是线程安全的，且我们不修改 session 状态，
+    因此同一个实例可以被多个后台线程同时使用。
+    每个请求都要先经过 limiter（令牌桶 + AIMD 并发上限），
+    可以安全重试的响应（见 should_retry）按 Retry-After 或指数退避自动重试。
+    """
+
+    def __init__(self, api_key=None, base_url=LEONARDO_API_BASE, pool_size=10, timeout=30,
+                 limiter=None, max_retries=3, backoff=1):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.limiter = limiter or get_limiter()
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "accept": "application/json",
+            "authorization": "Bearer %s" % api_key,
+        })
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        operation = metrics.leonardo_operation(method, path)
+        for attempt in range(self.max_retries + 1):
+            with self.limiter.slot() as slot:
+                try:
+                    with metrics.track("leonardo", operation) as call:
+                        response = self.session.request(method, self.url(path), **kwargs)
+                        call.status(response.status_code)
+                except requests.exceptions.Timeout:
+                    slot.overloaded()
+                    raise
+                if response.status_code in OVERLOAD_STATUSES:
+                    slot.overloaded(parse_retry_after(response.headers.get('Retry-After')))
+
+            if not should_retry(method, response) or attempt == self.max_retries:
+                return response
+            logger.warning(f"{method} {path} returned {response.status_code}, retrying ({attempt + 1}/{self.max_retries})")
+            # 有 Retry-After 时令牌桶已经暂停发放，下一次 slot() 会自动等待
+            if not slot.retry_after:
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        # requests 会为 json= 自动加上 content-type: application/json
+        return self.request("POST", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """返回当前进程共享的 LeonardoClient
+    fork 出来的 worker 会重新创建自己的 client，避免共用父进程的 socket
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = LeonardoClient(
+                    api_key=os.getenv("LEONARDO_API_KEY"),
+                    base_url=getattr(settings, 'LEONARDO_API_BASE', LEONARDO_API_BASE),
+                    pool_size=getattr(settings, 'LEONARDO_POOL_SIZE', 10),
+                    timeout=getattr(settings, 'LEONARDO_TIMEOUT', 30),
+                    max_retries=getattr(settings, 'LEONARDO_MAX_RETRIES', 3),
+                )
+                _client_pid = pid
+                logger.info(f"Created Leonardo client with pool size {_client.pool_size}")
+    return _client
+
+
+class AsyncLeonardoClient:
+    """LeonardoClient 的 asyncio 版本，基于 httpx.AsyncClient
+    等待中的请求只占用一个协程而不是一个线程，
+    因此一个 ASGI worker 可以同时挂起上百个生成任务。
+    """
+
+    def __init__(self, api_key=None, base_url=LEONARDO_API_BASE, pool_size=100, timeout=30,
+                 limiter=None, max_retries=3, backoff=1):
+        import httpx
+
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.limiter = limiter or get_limiter()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = httpx.AsyncClient(
+            headers={
+                "accept": "application/json",
+                "authorization": "Bearer %s" % api_key,
+            },
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=timeout,
+        )
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def request(self, method, path, **kwargs):
+        import httpx
+
+        operation = metrics.leonardo_operation(method, path)
+        for attempt in range(self.max_retries + 1):
+            async with self.limiter.aslot() as slot:
+                try:
+                    with metrics.track("leonardo", operation) as call:
+                        response = await self.session.request(method, self.url(path), **kwargs)
+                        call.status(response.status_code)
+                except httpx.TimeoutException:
+                    slot.overloaded()
+                    raise
+                if response.status_code in OVERLOAD_STATUSES:
+                    slot.overloaded(parse_retry_after(response.headers.get('Retry-After')))
+
+            if not should_retry(method, response) or attempt == self.max_retries:
+                return response
+            logger.warning(f"{method} {path} returned {response.status_code}, retrying ({attempt + 1}/{self.max_retries})")
+            if not slot.retry_after:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def aclose(self):
+        await self.session.aclose()
+
+
+def reset_client():
+    """丢弃当前进程的共享 client，下次 get_client() 按最新的 settings 重建（基准测试中使用）"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+
+# httpx.AsyncClient 绑定在创建它的事件循环上，所以按循环分别缓存；
+# WSGI 下每个异步视图都有自己的事件循环，视图结束时由 closes_async_client 关闭
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """返回当前事件循环共享的 AsyncLeonardoClient"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncLeonardoClient(
+            api_key=os.getenv("LEONARDO_API_KEY"),
+            base_url=getattr(settings, 'LEONARDO_API_BASE', LEONARDO_API_BASE),
+            pool_size=getattr(settings, 'LEONARDO_ASYNC_POOL_SIZE', 100),
+            timeout=getattr(settings, 'LEONARDO_TIMEOUT', 30),
+            max_retries=getattr(settings, 'LEONARDO_MAX_RETRIES', 3),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def aclose_async_client():
+    """关闭当前事件循环的 AsyncLeonardoClient（如果有）"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def closes_async_client(view):
+    """异步视图的装饰器
+    WSGI 下 Django 为每个异步视图新建一个事件循环，请求结束后循环就被丢弃，client 不会再被复用：
+    视图返回前关闭它，释放连接。ASGI 下事件循环长期存在，client 继续在请求之间复用
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        finally:
+            if not isinstance(request, ASGIRequest):
+                await aclose_async_client()
+    return wrapper
@@ -0,0 +1,261 @@
+"""
+本地的 Leonardo API 替身，用于在没有 API key / 网络的情况下做压测和调试。
+实现了 image_generation.py 用到的接口，返回与真实 API 相同结构的 JSON：
+- POST /generations, GET /generations/{id}
+- POST /datasets, GET /datasets/{id}, POST /datasets/{id}/upload/gen
+- POST /models, GET /models/{id}
+- GET /me
+生成/训练耗时服从对数正态分布，可以按比例注入 429 和 500。
+用法: python manage.py leonardo_standin --port 8787
+然后设置 LEONARDO_API_BASE=http://127.0.0.1:8787/api/rest/v1
+"""
+
+import re
+import json
+import math
+import time
+import uuid
+import random
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/api/rest/v1"
+
+# 1x1 的灰色 PNG，作为所有生成图片的内容
+PLACEHOLDER_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108000000003a7e9b55"
+    "0000000a49444154789c636800000082008177cd72b60000000049454e44ae426082"
+)
+
+
+@dataclass
+class StandinConfig:
+    generation_latency: float = 8.0  # 生成耗时的中位数（秒）
+    training_latency: float = 60.0  # 训练耗时的中位数（秒）
+    latency_sigma: float = 0.3  # 对数正态分布的 sigma，0 表示固定耗时
+    rate_429: float = 0.0  # 返回 429 的请求比例
+    rate_500: float = 0.0  # 返回 500 的请求比例
+    retry_after: float = 1.0  # 429 响应中的 Retry-After（秒）
+    images_per_generation: int = None  # 为 None 时按请求中的 num_images
+    seed: int = None
+
+    def sample_latency(self, rng, median):
+        if self.latency_sigma <= 0:
+            return median
+        return rng.lognormvariate(math.log(median), self.latency_sigma)
+
+
+class StandinState:
+    """所有内存中的生成任务、数据集和模型，以及每个接口的调用次数"""
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.generations = {}
+        self.datasets = {}
+        self.models = {}
+        self.calls = Counter()
+
+    def new_id(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128)))
+
+    def image_url(self, base_url, image_id):
+        return f"{base_url}/images/{image_id}.png"
+
+
+def _iso(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None  # 由 make_server 绑定
+
+    # (method, pattern, handler name, endpoint label)
+    routes = [
+        ("POST", r"/generations", "create_generation", "POST /generations"),
+        ("GET", r"/generations/(?P<id>[^/]+)", "get_generation", "GET /generations/{id}"),
+        ("POST", r"/datasets", "create_dataset", "POST /datasets"),
+        ("GET", r"/datasets/(?P<id>[^/]+)", "get_dataset", "GET /datasets/{id}"),
+        ("POST", r"/datasets/(?P<id>[^/]+)/upload/gen", "upload_generated", "POST /datasets/{id}/upload/gen"),
+        ("POST", r"/models", "create_model", "POST /models"),
+        ("GET", r"/models/(?P<id>[^/]+)", "get_model", "GET /models/{id}"),
+        ("GET", r"/me", "me", "GET /me"),
+    ]
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def do_GET(self):
+        if self.path.startswith("/images/"):
+            return self._send_bytes(PLACEHOLDER_PNG, "image/png")
+        if self.path == "/__stats":
+            with self.state.lock:
+                return self._send_json(dict(self.state.calls))
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        path = self.path.split("?", 1)[0]
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+        length = int(self.headers.get("content-length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+        for route_method, pattern, handler, label in self.routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                with self.state.lock:
+                    self.state.calls[label] += 1
+                    roll = self.state.rng.random()
+                config = self.state.config
+                if roll < config.rate_429:
+                    return self._send_json({"error": "Too many requests"}, 429,
+                                           {"Retry-After": f"{config.retry_after:g}"})
+                if roll < config.rate_429 + config.rate_500:
+                    return self._send_json({"error": "Internal server error"}, 500)
+                status, payload = getattr(self, handler)(body, **match.groupdict())
+                return self._send_json(payload, status)
+
+        self._send_json({"error": f"Unknown endpoint {method} {path}"}, 404)
+
+    def _send_bytes(self, data, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header("content-type", content_type)
+        self.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, payload, status=200, headers=None):
+        self._send_bytes(json.dumps(payload).encode(), "application/json", status, headers)
+
+    ############ generations ############
+
+    def create_generation(self, body):
+        state = self.state
+        with state.lock:
+            generation_id = state.new_id()
+            num_images = state.config.images_per_generation or body.get("num_images", 1)
+            now = time.time()
+            state.generations[generation_id] = {
+                "created": now,
+                "ready_at": now + state.config.sample_latency(state.rng, state.config.generation_latency),
+                "prompt": body.get("prompt", ""),
+                "modelId": body.get("modelId"),
+                "image_ids": [state.new_id() for _ in range(num_images)],
+            }
+        return 200, {"sdGenerationJob": {"generationId": generation_id, "apiCreditCost": 8}}
+
+    def get_generation(self, body, id):
+        with self.state.lock:
+            generation = self.state.generations.get(id)
+        if generation is None:
+            return 200, {"generations_by_pk": None}
+        complete = time.time() >= generation["ready_at"]
+        return 200, {"generations_by_pk": {
+            "id": id,
+            "status": "COMPLETE" if complete else "PENDING",
+            "prompt": generation["prompt"],
+            "modelId": generation["modelId"],
+            "createdAt": _iso(generation["created"]),
+            "generated_images": [
+                {"id": image_id, "url": self.state.image_url(self.base_url, image_id), "nsfw": False}
+                for image_id in generation["image_ids"]
+            ] if complete else [],
+        }}
+
+    ############ datasets ############
+
+    def create_dataset(self, body):
+        with self.state.lock:
+            dataset_id = self.state.new_id()
+            self.state.datasets[dataset_id] = {"name": body.get("name", ""), "images": []}
+        return 200, {"insert_datasets_one": {"id": dataset_id}}
+
+    def get_dataset(self, body, id):
+        with self.state.lock:
+            dataset = self.state.datasets.get(id)
+            images = list(dataset["images"]) if dataset else []
+        if dataset is None:
+            return 200, {"datasets_by_pk": None}
+        return 200, {"datasets_by_pk": {
+            "id": id,
+            "name": dataset["name"],
+            "dataset_images": [
+                {"id": image_id, "url": self.state.image_url(self.base_url, image_id), "createdAt": _iso(created)}
+                for image_id, created in images
+            ],
+        }}
+
+    def upload_generated(self, body, id):
+        with self.state.lock:
+            dataset = self.state.datasets.get(id)
+            if dataset is None:
+                return 404, {"error": "dataset not found"}
+            image_id = self.state.new_id()
+            dataset["images"].append((image_id, time.time()))
+        return 200, {"uploadDatasetImageFromGen": {"id": image_id}}
+
+    ############ models ############
+
+    def create_model(self, body):
+        state = self.state
+        with state.lock:
+            if body.get("datasetId") not in state.datasets:
+                return 500, {"error": "dataset not found"}
+            model_id = state.new_id()
+            state.models[model_id] = {
+                "name": body.get("name", ""),
+                "ready_at": time.time() + state.config.sample_latency(state.rng, state.config.training_latency),
+            }
+            training_id = state.new_id()
+        return 200, {"sdTrainingJob": {"customModelId": model_id, "id": training_id, "apiCreditCost": 500}}
+
+    def get_model(self, body, id):
+        with self.state.lock:
+            model = self.state.models.get(id)
+        if model is None:
+            return 200, {"custom_models_by_pk": None}
+        status = "COMPLETE" if time.time() >= model["ready_at"] else "PENDING"
+        return 200, {"custom_models_by_pk": {"id": id, "name": model["name"], "status": status}}
+
+    def me(self, body):
+        return 200, {"user_details": [{
+            "user": {"id": "standin-user", "username": "standin"},
+            "apiConcurrencySlots": 10,
+            "apiSubscriptionTokens": 100000,
+        }]}
+
+
+def make_server(host="127.0.0.1", port=8787, config=None):
+    """创建（但不启动）替身服务器，port=0 时由系统分配端口"""
+    state = StandinState(config or StandinConfig())
+    handler = type("BoundStandinHandler", (StandinHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    return server
+
+
+def start_in_thread(host="127.0.0.1", port=0, config=None):
+    """在后台线程中启动替身服务器，返回 (server, base_url)，用于基准测试"""
+    server = make_server(host, port, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}{API_PREFIX}"
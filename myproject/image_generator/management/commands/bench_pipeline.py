@@ -0,0 +1,98 @@
+import sys
+import json
+import time
+import logging
+import platform
+from contextlib import redirect_stdout
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from image_generator import prompt_generation
+from image_generator.leonardo_client import reset_client
+from image_generator.leonardo_standin import StandinConfig, start_in_thread
+from image_generator.benchmarks.runner import run_stage, compare, load_results
+from image_generator.benchmarks.stages import BenchEnv, StandinGeminiModel, default_stages
+
+
+class Command(BaseCommand):
+    help = "Benchmark each stage of the diary pipeline against local stand-ins and emit JSON results"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stages', help='Comma-separated stage names (default: all)')
+        parser.add_argument('--iterations', type=int, help='Override the iteration count of every stage')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--baseline', help='Previous results to compare against; regressions fail the command')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed p95 slowdown relative to the baseline (default 0.2 = 20%%)')
+        parser.add_argument('--generation-latency', type=float, default=0.5,
+                            help='Median stand-in generation latency in seconds')
+        parser.add_argument('--gemini-latency', type=float, default=0.0,
+                            help='Stand-in Gemini latency in seconds')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # 应用在 INFO 级别日志很多，会干扰计时
+        if options['verbosity'] < 2:
+            logging.disable(logging.INFO)
+
+        standin, base_url = start_in_thread(config=StandinConfig(
+            generation_latency=options['generation_latency'],
+            seed=options['seed'],
+        ))
+        env = BenchEnv(standin, StandinGeminiModel(latency=options['gemini_latency']))
+
+        stages = default_stages(env)
+        if options['stages']:
+            wanted = options['stages'].split(',')
+            unknown = set(wanted) - {stage.name for stage in stages}
+            if unknown:
+                raise CommandError(f"Unknown stages: {', '.join(sorted(unknown))}")
+            stages = [stage for stage in stages if stage.name in wanted]
+
+        # 在独立的测试数据库里运行，不污染正式数据
+        old_db_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        original_model = prompt_generation._model
+        prompt_generation._model = lambda: env.gemini
+        try:
+            # 应用代码里的 print() 调试输出不能混进 stdout 上的 JSON
+            with override_settings(LEONARDO_API_BASE=base_url, GENERATION_CACHE_ENABLED=False), \
+                    redirect_stdout(sys.stderr):
+                reset_client()
+                results = {
+                    stage.name: run_stage(stage, env, options['iterations']).to_dict()
+                    for stage in stages
+                }
+        finally:
+            prompt_generation._model = original_model
+            reset_client()
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            standin.shutdown()
+            logging.disable(logging.NOTSET)
+
+        report = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'python': platform.python_version(),
+                'generation_latency_s': options['generation_latency'],
+                'gemini_latency_s': options['gemini_latency'],
+                'leonardo_rate_limit': getattr(settings, 'LEONARDO_RATE_LIMIT', None),
+            },
+            'stages': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            regressions = compare(report, load_results(options['baseline']), options['tolerance'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(regression)
+                raise CommandError(f"{len(regressions)} benchmark regression(s) against {options['baseline']}")
+            self.stderr.write(self.style.SUCCESS("No regressions against baseline"))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from image_generator.leonardo_standin import StandinConfig, make_server, API_PREFIX
+
+
+class Command(BaseCommand):
+    help = "Run a local stand-in for the Leonardo REST API with configurable latency and failures"
+
+    # 替身服务器不依赖项目的其余部分，跳过系统检查
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8787)
+        parser.add_argument('--generation-latency', type=float, default=8.0,
+                            help='Median seconds until a generation is COMPLETE')
+        parser.add_argument('--training-latency', type=float, default=60.0,
+                            help='Median seconds until a custom model is COMPLETE')
+        parser.add_argument('--latency-sigma', type=float, default=0.3,
+                            help='Log-normal sigma of the latencies (0 = fixed)')
+        parser.add_argument('--rate-429', type=float, default=0.0, help='Fraction of requests answered with 429')
+        parser.add_argument('--rate-500', type=float, default=0.0, help='Fraction of requests answered with 500')
+        parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds on 429')
+        parser.add_argument('--images', type=int, default=None,
+                            help='Images per generation (default: the requested num_images)')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        config = StandinConfig(
+            generation_latency=options['generation_latency'],
+            training_latency=options['training_latency'],
+            latency_sigma=options['latency_sigma'],
+            rate_429=options['rate_429'],
+            rate_500=options['rate_500'],
+            retry_after=options['retry_after'],
+            images_per_generation=options['images'],
+            seed=options['seed'],
+        )
+        server = make_server(options['host'], options['port'], config)
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(
+            f"Leonardo stand-in listening; set LEONARDO_API_BASE=http://{host}:{port}{API_PREFIX}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,87 @@
+import time
+import signal
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from image_generator import jobs, ocr_cache
+from image_generator.training_scheduler import TrainingScheduler
+# 导入 views 以注册各个任务类型的处理函数
+from image_generator import views  # noqa: F401
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Claim queued jobs from the database and run them on a thread pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Jobs run concurrently (default: JOB_WORKERS)')
+        parser.add_argument('--poll-interval', type=float, help='Seconds between polls of an empty queue')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when no job is due and none are running, instead of waiting for more')
+        parser.add_argument('--no-training-scheduler', action='store_true',
+                            help='Do not watch model training status from this process')
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or getattr(settings, 'JOB_WORKERS', 4)
+        poll_interval = options['poll_interval'] or getattr(settings, 'JOB_POLL_INTERVAL', 1)
+        worker = jobs.worker_id()
+
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            logger.info("Stopping after running jobs finish")
+            stop.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker} running up to {workers} jobs"))
+        # 所有训练中模型的状态由一个调度线程批量检查，和任务共用停止信号
+        if not options['no_training_scheduler'] and not options['once']:
+            threading.Thread(target=self._watch_training, args=(stop,), name='training-scheduler', daemon=True).start()
+        # 上一次运行被杀掉时留下的任务马上放回队列，重新执行时从检查点继续
+        jobs.recover_orphans(worker)
+        running = set()
+        last_sweep = 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job') as executor:
+            while not stop.is_set():
+                running = {future for future in running if not future.done()}
+
+                # 崩溃的 worker 留下的 RUNNING 任务和没有识别的 OCR 图片，每分钟检查一次
+                if time.monotonic() - last_sweep > 60:
+                    jobs.requeue_stale()
+                    ocr_cache.expire_pending()
+                    last_sweep = time.monotonic()
+
+                claimed = jobs.claim(worker, workers - len(running)) if len(running) < workers else []
+                for job in claimed:
+                    running.add(executor.submit(self._run, job))
+
+                if options['once'] and not claimed and not running:
+                    break
+                if len(running) >= workers:
+                    wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                elif not claimed:
+                    stop.wait(poll_interval)
+
+    def _watch_training(self, stop):
+        try:
+            TrainingScheduler().run_forever(stop)
+        finally:
+            close_old_connections()
+
+    def _run(self, job):
+        # 每个线程有自己的数据库连接，执行前后清理超时或出错的连接
+        close_old_connections()
+        try:
+            jobs.run(job)
+        except Exception:
+            logger.exception(f"Unexpected error while running job {job.id}")
+        finally:
+            close_old_connections()
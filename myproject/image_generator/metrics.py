@@ -0,0 +1,285 @@
+"""
+进程内的指标采集，按 Prometheus 文本格式在 /metrics 输出。
+- upstream_requests_total / upstream_request_duration_seconds / upstream_in_flight:
+  每次调用 Leonardo、Google Vision、Gemini 的结果、耗时和并发数，按 upstream + operation 区分
+- background_tasks_running: 正在运行的后台线程，按任务名区分
+- generation_cache_lookups_total: 生成结果缓存的命中/未命中次数
+- 其余队列深度（限流器排队数等）通过 gauge_function 在输出时读取
+指标只在当前进程内累计，多个 gunicorn worker 需要分别抓取。
+"""
+
+import re
+import time
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """产生 (名称后缀, 标签名, 标签值, 数值)"""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            yield "", self.labels, key, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {value:g}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class GaugeFunction(_Metric):
+    """输出时调用 func() 取值的 gauge，func 返回一个数，或 {标签值元组: 数} 的字典"""
+    type = "gauge"
+
+    def __init__(self, name, help, func, labels=()):
+        super().__init__(name, help, labels)
+        self.func = func
+
+    def samples(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.warning(f"Failed to collect {self.name}: {str(e)}")
+            return
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                yield "", self.labels, key, item
+        elif value is not None:
+            yield "", (), (), value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [每个桶的累计数, 总和, 次数]
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        names = self.labels + ("le",)
+        for key, counts, total, count in sorted(items):
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield "_bucket", names, key + (f"{bound:g}",), bucket_count
+            yield "_bucket", names, key + ("+Inf",), count
+            yield "_sum", self.labels, key, total
+            yield "_count", self.labels, key, count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name, help, labels=()):
+    return registry.register(Counter(name, help, labels))
+
+
+def gauge(name, help, labels=()):
+    return registry.register(Gauge(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, help, labels, buckets))
+
+
+def gauge_function(name, help, func, labels=()):
+    return registry.register(GaugeFunction(name, help, func, labels))
+
+
+def render():
+    return registry.render()
+
+
+############ 上游调用 ############
+
+upstream_requests = counter(
+    "upstream_requests_total", "Calls to external APIs by outcome",
+    ("upstream", "operation", "outcome"),
+)
+upstream_duration = histogram(
+    "upstream_request_duration_seconds", "Latency of calls to external APIs",
+    ("upstream", "operation"),
+)
+upstream_in_flight = gauge(
+    "upstream_in_flight", "Calls to external APIs currently in progress",
+    ("upstream", "operation"),
+)
+
+
+class Call:
+    """一次上游调用，HTTP 调用方通过 status() 记录状态码"""
+
+    def __init__(self):
+        self.outcome = "ok"
+
+    def status(self, status_code):
+        self.outcome = str(status_code)
+
+
+@contextmanager
+def track(upstream, operation):
+    """记录一次上游调用的耗时、结果和并发数，异常时 outcome 为异常类名"""
+    labels = {"upstream": upstream, "operation": operation}
+    call = Call()
+    upstream_in_flight.inc(**labels)
+    started_at = time.perf_counter()
+    try:
+        yield call
+    except BaseException as e:
+        call.outcome = type(e).__name__
+        raise
+    finally:
+        upstream_duration.observe(time.perf_counter() - started_at, **labels)
+        upstream_requests.inc(outcome=call.outcome, **labels)
+        upstream_in_flight.dec(**labels)
+
+
+# (方法, 路径正则, operation)，路径是相对 API base 的部分
+LEONARDO_OPERATIONS = [
+    ("POST", r"generations", "generate"),
+    ("GET", r"generations/[^/]+", "poll"),
+    ("POST", r"datasets/[^/]+/upload(/.*)?", "upload"),
+    ("POST", r"datasets", "create_dataset"),
+    ("GET", r"datasets/[^/]+", "dataset_status"),
+    ("POST", r"models", "train"),
+    ("GET", r"models/[^/]+", "train_poll"),
+    ("GET", r"me", "account"),
+]
+
+
+@functools.lru_cache(maxsize=256)
+def leonardo_operation(method, path):
+    """根据请求方法和路径推断 operation 标签，避免把 ID 之类的高基数值写进标签"""
+    path = path.split("?", 1)[0].strip("/")
+    for route_method, pattern, operation in LEONARDO_OPERATIONS:
+        if route_method == method.upper() and re.fullmatch(pattern, path):
+            return operation
+    return "other"
+
+
+############ 生成缓存 ############
+
+generation_cache_lookups = counter(
+    "generation_cache_lookups_total", "Generation cache lookups by result", ("result",)
+)
+
+
+############ 后台任务 ############
+
+background_tasks = gauge(
+    "background_tasks_running", "Background tasks currently running in this process", ("task",)
+)
+
+
+def background_task(name):
+    """装饰后台线程的入口函数，运行期间计入 background_tasks_running"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            background_tasks.inc(task=name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                background_tasks.dec(task=name)
+        return wrapper
+    return decorator
+
+
+work_queue_depth = gauge(
+    "work_queue_depth", "Items queued or in progress in in-process work queues", ("queue",)
+)
+
+gauge_function("process_threads", "Live threads in this process", threading.active_count)
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0005_userprofile_seed_image_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GenerationCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64, unique=True)),
+                ("model_id", models.CharField(max_length=100)),
+                ("prompt", models.TextField()),
+                ("generation_id", models.CharField(max_length=100)),
+                ("status", models.CharField(default="PENDING", max_length=20)),
+                ("images", models.JSONField(default=list)),
+                ("hit_count", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
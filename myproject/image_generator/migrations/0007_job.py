@@ -0,0 +1,48 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0006_generationcache"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Job",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("job_type", models.CharField(max_length=50)),
+                ("payload", models.JSONField(default=dict)),
+                ("state", models.CharField(default="QUEUED", max_length=20)),
+                ("attempts", models.IntegerField(default=0)),
+                ("max_attempts", models.IntegerField(default=1)),
+                ("run_after", models.DateTimeField(default=django.utils.timezone.now)),
+                ("locked_by", models.CharField(blank=True, max_length=100, null=True)),
+                ("locked_at", models.DateTimeField(blank=True, null=True)),
+                ("result", models.JSONField(blank=True, null=True)),
+                ("error", models.TextField(blank=True, default="")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["state", "run_after"],
+                        name="image_gener_state_3cf3db_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0007_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SceneImage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("dataset_id", models.CharField(db_index=True, max_length=100)),
+                ("scene_index", models.IntegerField()),
+                ("scene", models.TextField()),
+                (
+                    "generation_id",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                ("image_id", models.CharField(blank=True, max_length=100, null=True)),
+                ("url", models.URLField(blank=True, default="", max_length=500)),
+                ("status", models.CharField(default="PENDING", max_length=20)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "ordering": ["scene_index"],
+                "unique_together": {("dataset_id", "scene_index")},
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0008_sceneimage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobProgress",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "dataset_id",
+                    models.CharField(
+                        blank=True, db_index=True, max_length=100, null=True
+                    ),
+                ),
+                ("status", models.CharField(default="starting", max_length=20)),
+                ("current_activity", models.TextField(blank=True, default="")),
+                ("completed", models.IntegerField(default=0)),
+                ("total", models.IntegerField(default=0)),
+                ("seq", models.IntegerField(default=0)),
+                ("log", models.JSONField(default=list)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "job",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="progress",
+                        to="image_generator.job",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0009_jobprogress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usercustommodel",
+            name="checks",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="usercustommodel",
+            name="job",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="image_generator.job",
+            ),
+        ),
+        migrations.AddField(
+            model_name="usercustommodel",
+            name="next_check_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="usercustommodel",
+            name="training_started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
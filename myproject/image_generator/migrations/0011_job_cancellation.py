@@ -0,0 +1,22 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0010_training_scheduler"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="cancel_requested_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="job",
+            name="deadline",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
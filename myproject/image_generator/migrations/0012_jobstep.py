@@ -0,0 +1,48 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0011_job_cancellation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JobStep",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("step_index", models.IntegerField()),
+                ("status", models.CharField(default="PENDING", max_length=20)),
+                (
+                    "generation_id",
+                    models.CharField(blank=True, max_length=100, null=True),
+                ),
+                ("images", models.JSONField(default=list)),
+                ("uploaded_image_ids", models.JSONField(default=list)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "job",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="steps",
+                        to="image_generator.job",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["step_index"],
+                "unique_together": {("job", "step_index")},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0012_jobstep"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userdiary",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0013_userdiary_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userdiary",
+            name="ocr_backend",
+            field=models.CharField(default="google", max_length=20),
+        ),
+    ]
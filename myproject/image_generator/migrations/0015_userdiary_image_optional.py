@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image_generator", "0014_userdiary_ocr_backend"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="userdiary",
+            name="diary_image",
+            field=models.ImageField(blank=True, upload_to="diary_images/"),
+        ),
+    ]
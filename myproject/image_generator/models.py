@@ -10,8 +10,12 @@ from django.utils import timezone
 
 class UserDiary(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)  # Make user optional
-    diary_image = models.ImageField(upload_to='diary_images/')
+    # 只在异步 OCR 排队期间保存原图，识别完成后删除（见 ocr_cache.complete）
+    diary_image = models.ImageField(upload_to='diary_images/', blank=True)
     extracted_text = models.TextField(blank=True, null=True)
+    # 图片内容的 SHA-256，用作 OCR 结果的缓存键（见 ocr_cache）
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    ocr_backend = models.CharField(max_length=20, default='google')  # 识别用的 OCR 后端，不同后端的结果分开缓存
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -43,6 +47,107 @@ class UserCustomModel(models.Model):
     model_status = models.CharField(max_length=20, default='PENDING')  # PENDING, TRAINING, COMPLETE, FAILED
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # 以下字段由 TrainingScheduler 维护
+    training_started_at = models.DateTimeField(blank=True, null=True)
+    next_check_at = models.DateTimeField(blank=True, null=True, db_index=True)  # 下一次检查训练状态的时间
+    checks = models.IntegerField(default=0)  # 本次训练已检查的次数
+    job = models.ForeignKey('Job', on_delete=models.SET_NULL, blank=True, null=True)  # 承载训练进度的任务
 
     def __str__(self):
-        return f"{self.username}'s model: {self.model_id}"
\ No newline at end of file
+        return f"{self.username}'s model: {self.model_id}"
+
+class GenerationCache(models.Model):
+    """以生成参数的哈希为键，记录对应的 generation 和图片，相同请求不再重复付费生成"""
+    key = models.CharField(max_length=64, unique=True)  # sha256(modelId, controlnets, prompt, size, presetStyle)
+    model_id = models.CharField(max_length=100)
+    prompt = models.TextField()
+    generation_id = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, default='PENDING')  # PENDING, COMPLETE
+    images = models.JSONField(default=list)  # [{'url': ..., 'id': ...}]
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Cached generation {self.generation_id} ({self.status})"
+
+
+class Job(models.Model):
+    """持久化的后台任务，由 manage.py run_workers 领取并执行"""
+    job_type = models.CharField(max_length=50)  # create_dataset, generate_scenes, watch_training
+    payload = models.JSONField(default=dict)
+    state = models.CharField(max_length=20, default='QUEUED')  # QUEUED, RUNNING, WAITING, SUCCEEDED, FAILED, CANCELLED
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=1)
+    run_after = models.DateTimeField(default=timezone.now)  # 重试/重新调度时推迟到这个时间之后
+    locked_by = models.CharField(max_length=100, blank=True, null=True)  # host:pid
+    locked_at = models.DateTimeField(blank=True, null=True)
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    deadline = models.DateTimeField(blank=True, null=True)  # 第一次执行时写入，超过后任务以 FAILED 结束
+    cancel_requested_at = models.DateTimeField(blank=True, null=True)  # 用户请求取消的时间
+
+    class Meta:
+        indexes = [models.Index(fields=['state', 'run_after'])]
+
+    def __str__(self):
+        return f"Job {self.id} {self.job_type} ({self.state})"
+
+
+class SceneImage(models.Model):
+    """日记场景与生成图片的对应关系，每个场景完成时写入，展示时按 scene_index 配对而不依赖数据集里的顺序"""
+    dataset_id = models.CharField(max_length=100, db_index=True)
+    scene_index = models.IntegerField()
+    scene = models.TextField()
+    generation_id = models.CharField(max_length=100, blank=True, null=True)
+    image_id = models.CharField(max_length=100, blank=True, null=True)
+    url = models.URLField(max_length=500, blank=True, default='')
+    status = models.CharField(max_length=20, default='PENDING')  # PENDING, GENERATING, COMPLETE, FAILED, CANCELLED
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('dataset_id', 'scene_index')
+        ordering = ['scene_index']
+
+    def __str__(self):
+        return f"Scene {self.scene_index} of {self.dataset_id} ({self.status})"
+
+
+class JobProgress(models.Model):
+    """后台任务的进度：计数器 + 定长的事件日志，每次只更新这一行，不再反复写 session"""
+    job = models.OneToOneField(Job, on_delete=models.CASCADE, related_name='progress')
+    dataset_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    status = models.CharField(max_length=20, default='starting')  # starting, in_progress, error, complete, failed, cancelled
+    current_activity = models.TextField(blank=True, default='')
+    completed = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    seq = models.IntegerField(default=0)  # 最后一条事件的序号
+    log = models.JSONField(default=list)  # 最近的 PROGRESS_LOG_SIZE 条 {'seq', 'event', 'message'}
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Progress of job {self.job_id}: {self.completed}/{self.total} ({self.status})"
+
+
+class JobStep(models.Model):
+    """后台任务中每一步（数据集的一个活动、日记的一个场景）的检查点
+    任务重新执行时跳过已上传的步骤，已提交的生成按 generation_id 继续等待，不重新提交
+    """
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='steps')
+    step_index = models.IntegerField()
+    status = models.CharField(max_length=20, default='PENDING')  # PENDING, GENERATING, GENERATED, UPLOADED, FAILED
+    generation_id = models.CharField(max_length=100, blank=True, null=True)
+    images = models.JSONField(default=list)  # 生成完成的图片 [{'url': ..., 'id': ...}]
+    uploaded_image_ids = models.JSONField(default=list)  # 已上传到数据集的图片ID
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('job', 'step_index')
+        ordering = ['step_index']
+
+    def __str__(self):
+        return f"Step {self.step_index} of job {self.job_id} ({self.status})"
@@ -0,0 +1,283 @@
+"""
+日记图片的文字识别。
+parse_diary / parse_diary_pages / aparse_diary 通过 get_backend() 分发到 settings.OCR_BACKEND 选中的后端：
+- google：Google Cloud Vision（document_text_detection，多页用 batch_annotate_images）
+- tesseract：本机的 Tesseract，通过子进程调用，不需要网络
+- fake：根据图片内容生成固定文字的替身，不做任何识别，用于基准测试和离线压测
+后端只负责把预处理过的图片变成单词列表；读取和预处理（cloudvision.preprocess）、拼接成文字、
+耗时记录（metrics.track，upstream 为后端的 upstream 名）由 OCRBackend 统一完成。
+"""
+
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import subprocess
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from . import cloudvision, metrics
+from .cloudvision import preprocess, read_content
+
+
+logger = logging.getLogger(__name__)
+
+
+class OCRTimeout(Exception):
+    """OCR 调用超过 VISION_TIMEOUT，各后端的超时异常统一转换成这一种"""
+
+
+def format_paragraph(words, separator=''):
+    # Join the list of words into a single string (Chinese text needs no spaces between words)
+    paragraph = separator.join(words)
+    return paragraph
+
+
+class OCRBackend:
+    name = None
+    upstream = None  # metrics 中的 upstream 标签
+    separator = ''  # 拼接单词用的分隔符
+
+    def detect(self, content):
+        """识别一页（预处理后的 bytes），返回单词列表"""
+        raise NotImplementedError
+
+    def detect_pages(self, contents):
+        """识别多页，返回与 contents 顺序一致的单词列表；默认在线程池里逐页并发调用 detect()"""
+        concurrency = getattr(settings, 'VISION_CONCURRENCY', 4)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(contents))) as executor:
+            return list(executor.map(self.detect, contents))
+
+    async def adetect(self, content):
+        """detect() 的异步版本，默认放到线程里执行"""
+        return await asyncio.to_thread(self.detect, content)
+
+    def warm_up(self):
+        """worker 启动时调用，提前建立连接等"""
+
+    def timeout_errors(self):
+        """该后端表示超时的异常类型"""
+        return (TimeoutError, subprocess.TimeoutExpired)
+
+    @contextmanager
+    def _call(self, operation, pages):
+        """一次 OCR 调用：记录耗时，把超时转换成 OCRTimeout"""
+        started_at = time.perf_counter()
+        try:
+            with metrics.track(self.upstream, operation):
+                yield
+        except self.timeout_errors() as e:
+            raise OCRTimeout(f"OCR ({self.name}) timed out after {time.perf_counter() - started_at:.0f}s") from e
+        logger.info(f"OCR ({self.name}) of {pages} page(s) took {(time.perf_counter() - started_at) * 1000:.0f}ms")
+
+    def parse(self, source):
+        """图片（bytes、文件对象或文件路径）-> 文字"""
+        content = preprocess(read_content(source))
+        with self._call("ocr", 1):
+            words = self.detect(content)
+        return format_paragraph(words, self.separator)
+
+    def parse_pages(self, sources):
+        """多页图片 -> 按页序排列的每页文字，各页的读取和预处理并发进行"""
+        sources = list(sources)
+        if not sources:
+            return []
+        concurrency = getattr(settings, 'VISION_CONCURRENCY', 4)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(sources))) as executor:
+            contents = list(executor.map(lambda source: preprocess(read_content(source)), sources))
+        with self._call("ocr_batch", len(contents)):
+            pages = self.detect_pages(contents)
+        return [format_paragraph(words, self.separator) for words in pages]
+
+    async def aparse(self, source):
+        """parse() 的异步版本"""
+        # 解码和缩放是 CPU 密集的，放到线程里，不阻塞事件循环
+        content = await asyncio.to_thread(preprocess, read_content(source))
+        with self._call("ocr", 1):
+            words = await self.adetect(content)
+        return format_paragraph(words, self.separator)
+
+
+class GoogleVisionBackend(OCRBackend):
+    name = 'google'
+    upstream = 'vision'
+
+    def detect(self, content):
+        from google.cloud import vision
+
+        response = cloudvision.get_client().document_text_detection(
+            image=vision.Image(content=content), **cloudvision.request_options(),
+        )
+        return cloudvision.words_from_response(response)
+
+    @staticmethod
+    def _batches(contents, batch_size, batch_bytes):
+        """按页序切分批次：每批最多 batch_size 页，图片总大小不超过 batch_bytes（单页超过时自成一批）"""
+        batches = []
+        size = 0
+        for content in contents:
+            if not batches or len(batches[-1]) >= batch_size or size + len(content) > batch_bytes:
+                batches.append([])
+                size = 0
+            batches[-1].append(content)
+            size += len(content)
+        return batches
+
+    def detect_pages(self, contents):
+        """每 VISION_BATCH_SIZE 页（API 上限 16）、且不超过 VISION_BATCH_BYTES 合成一个 batch_annotate_images 请求，
+        多个批次并发发送（最多 VISION_CONCURRENCY 个），整篇日记的耗时接近一次 OCR。
+        关闭预处理或图片无法解码时发送的是原图，手机照片几 MB 一张，只按页数分批会超过请求大小上限
+        """
+        from google.cloud import vision
+
+        concurrency = getattr(settings, 'VISION_CONCURRENCY', 4)
+        batch_size = min(getattr(settings, 'VISION_BATCH_SIZE', 16), 16)
+        batch_bytes = getattr(settings, 'VISION_BATCH_BYTES', 8 * 1024 * 1024)
+        feature = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+        batches = [
+            [
+                vision.AnnotateImageRequest(image=vision.Image(content=content), features=[feature],
+                                            image_context=cloudvision.IMAGE_CONTEXT)
+                for content in batch
+            ]
+            for batch in self._batches(contents, batch_size, batch_bytes)
+        ]
+
+        def annotate(requests):
+            response = cloudvision.get_client().batch_annotate_images(
+                requests=requests, timeout=getattr(settings, 'VISION_TIMEOUT', 30),
+            )
+            return [cloudvision.words_from_response(page) for page in response.responses]
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as executor:
+            return [words for batch in executor.map(annotate, batches) for words in batch]
+
+    async def adetect(self, content):
+        from google.cloud import vision
+
+        response = await cloudvision.get_async_client().document_text_detection(
+            image=vision.Image(content=content), **cloudvision.request_options(),
+        )
+        return cloudvision.words_from_response(response)
+
+    def warm_up(self):
+        cloudvision.warm_up()
+
+    def timeout_errors(self):
+        from google.api_core.exceptions import DeadlineExceeded
+        return super().timeout_errors() + (DeadlineExceeded,)
+
+
+class TesseractBackend(OCRBackend):
+    """本机 Tesseract（需要安装 tesseract 和对应语言包，如 tesseract-ocr-chi-sim），图片通过 stdin 传入"""
+    name = 'tesseract'
+    upstream = 'tesseract'
+
+    def _command(self):
+        return [
+            getattr(settings, 'TESSERACT_CMD', 'tesseract'), 'stdin', 'stdout',
+            '-l', getattr(settings, 'TESSERACT_LANG', 'chi_sim'),
+            '--psm', str(getattr(settings, 'TESSERACT_PSM', 6)),
+        ]
+
+    CJK_LANGS = ('chi_', 'jpn', 'kor')
+
+    @property
+    def separator(self):
+        """中日韩文字之间不加空格；其他语言（如 eng）的单词之间保留空格"""
+        langs = getattr(settings, 'TESSERACT_LANG', 'chi_sim').split('+')
+        return '' if all(lang.startswith(self.CJK_LANGS) for lang in langs) else ' '
+
+    def _words(self, returncode, stdout, stderr):
+        if returncode != 0:
+            raise Exception(f"Tesseract exited with {returncode}: {stderr.decode(errors='replace').strip()}")
+        # 中文输出的字之间带空格，和 Vision 一样按单词拆开，由 format_paragraph 按 separator 拼接
+        return stdout.decode().split()
+
+    def detect(self, content):
+        try:
+            result = subprocess.run(
+                self._command(), input=content, capture_output=True,
+                timeout=getattr(settings, 'VISION_TIMEOUT', 30),
+            )
+        except FileNotFoundError:
+            raise Exception(f"Tesseract not found, install it or set TESSERACT_CMD ({self._command()[0]})")
+        return self._words(result.returncode, result.stdout, result.stderr)
+
+    async def adetect(self, content):
+        process = await asyncio.create_subprocess_exec(
+            *self._command(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(content), timeout=getattr(settings, 'VISION_TIMEOUT', 30),
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+        return self._words(process.returncode, stdout, stderr)
+
+
+class FakeBackend(OCRBackend):
+    """不识别任何东西：按图片内容的哈希从固定的字表里挑字，同一张图片总是得到同样的文字。
+    OCR_FAKE_LATENCY 模拟一次调用的耗时（秒）
+    """
+    name = 'fake'
+    upstream = 'ocr_fake'
+
+    CHARACTERS = "今天早上我和妹妹去公园跑步然后一起在湖边喂鸭子中午我们家做了番茄炒蛋下午阳台上画幅水彩晚朋友看场电影"
+    WORDS = 60
+
+    def _words(self, content):
+        rng = random.Random(hashlib.sha256(content).digest())
+        return [''.join(rng.choices(self.CHARACTERS, k=rng.randint(1, 3))) for _ in range(self.WORDS)]
+
+    def detect(self, content):
+        time.sleep(getattr(settings, 'OCR_FAKE_LATENCY', 0))
+        return self._words(content)
+
+    async def adetect(self, content):
+        await asyncio.sleep(getattr(settings, 'OCR_FAKE_LATENCY', 0))
+        return self._words(content)
+
+
+BACKENDS = {backend.name: backend for backend in (GoogleVisionBackend, TesseractBackend, FakeBackend)}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """按名字（默认 settings.OCR_BACKEND）返回共享的后端实例"""
+    name = name or getattr(settings, 'OCR_BACKEND', 'google')
+    with _backends_lock:
+        if name not in _backends:
+            if name not in BACKENDS:
+                raise ValueError(f"Unknown OCR backend: {name} (choose from {', '.join(BACKENDS)})")
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
+
+
+def warm_up_in_background():
+    """VISION_WARM_UP 打开时在后台建好 OCR 后端的连接；只在 web 服务入口调用（wsgi.py、asgi.py、runserver）"""
+    if not getattr(settings, 'VISION_WARM_UP', False):
+        return
+    threading.Thread(target=get_backend().warm_up, name='ocr-warm-up', daemon=True).start()
+
+
+def parse_diary(image, backend=None):
+    """主函数，处理日记图片（bytes、文件对象或文件路径），返回文字"""
+    return get_backend(backend).parse(image)
+
+
+def parse_diary_pages(images, backend=None):
+    """多页日记，返回按页序排列的每页文字"""
+    return get_backend(backend).parse_pages(images)
+
+
+async def aparse_diary(image, backend=None):
+    """parse_diary() 的异步版本"""
+    return await get_backend(backend).aparse(image)
@@ -0,0 +1,176 @@
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from . import metrics, ocr
+from .cloudvision import read_content
+from .models import UserDiary
+
+
+logger = logging.getLogger(__name__)
+
+lookups = metrics.counter("ocr_cache_lookups_total", "OCR cache lookups by result", ("result",))
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def _store(digest, text, backend, user=None):
+    """OCR 结果保存为一条 UserDiary（不保存原图），下次用同一个后端识别同样的内容直接命中"""
+    return UserDiary.objects.create(user=user, content_hash=digest, ocr_backend=backend, extracted_text=text)
+
+
+def _queue(digest, content, name, backend, user=None):
+    """保存原图，extracted_text 为空，由 OCR 任务稍后识别并填写（见 submit / complete）"""
+    diary = UserDiary(user=user, content_hash=digest, ocr_backend=backend, extracted_text=None)
+    diary.diary_image.save(f"{digest}{_extension(name)}", ContentFile(content), save=False)
+    diary.save()
+    return diary
+
+
+def _discard(rows):
+    """删除排队中的图片文件和对应的 UserDiary"""
+    for row in rows:
+        row.diary_image.delete(save=False)
+    UserDiary.objects.filter(id__in=[row.id for row in rows]).delete()
+
+
+def _extension(name):
+    if name and '.' in name:
+        return '.' + name.rsplit('.', 1)[1].lower()
+    return ''
+
+
+def _lookup(sources, backend):
+    """读取并哈希各页，返回 (digests, 已缓存的 {digest: text}, 未命中的 {digest: (content, name)})"""
+    contents = [read_content(source) for source in sources]
+    digests = [content_hash(content) for content in contents]
+
+    cached = dict(
+        UserDiary.objects.filter(content_hash__in=set(digests), ocr_backend=backend.name,
+                                 extracted_text__isnull=False)
+        .values_list('content_hash', 'extracted_text')
+    )
+    missing = {}
+    for digest, content, source in zip(digests, contents, sources):
+        if digest not in cached and digest not in missing:
+            missing[digest] = (content, getattr(source, 'name', None))
+    return digests, cached, missing
+
+
+def _results(digests, cached, missing):
+    results = []
+    for digest in digests:
+        hit = digest in cached and digest not in missing
+        lookups.inc(result='hit' if hit else 'miss')
+        # 识别前日记被删除的页面没有结果，按空白页返回
+        results.append((cached.get(digest, ''), hit))
+    logger.info(f"OCR cache: {sum(hit for _, hit in results)}/{len(results)} pages served from cache")
+    return results
+
+
+def _recognize(backend, pages):
+    return [backend.parse(pages[0])] if len(pages) == 1 else backend.parse_pages(pages)
+
+
+def parse_pages(sources, user=None, backend=None):
+    """按内容哈希（SHA-256）和 OCR 后端查缓存，只有未命中的页面才发给 OCR
+    返回 [(text, hit), ...]，顺序与 sources 一致；同一次上传里重复的页面只 OCR 一次
+    """
+    backend = ocr.get_backend(backend)
+    digests, cached, missing = _lookup(sources, backend)
+
+    if missing:
+        texts = _recognize(backend, [content for content, _ in missing.values()])
+        for digest, text in zip(missing, texts):
+            _store(digest, text, backend.name, user)
+            cached[digest] = text
+
+    return _results(digests, cached, missing)
+
+
+def parse_diary(source, user=None, backend=None):
+    """单页版本，返回 (text, hit)"""
+    return parse_pages([source], user, backend)[0]
+
+
+def submit(sources, user=None, backend=None):
+    """parse_pages() 的异步模式：不在当前请求里调用 OCR
+    全部命中时返回 ([(text, True), ...], [])；否则把未命中的图片存进 UserDiary（extracted_text 为空），
+    返回 (None, 各页的 digest)，由 OCR 任务调用 complete() 识别
+    """
+    backend = ocr.get_backend(backend)
+    digests, cached, missing = _lookup(sources, backend)
+    if not missing:
+        return _results(digests, cached, missing), []
+
+    waiting = set(
+        UserDiary.objects.filter(content_hash__in=missing.keys(), ocr_backend=backend.name,
+                                 extracted_text__isnull=True)
+        .values_list('content_hash', flat=True)
+    )
+    for digest, (content, name) in missing.items():
+        # 同样的图片上次提交后还没识别完（或识别失败），沿用那一行
+        if digest not in waiting:
+            _queue(digest, content, name, backend.name, user)
+    return None, digests
+
+
+def complete(digests, backend=None):
+    """识别 submit() 存下的图片并写回 UserDiary，返回 [(text, hit), ...]
+    写回文字后删除图片文件，日记照片不在服务器上长期保存；识别失败时连同记录一起删除
+    """
+    backend = ocr.get_backend(backend)
+    diaries = UserDiary.objects.filter(content_hash__in=set(digests), ocr_backend=backend.name)
+    cached = {}
+    pending = {}
+    for diary in diaries:
+        if diary.extracted_text is not None:
+            cached[diary.content_hash] = diary.extracted_text
+        else:
+            pending.setdefault(diary.content_hash, []).append(diary)
+    # 排队期间可能已经被其他请求识别过
+    missing = {digest: diaries for digest, diaries in pending.items() if digest not in cached}
+
+    if missing:
+        pages = {}
+        for digest, rows in missing.items():
+            try:
+                with rows[0].diary_image.open('rb') as image:
+                    pages[digest] = image.read()
+            except (FileNotFoundError, ValueError):
+                # 图片已经不在了：日记被删除，或同一张图片刚被另一个任务识别完
+                logger.warning(f"Queued OCR image {digest} disappeared before recognition")
+        try:
+            texts = _recognize(backend, list(pages.values())) if pages else []
+        except Exception:
+            _discard([row for rows in missing.values() for row in rows])
+            raise
+        cached.update(
+            UserDiary.objects.filter(content_hash__in=set(missing) - set(pages), ocr_backend=backend.name,
+                                     extracted_text__isnull=False)
+            .values_list('content_hash', 'extracted_text')
+        )
+        for digest, text in zip(pages, texts):
+            for row in missing[digest]:
+                row.diary_image.delete(save=False)
+            UserDiary.objects.filter(id__in=[row.id for row in missing[digest]]).update(
+                extracted_text=text, diary_image='',
+            )
+            cached[digest] = text
+
+    return _results(digests, cached, missing)
+
+
+def expire_pending(max_age=None):
+    """删除排队超过 OCR_PENDING_TTL 仍没有识别的图片（任务被取消、超时或一直没有执行），返回删除的条数"""
+    max_age = max_age or getattr(settings, 'OCR_PENDING_TTL', 600)
+    rows = list(UserDiary.objects.filter(extracted_text__isnull=True,
+                                         created_at__lt=timezone.now() - timedelta(seconds=max_age)))
+    _discard(rows)
+    if rows:
+        logger.info(f"Expired {len(rows)} queued OCR image(s)")
+    return len(rows)
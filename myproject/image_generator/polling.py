@@ -0,0 +1,141 @@
+import time
+import random
+import itertools
+import asyncio
+import logging
+import threading
+from collections import deque, defaultdict
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class PollTimeout(TimeoutError):
+    """轮询超过了硬性截止时间"""
+
+
+class LatencyTracker:
+    """记录最近若干次任务的实际耗时，按 key 区分（如模型ID + preset）"""
+
+    def __init__(self, window=20):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    def expected(self, key):
+        """返回最近耗时的中位数，没有历史时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples:
+            return None
+        return samples[len(samples) // 2]
+
+
+class PollingPolicy:
+    """根据历史耗时决定轮询间隔
+    先一次性睡到预计完成时间附近（lead * 预计耗时），
+    之后从 min_interval 开始按 multiplier 指数退避（带抖动），最长 max_interval，
+    总时长超过 timeout 时抛出 PollTimeout。
+    """
+
+    def __init__(self, tracker=None, initial_delay=3, min_interval=1, max_interval=10,
+                 multiplier=1.5, jitter=0.2, lead=0.8, timeout=300):
+        self.tracker = tracker or LatencyTracker()
+        self.initial_delay = initial_delay
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.lead = lead
+        self.timeout = timeout
+
+    def delays(self, key):
+        """依次产生每次轮询之前需要等待的秒数"""
+        expected = self.tracker.expected(key)
+        if expected is not None:
+            yield max(expected * self.lead, self.min_interval)
+        else:
+            yield self.initial_delay
+
+        interval = self.min_interval
+        while True:
+            yield interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            interval = min(interval * self.multiplier, self.max_interval)
+
+    def delay(self, key, attempt):
+        """delays(key) 的第 attempt 个值，供每次只检查一次、之后重新排队的任务使用"""
+        return next(itertools.islice(self.delays(key), attempt, None))
+
+    def poll(self, fetch, is_done, key, timeout=None, record=None, cancel=None):
+        """重复调用 fetch() 直到 is_done(result) 为真，返回最后一次的结果
+        record(result) 为真时把本次耗时记入历史（默认所有完成的结果都记录）
+        cancel 是 jobs.CancelToken，任务取消或超过截止时间时在等待期间抛出异常，不再继续轮询
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started_at = time.monotonic()
+        deadline = started_at + timeout
+
+        result = fetch()
+        for delay in self.delays(key):
+            if is_done(result):
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PollTimeout(f"Polling {key} timed out after {timeout}s")
+            if cancel is not None:
+                cancel.sleep(min(delay, remaining))
+            else:
+                time.sleep(min(delay, remaining))
+            result = fetch()
+
+        self._record(key, result, time.monotonic() - started_at, record)
+        return result
+
+    async def apoll(self, fetch, is_done, key, timeout=None, record=None):
+        """poll() 的异步版本，fetch 是返回 awaitable 的函数"""
+        timeout = self.timeout if timeout is None else timeout
+        started_at = time.monotonic()
+        deadline = started_at + timeout
+
+        result = await fetch()
+        for delay in self.delays(key):
+            if is_done(result):
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PollTimeout(f"Polling {key} timed out after {timeout}s")
+            await asyncio.sleep(min(delay, remaining))
+            result = await fetch()
+
+        self._record(key, result, time.monotonic() - started_at, record)
+        return result
+
+    def _record(self, key, result, elapsed, record):
+        if record is None or record(result):
+            self.tracker.record(key, elapsed)
+            logger.info(f"{key} finished after {elapsed:.1f}s")
+
+
+def generation_key(model_id, preset_style):
+    return f"generation:{model_id}:{preset_style}"
+
+
+def training_key(model_type):
+    return f"training:{model_type}"
+
+
+# 单张图片的生成通常在十几秒内完成，前期间隔短一些
+generation_polling = PollingPolicy(
+    initial_delay=3, min_interval=1, max_interval=10,
+    timeout=getattr(settings, 'GENERATION_POLL_TIMEOUT', 300),
+)
+
+# 模型训练需要十几分钟到半小时，间隔放宽
+training_polling = PollingPolicy(
+    initial_delay=60, min_interval=10, max_interval=120,
+    timeout=getattr(settings, 'TRAINING_POLL_TIMEOUT', 1800),
+)
@@ -0,0 +1,62 @@
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .models import JobProgress
+
+
+logger = logging.getLogger(__name__)
+
+
+def create(job, total, dataset_id=None):
+    """任务入队时建好进度记录，页面第一次轮询就能读到"""
+    return JobProgress.objects.create(job=job, total=total, dataset_id=dataset_id)
+
+
+class ProgressReporter:
+    """一个任务的进度写入器
+    每次更新都是针对 JobProgress 这一行的 UPDATE，只写变化的字段；
+    计数器用 F() 表达式自增，事件日志保留最近 PROGRESS_LOG_SIZE 条。
+    job_id 为 None 时只在内存中记录（直接调用后台函数时使用，如基准测试）
+    """
+
+    def __init__(self, job_id=None, log_size=None):
+        self.job_id = job_id
+        self._lock = threading.Lock()
+        state = {'seq': 0, 'log': []}
+        if job_id is not None:
+            state = JobProgress.objects.filter(job_id=job_id).values('seq', 'log').first() or state
+        self.seq = state['seq']
+        self.log = deque(state['log'], maxlen=log_size or getattr(settings, 'PROGRESS_LOG_SIZE', 50))
+
+    def update(self, event=None, message=None, **fields):
+        """追加一条事件（可选）并更新给定字段，如 completed=F('completed') + 1"""
+        with self._lock:
+            if message is not None:
+                self.seq += 1
+                self.log.append({'seq': self.seq, 'event': event, 'message': message})
+                fields.update(seq=self.seq, log=list(self.log))
+            if self.job_id is None or not fields:
+                return
+            # update() 不会触发 auto_now，需要手动写 updated_at
+            JobProgress.objects.filter(job_id=self.job_id).update(updated_at=timezone.now(), **fields)
+
+    def increment(self, event=None, message=None, **fields):
+        """completed 加一，并追加一条事件"""
+        self.update(event, message, completed=F('completed') + 1, **fields)
+
+
+def snapshot(progress):
+    """JobProgress 转成进度接口返回的字典"""
+    return {
+        'job_id': progress.job_id,
+        'dataset_id': progress.dataset_id,
+        'status': progress.status,
+        'current_activity': progress.current_activity,
+        'completed': progress.completed,
+        'total': progress.total,
+        'seq': progress.seq,
+        'events': progress.log,
+    }
@@ -1,23 +1,33 @@
 import os
-import google.generativeai as genai
 import logging
 from django.conf import settings
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
 
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
-genai.configure(api_key=api_key)
+_configured = False
 
 
-def process_diary_text(diary_text):
-    """ 使用 Gemini 将日记文本转换为场景描述列表 """
-    try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        
-        prompt = f"""
+def _model():
+    """ 延迟导入并配置 Gemini SDK，返回用于拆分场景的模型
+    基准测试会把这个函数替换成本地的替身
+    """
+    global _configured
+    import google.generativeai as genai
+
+    if not _configured:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables")
+        genai.configure(api_key=api_key)
+        _configured = True
+    return genai.GenerativeModel("gemini-1.5-flash")
+
+
+def _scene_prompt(diary_text):
+    """ 构造把日记拆分成场景的提示词 """
+    return f"""
             You are an expert at converting diary entries into concise, descriptive image prompts.
 
             **Your Task:**  
@@ -56,19 +66,46 @@ def process_diary_text(diary_text):
             {diary_text}
 
         """
-        
-        response = model.generate_content(prompt)
+
+
+def _scene_list(response_text):
+    """ 把 Gemini 的输出按行切成场景列表 """
+    scene_list = []
+    for sentence in response_text.split('\n'):
+        sentence = sentence.strip()
+        if sentence:
+            scene_list.append(sentence)
+    return scene_list
+
+
+def process_diary_text(diary_text):
+    """ 使用 Gemini 将日记文本转换为场景描述列表 """
+    try:
+        model = _model()
+        with metrics.track("gemini", "scene_split"):
+            response = model.generate_content(_scene_prompt(diary_text))
         
         # generate scene list
-        scene_list = []
-        for sentence in response.text.split('\n'):
-            sentence = sentence.strip()
-            if sentence:
-                scene_list.append(sentence)
+        scene_list = _scene_list(response.text)
         
         logger.info(f"Generated {len(scene_list)} scenes from diary text")
         return scene_list
         
     except Exception as e:
         logger.error(f"Error processing diary text: {str(e)}")
-        raise 
\ No newline at end of file
+        raise 
+
+
+async def aprocess_diary_text(diary_text):
+    """ process_diary_text() 的异步版本，使用 Gemini SDK 自带的 async 接口 """
+    try:
+        model = _model()
+        with metrics.track("gemini", "scene_split"):
+            response = await model.generate_content_async(_scene_prompt(diary_text))
+        scene_list = _scene_list(response.text)
+        logger.info(f"Generated {len(scene_list)} scenes from diary text")
+        return scene_list
+
+    except Exception as e:
+        logger.error(f"Error processing diary text: {str(e)}")
+        raise
@@ -0,0 +1,401 @@
+import os
+import math
+import time
+import asyncio
+import sqlite3
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+from email.utils import parsedate_to_datetime
+from django.conf import settings
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# 请求的优先级：用户正盯着加载动画的请求（头像预览）是 interactive，数据集和日记场景的批量生成是 bulk
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)
+
+# 没有标记的请求（后台任务、线程池里的扇出）都按 bulk 处理
+_priority = contextvars.ContextVar('leonardo_priority', default=BULK)
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextmanager
+def priority(value):
+    """在这个上下文里发出的 Leonardo 请求使用给定的优先级"""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def interactive(view):
+    """视图装饰器：视图里发出的 Leonardo 请求按 interactive 排队，同步和异步视图都适用"""
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            with priority(INTERACTIVE):
+                return await view(*args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with priority(INTERACTIVE):
+                return view(*args, **kwargs)
+    return wrapper
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+# interactive 请求等令牌时登记一个短租约（预计等待时间 + INTERACTIVE_LEASE 秒），
+# 租约有效期间 bulk 不拿令牌；等待中的 interactive 每次重试都会续约，进程崩溃时租约自行过期
+INTERACTIVE_LEASE = 0.1
+
+
+def _take(tokens, now, interactive_until, rate, priority):
+    """令牌桶的取令牌规则，返回 (剩余令牌, interactive 租约到期时间, 需要等待的秒数)"""
+    if priority != INTERACTIVE and now < interactive_until:
+        return tokens, interactive_until, interactive_until - now
+    if tokens >= 1:
+        return tokens - 1, interactive_until, 0
+    wait = (1 - tokens) / rate
+    if priority == INTERACTIVE:
+        interactive_until = max(interactive_until, now + wait + INTERACTIVE_LEASE)
+    return tokens, interactive_until, wait
+
+
+class TokenBucket:
+    """进程内的令牌桶，rate 为每秒补充的令牌数，capacity 为突发上限"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._interactive_until = 0.0
+        self._lock = threading.Lock()
+
+    def try_take(self, priority=BULK):
+        """尝试取一个令牌，成功返回 0，否则返回建议等待的秒数；有 interactive 在等时 bulk 让它先拿"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens, self._interactive_until, wait = _take(
+                self._tokens, now, self._interactive_until, self.rate, priority)
+            return wait
+
+    def pause(self, seconds):
+        """收到 Retry-After 时，在 seconds 秒内不再发放令牌"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class SQLiteTokenBucket:
+    """存放在 SQLite 文件里的令牌桶，同一台机器上的多个 gunicorn worker 和 run_workers 共享预算
+    用 BEGIN IMMEDIATE 保证读-改-写的原子性；interactive 租约也存在这里，
+    web 进程里的 interactive 请求可以让 run_workers 里的批量任务让路
+    """
+
+    def __init__(self, path, rate, capacity, name="leonardo"):
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self.name = name
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_bucket ("
+                "name TEXT PRIMARY KEY, tokens REAL, updated REAL, blocked_until REAL, interactive_until REAL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO token_bucket (name, tokens, updated, blocked_until, interactive_until) "
+                "VALUES (?, ?, ?, 0, 0)",
+                (name, capacity, time.time()),
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return _Transaction(conn)
+
+    def try_take(self, priority=BULK):
+        with self._connect() as conn:
+            tokens, updated, blocked_until, interactive_until = conn.execute(
+                "SELECT tokens, updated, blocked_until, interactive_until FROM token_bucket WHERE name = ?",
+                (self.name,),
+            ).fetchone()
+            now = time.time()
+            if now < blocked_until:
+                return blocked_until - now
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            tokens, interactive_until, wait = _take(tokens, now, interactive_until, self.rate, priority)
+            conn.execute(
+                "UPDATE token_bucket SET tokens = ?, updated = ?, interactive_until = ? WHERE name = ?",
+                (tokens, now, interactive_until, self.name),
+            )
+            return wait
+
+    def pause(self, seconds):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE token_bucket SET blocked_until = MAX(blocked_until, ?) WHERE name = ?",
+                (time.time() + seconds, self.name),
+            )
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT 的上下文管理器"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class AIMDLimiter:
+    """加性增、乘性减的并发上限
+    每次成功把上限增加 1/limit（约每一轮请求 +1），遇到 429/5xx 时乘以 decrease
+    按优先级分配名额：interactive 可以用满上限，并且有 interactive 在等时 bulk 不再拿新名额（插队）；
+    bulk 最多用到上限减去为 interactive 保留的 interactive_share。
+    上限是每个进程各自的；只跑批量任务的进程（run_workers）从来不会有 interactive 请求，
+    所以在本进程出现第一个 interactive 请求之前不保留名额
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=16, decrease=0.5, interactive_share=0.25):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.interactive_share = interactive_share
+        self.in_flight = 0
+        self.waiting = {INTERACTIVE: 0, BULK: 0}
+        self.serves_interactive = False
+        self._cond = threading.Condition()
+
+    def reserved(self):
+        """为 interactive 保留的名额数，至少给 bulk 留一个，避免上限降到很低时批量任务完全停住"""
+        if not self.serves_interactive:
+            return 0
+        limit = int(self.limit)
+        return max(0, min(limit - 1, math.ceil(limit * self.interactive_share)))
+
+    def _available(self, priority):
+        if priority == INTERACTIVE:
+            self.serves_interactive = True
+            return self.in_flight < int(self.limit)
+        return not self.waiting[INTERACTIVE] and self.in_flight < int(self.limit) - self.reserved()
+
+    def queue(self, priority, delta):
+        """登记正在轮询 try_acquire() 的请求（异步路径），bulk 据此给 interactive 让路"""
+        with self._cond:
+            self.waiting[priority] += delta
+            if delta < 0:
+                self._cond.notify_all()
+
+    def try_acquire(self, priority=BULK):
+        with self._cond:
+            if self._available(priority):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self, priority=BULK):
+        with self._cond:
+            self.waiting[priority] += 1
+            try:
+                while not self._available(priority):
+                    self._cond.wait()
+            finally:
+                self.waiting[priority] -= 1
+            self.in_flight += 1
+            # interactive 不再排队后，被它挡住的 bulk 可能已经可以继续
+            self._cond.notify_all()
+
+    def release(self, overloaded=False):
+        with self._cond:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                logger.warning(f"Leonardo overloaded, concurrency limit down to {int(self.limit)}")
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+slot_wait = metrics.histogram(
+    "leonardo_slot_wait_seconds", "Time Leonardo requests spent waiting for a concurrency slot and token",
+    ("priority",),
+)
+
+
+class Slot:
+    """一次请求占用的名额，上游过载时调用 overloaded()，退出时据此调整并发上限"""
+
+    def __init__(self):
+        self.overload = False
+        self.retry_after = None
+
+    def overloaded(self, retry_after=None):
+        self.overload = True
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """令牌桶（请求速率）+ AIMD（并发数），放在每个 Leonardo 请求前面
+    优先级取自 current_priority()：interactive 在本进程里先拿并发名额；等令牌时由令牌桶让 bulk 让路，
+    使用 SQLite 令牌桶时跨进程生效（interactive 在 web 进程，批量任务在 run_workers）
+    """
+
+    def __init__(self, bucket, concurrency):
+        self.bucket = bucket
+        self.concurrency = concurrency
+        # 正在排队等并发名额或令牌的请求数，按优先级区分
+        self.waiting = {INTERACTIVE: 0, BULK: 0}
+        self._waiting_lock = threading.Lock()
+
+    def _queue(self, priority, delta):
+        with self._waiting_lock:
+            self.waiting[priority] += delta
+
+    def _finish(self, slot):
+        if slot.retry_after:
+            logger.warning(f"Leonardo asked us to back off for {slot.retry_after:.1f}s")
+            self.bucket.pause(slot.retry_after)
+        self.concurrency.release(overloaded=slot.overload)
+
+    @contextmanager
+    def slot(self, priority=None):
+        priority = priority or current_priority()
+        started_at = time.perf_counter()
+        self._queue(priority, 1)
+        try:
+            self.concurrency.acquire(priority)
+        except BaseException:
+            self._queue(priority, -1)
+            raise
+        slot = Slot()
+        try:
+            try:
+                while (wait := self.bucket.try_take(priority)) > 0:
+                    time.sleep(wait)
+            finally:
+                self._queue(priority, -1)
+            slot_wait.observe(time.perf_counter() - started_at, priority=priority)
+            yield slot
+        finally:
+            self._finish(slot)
+
+    @asynccontextmanager
+    async def aslot(self, priority=None):
+        priority = priority or current_priority()
+        started_at = time.perf_counter()
+        # 不能在事件循环里阻塞等待 Condition，用短间隔重试代替
+        self._queue(priority, 1)
+        self.concurrency.queue(priority, 1)
+        try:
+            while not self.concurrency.try_acquire(priority):
+                await asyncio.sleep(0.05)
+        except BaseException:
+            self._queue(priority, -1)
+            raise
+        finally:
+            self.concurrency.queue(priority, -1)
+        slot = Slot()
+        try:
+            try:
+                while (wait := self.bucket.try_take(priority)) > 0:
+                    await asyncio.sleep(wait)
+            finally:
+                self._queue(priority, -1)
+            slot_wait.observe(time.perf_counter() - started_at, priority=priority)
+            yield slot
+        finally:
+            self._finish(slot)
+
+
+_limiter = None
+_limiter_pid = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """返回进程共享的 RateLimiter；配置了 LEONARDO_RATE_LIMIT_DB 时速率预算跨进程共享"""
+    global _limiter, _limiter_pid
+    pid = os.getpid()
+    if _limiter is None or _limiter_pid != pid:
+        with _limiter_lock:
+            if _limiter is None or _limiter_pid != pid:
+                rate = getattr(settings, 'LEONARDO_RATE_LIMIT', 5)
+                burst = getattr(settings, 'LEONARDO_RATE_BURST', 10)
+                db_path = getattr(settings, 'LEONARDO_RATE_LIMIT_DB', None)
+                if db_path:
+                    bucket = SQLiteTokenBucket(db_path, rate, burst)
+                else:
+                    bucket = TokenBucket(rate, burst)
+                _limiter = RateLimiter(bucket, AIMDLimiter(
+                    initial=getattr(settings, 'LEONARDO_INITIAL_CONCURRENCY', 4),
+                    max_limit=getattr(settings, 'LEONARDO_MAX_CONCURRENCY', 16),
+                    interactive_share=getattr(settings, 'LEONARDO_INTERACTIVE_SHARE', 0.25),
+                ))
+                _limiter_pid = pid
+    return _limiter
+
+
+def _limiter_stat(attribute):
+    """只读取已经创建的 limiter，抓取指标时不主动创建"""
+    def read():
+        if _limiter is None or _limiter_pid != os.getpid():
+            return None
+        return attribute(_limiter)
+    return read
+
+
+metrics.gauge_function(
+    "leonardo_concurrency_limit", "Current AIMD concurrency limit for Leonardo requests",
+    _limiter_stat(lambda limiter: int(limiter.concurrency.limit)),
+)
+metrics.gauge_function(
+    "leonardo_concurrency_in_flight", "Leonardo requests holding a concurrency slot",
+    _limiter_stat(lambda limiter: limiter.concurrency.in_flight),
+)
+metrics.gauge_function(
+    "leonardo_queue_depth", "Leonardo requests waiting for a concurrency slot or rate-limit token",
+    _limiter_stat(lambda limiter: {(name,): count for name, count in limiter.waiting.items()}),
+    labels=("priority",),
+)
+metrics.gauge_function(
+    "leonardo_interactive_reserved", "Concurrency slots bulk requests leave free for interactive ones",
+    _limiter_stat(lambda limiter: limiter.concurrency.reserved()),
+)
@@ -0,0 +1,173 @@
+"""
+模型训练状态的统一调度。
+替代每次训练启动一个轮询线程/任务：一个循环每隔 TRAINING_SCHEDULER_INTERVAL 选出所有
+PENDING/TRAINING 且到期（next_check_at 为空或已过）的 UserCustomModel，
+在一个线程池里批量查询状态（请求经过 Leonardo 客户端的限流），最后用 bulk_update 一次写回。
+每个模型的下一次检查时间按 training_polling 计算；状态写在数据库里，重启后接着检查。
+训练开始超过 TRAINING_POLL_TIMEOUT 仍未结束的模型标记为 FAILED，不再检查。
+多个 run_workers 进程同时运行时，先用比较并交换把 next_check_at 推到租约时间，同一模型不会被重复检查。
+"""
+
+import time
+import logging
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from . import jobs, metrics
+from .image_generation import get_model_status
+from .models import UserCustomModel
+from .polling import training_polling, training_key
+from .progress import ProgressReporter
+
+
+logger = logging.getLogger(__name__)
+
+WATCHED_STATES = ('PENDING', 'TRAINING')
+FINAL_STATES = ('COMPLETE', 'FAILED')
+
+# 领取后在这段时间内其他进程不会再选中该模型，检查完成后会被真正的下一次检查时间覆盖
+LEASE_SECONDS = 300
+# 估算训练耗时时参考最近完成的模型数
+HISTORY_SIZE = 20
+
+tick_duration = metrics.histogram("training_scheduler_tick_seconds", "Time spent on one training status pass")
+
+
+def _watched_count():
+    return {(): UserCustomModel.objects.filter(model_status__in=WATCHED_STATES).count()}
+
+
+metrics.gauge_function("training_models_watched", "Custom models whose training status is being watched",
+                       _watched_count)
+
+
+def first_check_delay():
+    """训练开始后第一次检查前等待的秒数
+    按数据库里最近完成的训练耗时（training_started_at 到最后一次更新）的中位数 × lead 计算，
+    web 进程和各个 worker 得到同样的结果；没有历史时用 training_polling.initial_delay
+    """
+    finished = UserCustomModel.objects.filter(
+        model_status='COMPLETE', training_started_at__isnull=False,
+    ).order_by('-updated_at').values_list('training_started_at', 'updated_at')[:HISTORY_SIZE]
+    durations = sorted((updated_at - started_at).total_seconds() for started_at, updated_at in finished)
+    if not durations:
+        return training_polling.initial_delay
+    return max(durations[len(durations) // 2] * training_polling.lead, training_polling.min_interval)
+
+
+class TrainingScheduler:
+    def __init__(self, interval=None, batch_size=None, concurrency=None):
+        self.interval = interval or getattr(settings, 'TRAINING_SCHEDULER_INTERVAL', 10)
+        self.batch_size = batch_size or getattr(settings, 'TRAINING_SCHEDULER_BATCH', 50)
+        self.concurrency = concurrency or getattr(settings, 'TRAINING_SCHEDULER_CONCURRENCY', 4)
+        self.key = training_key("GENERAL")
+
+    def due(self, now):
+        """到期需要检查的模型"""
+        return list(
+            UserCustomModel.objects.filter(model_status__in=WATCHED_STATES)
+            .filter(Q(next_check_at__isnull=True) | Q(next_check_at__lte=now))
+            .order_by('next_check_at', 'id')[:self.batch_size]
+        )
+
+    def claim(self, models, now):
+        """比较并交换 next_check_at，只返回本进程抢到的模型"""
+        lease = now + timedelta(seconds=LEASE_SECONDS)
+        claimed = []
+        for model in models:
+            rows = UserCustomModel.objects.filter(id=model.id, model_status=model.model_status)
+            if model.next_check_at is None:
+                rows = rows.filter(next_check_at__isnull=True)
+            else:
+                rows = rows.filter(next_check_at=model.next_check_at)
+            if rows.update(next_check_at=lease):
+                claimed.append(model)
+        return claimed
+
+    def _fetch(self, model_id):
+        try:
+            return get_model_status(model_id)
+        except Exception as e:
+            logger.error(f"Error checking training status of model {model_id}: {str(e)}")
+            return None
+        finally:
+            close_old_connections()
+
+    def tick(self):
+        """执行一轮检查，返回检查的模型数"""
+        started_at = time.perf_counter()
+        now = timezone.now()
+        models = self.claim(self.due(now), now)
+        if not models:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(models)),
+                                thread_name_prefix='training-status') as executor:
+            statuses = list(executor.map(self._fetch, [model.model_id for model in models]))
+
+        now = timezone.now()
+        for model, status in zip(models, statuses):
+            self._apply(model, status, now)
+        # bulk_update 不会触发 auto_now，需要手动写 updated_at
+        UserCustomModel.objects.bulk_update(
+            models, ['model_status', 'next_check_at', 'checks', 'job', 'updated_at'])
+
+        tick_duration.observe(time.perf_counter() - started_at)
+        logger.info(f"Checked training status of {len(models)} models")
+        return len(models)
+
+    def _apply(self, model, status, now):
+        """根据查询结果更新模型（只改内存，由 tick() 统一写回）并推送进度"""
+        previous = model.model_status
+        started_at = model.training_started_at or model.created_at
+        progress = ProgressReporter(model.job_id) if model.job_id else None
+
+        model.checks += 1
+        model.updated_at = now
+        if status:
+            model.model_status = status
+            if progress and status != previous:
+                progress.update('training_status', f"Training status: {status}",
+                                status='in_progress', current_activity=status)
+
+        if model.model_status in FINAL_STATES:
+            model.next_check_at = None
+            logger.info(f"Model training {model.model_status.lower()} for {model.model_id}")
+            if progress:
+                if model.model_status == 'COMPLETE':
+                    progress.increment('complete', "Model training completed", status='complete')
+                    jobs.finish(model.job_id, 'SUCCEEDED', result={'status': model.model_status})
+                else:
+                    progress.update('failed', "Model training failed", status='failed')
+                    jobs.finish(model.job_id, 'FAILED', error="Model training failed")
+                model.job = None
+            return
+
+        # 超过 TRAINING_POLL_TIMEOUT 仍未结束，标记为 FAILED 并停止检查
+        if (now - started_at).total_seconds() > training_polling.timeout:
+            logger.error(f"Gave up waiting for training of model {model.model_id}")
+            model.model_status = 'FAILED'
+            model.next_check_at = None
+            if progress:
+                progress.update('failed', "Gave up waiting for model training", status='failed')
+                jobs.finish(model.job_id, 'FAILED', error="Timed out waiting for model training")
+                model.job = None
+            return
+
+        # 第一次检查前的等待已经在训练开始时排好（见 first_check_delay），之后按退避间隔检查
+        model.next_check_at = now + timedelta(seconds=training_polling.delay(self.key, model.checks))
+
+    def run_forever(self, stop):
+        """循环执行 tick()，直到 stop（threading.Event）被设置"""
+        logger.info(f"Training scheduler checking every {self.interval}s")
+        while not stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Training scheduler pass failed")
+            finally:
+                close_old_connections()
+            stop.wait(self.interval)
@@ -0,0 +1,67 @@
+import logging
+import functools
+from tempfile import SpooledTemporaryFile
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+
+logger = logging.getLogger(__name__)
+
+
+class SpooledUploadHandler(FileUploadHandler):
+    """上传文件先放在内存里，超过 FILE_UPLOAD_MAX_MEMORY_SIZE 后自动转存到匿名临时文件（SpooledTemporaryFile），
+    不会在工作目录里按上传的文件名写文件，同名上传互不影响；视图直接把上传文件交给 OCR（见 ocr.py）。
+    边接收边检查 UPLOAD_MAX_SIZE，超出时丢弃这个文件并在 request.upload_rejected 上记录原因，
+    请求里的其他字段和文件照常解析。只用于 OCR 上传接口（见 spooled_uploads）
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.max_size = getattr(settings, 'UPLOAD_MAX_SIZE', 20 * 1024 * 1024)
+        self.received = 0
+        self.file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE,
+            dir=settings.FILE_UPLOAD_TEMP_DIR,
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.file.close()
+            logger.warning(f"Rejected upload {self.file_name}: larger than {self.max_size} bytes")
+            if self.request is not None:
+                self.request.upload_rejected = f"File is larger than {self.max_size // (1024 * 1024)} MB"
+            raise SkipFile()
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        return UploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+def spooled_uploads(view):
+    """视图的上传文件改用 SpooledUploadHandler 接收
+    上传处理器必须在读取 request.POST / FILES 之前设置，而 CsrfViewMiddleware 会先读取 request.POST，
+    所以按 Django 文档的做法：外层 csrf_exempt 设置处理器，内层 csrf_protect 照常校验 CSRF
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers.insert(0, SpooledUploadHandler(request))
+        return protected(request, *args, **kwargs)
+    return wrapper
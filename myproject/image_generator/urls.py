@@ -13,7 +13,9 @@ urlpatterns = [
     
     # 数据集相关的路由
     path('create-dataset/<str:selected_image_id>/', views.create_user_dataset_view, name='create_dataset'),
-    path('dataset-progress/', views.dataset_progress, name='dataset_progress'),
+    path('dataset-progress/<int:job_id>/', views.dataset_progress, name='dataset_progress'),
+    path('progress/<int:job_id>/stream', views.progress_stream, name='progress_stream'),
+    path('jobs/<int:job_id>/cancel/', views.cancel_job, name='cancel_job'),
     path('dataset-complete/<str:dataset_id>/', views.dataset_complete, name='dataset_complete'),
     
     # 模型相关的路由
@@ -25,6 +27,8 @@ urlpatterns = [
     path('upload-diary/', views.diary_processing_flow, name='upload_diary'),
     path('view-generated-scenes/', views.view_generated_scenes, name='view_generated_scenes'),
     path('extract-text/', views.extract_text_view, name='extract_text'),
+    path('extract-text/pages/', views.extract_pages_view, name='extract_pages'),
+    path('extract-text/jobs/<int:job_id>/', views.ocr_result, name='ocr_result'),
     path('generate-scenes/', views.generate_scenes_view, name='generate_scenes'),
     path('generate-with-model/<str:model_id>/', views.generate_with_model, name='generate_with_model'),
     
@@ -34,6 +38,7 @@ urlpatterns = [
     path('display-diary-scenes/<str:dataset_id>/', views.display_diary_scenes, name='display_diary_scenes'),
     path('check-dataset-progress/<str:dataset_id>/', views.check_dataset_progress, name='check_dataset_progress'),
     path('get-dataset-images/<str:dataset_id>/', views.get_dataset_images, name='get_dataset_images'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
 
 # urlpatterns = [
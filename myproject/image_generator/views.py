@@ -1,8 +1,9 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.urls import reverse
 from .models import UserDiary, GeneratedImage, UserProfile
-from .cloudvision import parse_diary
+from . import ocr, ocr_cache
 from .image_generation import (
     generate, 
     display_images, 
@@ -10,25 +11,38 @@ from .image_generation import (
     get_number_of_images_in_dataset,
     create_dataset,
     generate_with_image_id,
-    check_generation_status,
-    get_generated_image_ids,
-    upload_image_to_dataset,
+    upload_images_to_dataset,
     display_all_images_in_dataset,
     train_custom_model,
-    get_model_status,
     generate_with_custom_model,
-    check_dataset_status
+    wait_for_generation,
+    adisplay_images,
+    acreate_dataset,
+    aget_model_status,
+    acheck_dataset_status,
+    adisplay_all_images_in_dataset,
 )
-import requests
-import os
+from .leonardo_client import get_client, closes_async_client
+from . import broadcast, jobs, metrics, ratelimit
 import logging
 import json
-import threading
 import time
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
 from django.contrib import messages
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
 from .forms import AvatarGenerationForm
 from .prompt_generation import process_diary_text
-from .models import UserCustomModel
+from .models import UserCustomModel, SceneImage, Job, JobProgress
+from . import progress as progress_store
+from .progress import ProgressReporter
+from .checkpoints import Checkpoints
+from .training_scheduler import first_check_delay
+from .uploads import spooled_uploads
 
 
 logger = logging.getLogger(__name__)
@@ -85,17 +99,8 @@ def initial_user_flow(request):
 
 def test_leonardo_api_key(request):
     """Test the Leonardo AI API key and return the response."""
-    leonardo_api_key = os.getenv("LEONARDO_API_KEY")
-    authorization = f"Bearer {leonardo_api_key}"
-    
-    url = "https://cloud.leonardo.ai/api/rest/v1/me"
-    headers = {
-        "accept": "application/json",
-        "authorization": authorization
-    }
-    
     try:
-        response = requests.get(url, headers=headers)
+        response = get_client().get("me")
         formatted_response = format_json_response(response)
         return JsonResponse({'status': 'success', 'response': formatted_response})
     except Exception as e:
@@ -163,22 +168,20 @@ def diary_processing_flow(request):
 
 ############# upload and parse diary ######################
 
+@spooled_uploads
 def upload_diary(request):
     """处理日记上传、文字提取、场景生成和图片生成的统一视图"""
     try:
         if request.method == 'POST':
-            if 'diary_images' in request.FILES:
+            if getattr(request, 'upload_rejected', None):
+                messages.error(request, request.upload_rejected)
+            elif 'diary_images' in request.FILES:
+                # 上传文件在内存或匿名临时文件里（见 uploads.SpooledUploadHandler），直接交给 OCR
                 image = request.FILES['diary_images']
                 
-                # 保存上传的图片到临时文件
-                temp_path = f'temp_{image.name}'
-                with open(temp_path, 'wb+') as destination:
-                    for chunk in image.chunks():
-                        destination.write(chunk)
-                        
                 try:
                     # 1. 提取文字
-                    diary_text = parse_diary(temp_path)
+                    diary_text, _ = ocr_cache.parse_diary(image, user=_diary_owner(request))
                     
                     # 2. 生成场景描述
                     scenes = process_diary_text(diary_text)
@@ -207,9 +210,7 @@ def upload_diary(request):
                     return render(request, 'image_generator/upload_diary.html', context)
                     
                 finally:
-                    # 清理临时文件
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
+                    image.close()
                         
             else:
                 messages.error(request, 'Please upload a diary image')
@@ -263,6 +264,7 @@ def process_diary_view(request):
 
 ########## allow user to create and select avatar ##############
 
+@ratelimit.interactive
 def generate_avatars(request):
     """Generate multiple avatar images based on user description."""
     username = request.session.get('username')
@@ -379,148 +381,207 @@ def create_user_dataset_view(request, selected_image_id):
         
         dataset_name = f"user_dataset_{selected_image_id[:8]}"
         
-        # 初始化进度信息
-        request.session['dataset_progress'] = {
-            'current_activity': '',
-            'completed_activities': 0,
-            'total_activities': 9,
-            'logs': [],
-            'status': 'starting',
-            'dataset_id': None
-        }
-        request.session.modified = True
-        
-        # 在后台线程中开始数据集创建
-        thread = threading.Thread(
-            target=create_dataset_background,
-            args=(request.session.session_key, dataset_name, selected_image_id, describe_user)
-        )
-        thread.start()
+        # 交给 run_workers 在后台创建数据集，进度记录和任务一起写入
+        with transaction.atomic():
+            job = jobs.enqueue('create_dataset', {
+                'dataset_name': dataset_name,
+                'seed_image_id': selected_image_id,
+                'describe_user': describe_user,
+                'username': username,
+            })
+            progress_store.create(job, total=len(DATASET_ACTIVITIES))
         
         return render(request, 'image_generator/dataset_progress.html', {
-            'selected_image_id': selected_image_id
+            'selected_image_id': selected_image_id,
+            'job_id': job.id,
         })
     
     return redirect('image_generator:home')
 
 
-def create_dataset_background(session_key, dataset_name, seed_image_id, describe_user):
-    """Background task to create dataset and update progress"""
-    from django.contrib.sessions.backends.db import SessionStore
-    session = SessionStore(session_key=session_key)
+# 数据集里每张图片对应的活动，顺序即进度日志和结果的顺序
+DATASET_ACTIVITIES = [
+    "playing basketball", "riding a bicycle", "reading a book",
+    "playing the piano", "cooking in the kitchen", "flying a kite",
+    "playing tennis", "swimming in a pool", "watering flowers"
+]
+
+
+def _report_stopped(progress, error):
+    """任务被取消或超过截止时间时写入最终进度"""
+    if isinstance(error, jobs.DeadlineExceeded):
+        progress.update('failed', "Stopped: the job ran past its deadline", status='failed')
+    else:
+        progress.update('cancelled', "Cancelled", status='cancelled')
+
+
+def _report_incomplete(progress, job, error):
+    """部分步骤没有完成（jobs.Incomplete）：还会重试时保持 in_progress，否则写入最终的失败状态"""
+    if job.attempts < job.max_attempts:
+        progress.update('retrying', f"{error}, retrying", status='in_progress')
+    else:
+        progress.update('failed', str(error), status='failed')
+
+
+@metrics.background_task("create_dataset")
+def create_dataset_background(dataset_name, seed_image_id, describe_user, progress=None, cancel=None,
+                              checkpoints=None, dataset_id=None):
+    """Background task to create dataset and update progress
+    各个活动并发提交（最多 DATASET_FANOUT_CONCURRENCY 个同时进行），
+    每个活动的图片在生成完成后立即上传，不等其他活动
+    进度写入 progress（ProgressReporter），不再写 session
+    每个活动开始前、轮询期间和上传前检查 cancel（jobs.CancelToken），取消后不再跟进已提交的生成
+    每一步写入 checkpoints（Checkpoints），任务重新执行时沿用 dataset_id，跳过已上传的活动，
+    已提交的生成按 generation_id 继续等待；有活动没有完成时抛出 jobs.Incomplete，任务重试时从检查点继续
+    """
+    progress = progress or ProgressReporter()
+    cancel = cancel or jobs.CancelToken()
+    checkpoints = checkpoints or Checkpoints()
     
     logger.info(f"Starting dataset creation with description: {describe_user}")
     
     try:
-        dataset_id = create_dataset(dataset_name)
-        logger.info(f"Dataset created with ID: {dataset_id}")
-        
-        if not dataset_id:
-            logger.error("Failed to create dataset")
-            session['dataset_progress'].update({
-                'status': 'failed',
-                'logs': ['Failed to create dataset']
-            })
-            session.save()
-            return
+        if dataset_id:
+            logger.info(f"Resuming dataset {dataset_id} ({checkpoints.count('UPLOADED')} activities already uploaded)")
+            progress.update('resumed', f"Resuming dataset {dataset_id}", status='in_progress',
+                            completed=checkpoints.count('UPLOADED'))
+        else:
+            dataset_id = create_dataset(dataset_name)
+            logger.info(f"Dataset created with ID: {dataset_id}")
             
-        # Initialize or update the progress dictionary
-        progress_data = session.get('dataset_progress', {})
-        progress_data.update({
-            'dataset_id': dataset_id,
-            'status': 'in_progress',
-            'current_activity': '',
-            'completed_activities': 0,
-            'total_activities': 9,
-            'logs': [f"Dataset created with ID: {dataset_id}"]
-        })
-        session['dataset_progress'] = progress_data
-        session.save()
-        
-        activities = [
-            "playing basketball", "riding a bicycle", "reading a book",
-            "playing the piano", "cooking in the kitchen", "flying a kite",
-            "playing tennis", "swimming in a pool", "watering flowers"
-        ]
+            if not dataset_id:
+                logger.error("Failed to create dataset")
+                progress.update('failed', 'Failed to create dataset', status='failed')
+                return
+            # 重试时沿用这个数据集，不再新建
+            checkpoints.remember(dataset_id=dataset_id)
+            
+            progress.update('dataset_created', f"Dataset created with ID: {dataset_id}",
+                            dataset_id=dataset_id, status='in_progress', total=len(DATASET_ACTIVITIES))
         
-        for idx, activity in enumerate(activities):
+        in_progress = []
+        in_progress_lock = threading.Lock()
+
+        def set_in_progress(activity, running):
+            with in_progress_lock:
+                if running:
+                    in_progress.append(activity)
+                elif activity in in_progress:
+                    in_progress.remove(activity)
+                return ', '.join(in_progress)
+
+        def run_activity(item):
+            idx, activity = item
+            step = checkpoints.get(idx)
+            if step.status == 'UPLOADED':
+                return True
             try:
+                cancel.check()
                 prompt = f"Highly detailed 3D Disney Pixar-style animation of a {describe_user}, {activity}. Disney, Pixar art style, CGI, high details, 3d animation."
-                logger.info(f"Activity {idx + 1}/{len(activities)}: {activity}")
+                logger.info(f"Activity {idx + 1}/{len(DATASET_ACTIVITIES)}: {activity}")
                 logger.info(f"Full prompt: {prompt}")
                 
-                progress_data = session.get('dataset_progress', {})
-                progress_data.update({
-                    'current_activity': activity,
-                    'completed_activities': idx,
-                    'logs': progress_data.get('logs', []) + [
-                        f"Starting generation for: {activity}",
-                        f"Using prompt: {prompt}"
-                    ]
-                })
-                session['dataset_progress'] = progress_data
-                session.save()
-                
-                # Generate image for activity
-                generation_id = generate_with_image_id(seed_image_id, prompt, 1)
+                progress.update('activity_started', f"Starting generation for: {activity}",
+                                current_activity=set_in_progress(activity, True))
                 
-                if generation_id:
+                if step.status == 'GENERATED':
+                    images = step.images
+                else:
+                    if step.status == 'GENERATING' and step.generation_id:
+                        # 上一次执行已提交的生成，接着等待，不重新提交
+                        generation_id = step.generation_id
+                        logger.info(f"Re-attaching to generation {generation_id} for {activity}")
+                    else:
+                        # Generate image for activity
+                        generation_id = generate_with_image_id(seed_image_id, prompt, 1)
+                        if not generation_id:
+                            logger.info(f"Failed to generate image for {activity}")
+                            checkpoints.save(idx, status='FAILED')
+                            progress.update('activity_failed', f"Failed to generate image for {activity}")
+                            return False
+                        checkpoints.save(idx, status='GENERATING', generation_id=generation_id)
+                    
                     logger.info(f"Generation started for {activity} with ID: {generation_id}")
-                    session['dataset_progress']['logs'].append(f"Generation started for {activity} (ID: {generation_id})")
-                    session.save()
+                    progress.update('generation_started', f"Generation started for {activity} (ID: {generation_id})")
                     
                     # Wait for generation
-                    while True:
-                        status = check_generation_status(generation_id)
-                        if status == 'COMPLETE':
-                            break
-                        time.sleep(2)
-                    
-                    # Upload to dataset
-                    image_ids = get_generated_image_ids(generation_id)
-                    for image_id in image_ids:
-                        upload_success = upload_image_to_dataset(dataset_id, image_id)
-                    
-                    session['dataset_progress'].update({
-                        'completed_activities': idx + 1,
-                        'logs': session['dataset_progress']['logs'] + [f"Completed: {activity}"]
-                    })
-                    session.save()
-                else:
-                    logger.info(f"Failed to generate image for {activity}")
-                    session['dataset_progress']['logs'].append(f"Failed to generate image for {activity}")
-                    session.save()
+                    result = wait_for_generation(generation_id, cancel=cancel)
+                    if not result.complete:
+                        checkpoints.save(idx, status='FAILED')
+                        raise RuntimeError(f"Generation {generation_id} ended with status {result.status}")
+                    images = result.images
+                    checkpoints.save(idx, status='GENERATED', images=images)
                 
+                # 生成完成就上传，不等其他活动
+                cancel.check()
+                image_ids = [image['id'] for image in images]
+                # 有图片没传上去时保持 GENERATED，重新执行时只重试还没上传的图片
+                already = step.uploaded_image_ids or []
+                outcomes = upload_images_to_dataset(dataset_id, [i for i in image_ids if i not in already])
+                uploaded = already + [outcome.image_id for outcome in outcomes if outcome.success]
+                checkpoints.save(idx, uploaded_image_ids=uploaded,
+                                 status='UPLOADED' if len(uploaded) == len(image_ids) else 'GENERATED')
+                if len(uploaded) < len(image_ids):
+                    progress.update('activity_failed', f"Failed to upload images for {activity}")
+                    return False
+                
+                progress.increment('image_uploaded', f"Completed: {activity}")
+                return True
+                
+            except jobs.JobCancelled:
+                raise
             except Exception as e:
                 logger.error(f"Error processing activity {activity}: {str(e)}")
-                progress_data = session.get('dataset_progress', {})
-                progress_data.update({
-                    'status': 'error',
-                    'logs': progress_data.get('logs', []) + [f"Error: {str(e)}"]
-                })
-                session['dataset_progress'] = progress_data
-                session.save()
+                progress.update('activity_failed', f"Error: {str(e)}", status='error')
+                return False
+            finally:
+                progress.update(current_activity=set_in_progress(activity, False))
+                # 线程池里的线程各自持有数据库连接，用完即关
+                close_old_connections()
+
+        concurrency = getattr(settings, 'DATASET_FANOUT_CONCURRENCY', 5)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(DATASET_ACTIVITIES))) as executor:
+            # map 按活动顺序返回结果，但各活动的生成和上传互不等待
+            succeeded = list(executor.map(run_activity, enumerate(DATASET_ACTIVITIES)))
+
+        if not all(succeeded):
+            raise jobs.Incomplete(f"{len(succeeded) - sum(succeeded)}/{len(DATASET_ACTIVITIES)} activities not uploaded")
                 
-        session['dataset_progress']['status'] = 'complete'
-        session['dataset_progress']['logs'].append("Dataset creation completed")
-        session.save()
+        progress.update('complete', f"Dataset creation completed ({sum(succeeded)}/{len(DATASET_ACTIVITIES)} activities)",
+                        status='complete')
         logger.info("Dataset creation completed successfully")
-
+        return {'dataset_id': dataset_id, 'completed': sum(succeeded)}
+
+    except jobs.JobCancelled as e:
+        logger.info(f"Dataset creation stopped: {str(e)}")
+        _report_stopped(progress, e)
+        raise
+    except jobs.Incomplete:
+        raise
     except Exception as e:
         logger.error(f"Critical error in background task: {str(e)}")
-        progress_data = session.get('dataset_progress', {})
-        progress_data.update({
-            'status': 'failed',
-            'logs': progress_data.get('logs', []) + [f"Critical error: {str(e)}"]
-        })
-        session['dataset_progress'] = progress_data
-        session.save()     
+        progress.update('failed', f"Critical error: {str(e)}", status='failed')
 
 
-def display_generated_images(request, generation_id):
+@jobs.register('create_dataset', max_attempts=3)
+def create_dataset_job(job):
+    # username 只用来核对任务归属
+    payload = {key: value for key, value in job.payload.items() if key != 'username'}
+    progress = ProgressReporter(job.id)
+    try:
+        return create_dataset_background(progress=progress, cancel=jobs.CancelToken.for_job(job),
+                                         checkpoints=Checkpoints(job.id), **payload)
+    except jobs.Incomplete as e:
+        _report_incomplete(progress, job, e)
+        raise
+
+
+@closes_async_client
+@ratelimit.interactive
+async def display_generated_images(request, generation_id):
     """View to display generated images"""
     # Get images using the function from image_generation.py
-    images = display_images(generation_id)
+    images = await adisplay_images(generation_id)
     
     # Add debugging information
     print(f"Generation ID: {generation_id}")
@@ -532,7 +593,8 @@ def display_generated_images(request, generation_id):
         'generation_id': generation_id,
         'images': images,
     }
-    return render(request, 'image_generator/display_images.html', context)
+    # 模板会读取 messages（session），渲染放到线程里执行
+    return await sync_to_async(render)(request, 'image_generator/display_images.html', context)
 
 
 
@@ -558,58 +620,30 @@ def train_model_view(request, dataset_id):
         if training_info:
             model_id = training_info['model_id']
             
-            # 用 update_or_create 而不是 create
-            UserCustomModel.objects.update_or_create(
-                username=username,  # 查找条件
-                defaults={         # 要更新的字段
-                    'model_id': model_id,
-                    'model_status': 'TRAINING'
-                }
-            )
+            # 训练状态由 run_workers 里的 TrainingScheduler 统一检查，这个任务只承载进度
+            with transaction.atomic():
+                job = jobs.external('watch_training', {'model_id': model_id, 'username': username})
+                progress_store.create(job, total=1)
+                # 用 update_or_create 而不是 create
+                now = timezone.now()
+                UserCustomModel.objects.update_or_create(
+                    username=username,  # 查找条件
+                    defaults={         # 要更新的字段
+                        'model_id': model_id,
+                        'model_status': 'TRAINING',
+                        'job': job,
+                        'checks': 0,
+                        'training_started_at': now,
+                        'next_check_at': now + timedelta(seconds=first_check_delay()),
+                    }
+                )
             
             logger.info(f"Model training started for user {username}")
             
-            # 立即检查初始状态
-            try:
-                initial_status = get_model_status(model_id)
-                logger.info(f"Initial training status for model {model_id}: {initial_status}")
-            except Exception as status_error:
-                logger.warning(f"Failed to get initial status: {str(status_error)}")
-            
-            # 启动后台任务来定期检查状态
-            def check_status_periodically():
-                max_checks = 60  # 最多检查60次
-                check_interval = 30  # 每30秒检查一次
-                
-                for i in range(max_checks):
-                    try:
-                        status = get_model_status(model_id)
-                        logger.info(f"Training status check {i+1}/{max_checks} for model {model_id}: {status}")
-                        
-                        # 更新数据库中的状态
-                        UserCustomModel.objects.filter(model_id=model_id).update(
-                            model_status=status
-                        )
-                        
-                        # 如果训练完成或失败，停止检查
-                        if status in ['COMPLETE', 'FAILED']:
-                            logger.info(f"Model training {status.lower()} for {model_id}")
-                            break
-                            
-                        time.sleep(check_interval)
-                    except Exception as e:
-                        logger.error(f"Error checking model status: {str(e)}")
-                        time.sleep(check_interval)
-                        
-            # 在后台线程中运行状态检查
-            import threading
-            status_thread = threading.Thread(target=check_status_periodically)
-            status_thread.daemon = True
-            status_thread.start()
-            
             return JsonResponse({
                 'status': 'success',
-                'model_id': model_id
+                'model_id': model_id,
+                'job_id': job.id,
             })
         else:
             return JsonResponse({
@@ -642,11 +676,17 @@ def view_trained_model(request, model_id):
         return redirect('image_generator:home')
 
 
-def check_model_status_view(request, model_id):
+@closes_async_client
+async def check_model_status_view(request, model_id):
     """View to check model training status."""
     try:
         logger.info(f"Checking status for model ID: {model_id}")
-        status = get_model_status(model_id)
+        # 训练中的模型由 TrainingScheduler 定期刷新，直接读数据库；不认识的模型才去问 Leonardo
+        status = await sync_to_async(
+            UserCustomModel.objects.filter(model_id=model_id).values_list('model_status', flat=True).first
+        )()
+        if not status:
+            status = await aget_model_status(model_id)
         logger.info(f"Retrieved status: {status}")
         
         if status:
@@ -674,22 +714,31 @@ def check_model_status_view(request, model_id):
 
 
 
-def dataset_progress(request, dataset_id=None):
+def _progress_for(**lookup):
+    row = JobProgress.objects.filter(**lookup).order_by('-job_id').first()
+    return progress_store.snapshot(row) if row else None
+
+
+async def dataset_progress(request, job_id):
     """API endpoint to check dataset creation progress"""
-    progress = request.session.get('dataset_progress', {})
+    # 只返回当前会话用户自己的任务进度
+    job = await Job.objects.filter(id=job_id).afirst()
+    owned = _owns_job(job, await request.session.aget('username'))
+    snapshot = await sync_to_async(_progress_for)(job_id=job_id) if owned else None
     
-    if not progress:
+    if not snapshot:
         return JsonResponse({
             'error': 'No dataset creation in progress'
         })
     
     return JsonResponse({
-        'current_activity': progress.get('current_activity', ''),
-        'completed_activities': progress.get('completed_activities', 0),
-        'total_activities': progress.get('total_activities', 9),
-        'logs': progress.get('logs', []),
-        'status': progress.get('status', 'unknown'),
-        'dataset_id': progress.get('dataset_id')
+        'current_activity': snapshot['current_activity'],
+        'completed_activities': snapshot['completed'],
+        'total_activities': snapshot['total'],
+        'logs': [event['message'] for event in snapshot['events']],
+        'events': snapshot['events'],
+        'status': snapshot['status'],
+        'dataset_id': snapshot['dataset_id']
     })
 
 
@@ -706,15 +755,17 @@ def dataset_complete(request, dataset_id):
 
 
 
-def generate_with_model(request, model_id):
+@closes_async_client
+async def generate_with_model(request, model_id):
     """Generate images using trained model"""
     try:
         logger.info(f"Received request to generate images with model_id: {model_id}")
         data = json.loads(request.body)
         scenes = data.get('scenes', [])
+        use_cache = data.get('use_cache', True)  # 传 false 时强制重新生成
         
         # 获取用户名
-        username = request.session.get('username')
+        username = await request.session.aget('username')
         if not username:
             return JsonResponse({
                 'status': 'error',
@@ -723,7 +774,7 @@ def generate_with_model(request, model_id):
         
         # 创建新的数据集
         dataset_name = f"diary_dataset_{int(time.time())}"
-        dataset_id = create_dataset(dataset_name)
+        dataset_id = await acreate_dataset(dataset_name)
         logger.info(f"Created dataset with ID: {dataset_id}")
         
         if not dataset_id:
@@ -732,17 +783,14 @@ def generate_with_model(request, model_id):
                 'message': 'Failed to create dataset'
             })
         
-        # 启动后台线程生成图片，传入 username
-        thread = threading.Thread(
-            target=generate_images_background,
-            args=(scenes, dataset_id, model_id, username)  # 修改参数顺序
-        )
-        thread.start()
+        # 交给 run_workers 在后台生成图片
+        job = await sync_to_async(enqueue_scene_job)(scenes, dataset_id, model_id, username, use_cache)
         
         return JsonResponse({
             'status': 'success',
             'dataset_id': dataset_id,
-            'redirect_url': reverse('image_generator:display_diary_scenes', kwargs={'dataset_id': dataset_id})
+            'job_id': job.id,
+            'redirect_url': reverse('image_generator:display_diary_scenes', kwargs={'dataset_id': dataset_id}) + f"?job_id={job.id}"
         })
         
     except Exception as e:
@@ -756,29 +804,34 @@ def generate_with_model(request, model_id):
 def display_diary_scenes(request, dataset_id):
     """Display generated diary scenes with progress tracking"""
     try:
-        # 获取场景列表，保持原始顺序
-        scenes = request.session.get('generated_scenes', [])
-        logger.info(f"Number of scenes from session: {len(scenes)}")
-        
-        # 获取数据集中的图片，假设图片顺序与生成顺序一致
-        dataset_images = display_all_images_in_dataset(dataset_id)
-        logger.info(f"Number of dataset images: {len(dataset_images)}")
+        # 优先使用渲染时记录的 scene_index -> 图片 对应关系，已完成的场景直接显示
+        scene_images = [
+            {'scene': row.scene, 'image_url': row.url, 'index': row.scene_index, 'status': row.status}
+            for row in SceneImage.objects.filter(dataset_id=dataset_id)
+        ]
         
-        # 按顺序将场景和图片配对
-        scene_images = []
-        for i, scene in enumerate(scenes):
-            image_url = dataset_images[i]['url'] if i < len(dataset_images) else ''
-            scene_images.append({
-                'scene': scene,
-                'image_url': image_url,
-                'index': i  # 添加索引
-            })
+        if not scene_images:
+            # 之前生成的数据集没有对应关系，退回按数据集中的位置配对
+            scenes = request.session.get('generated_scenes', [])
+            logger.info(f"Number of scenes from session: {len(scenes)}")
+            
+            dataset_images = display_all_images_in_dataset(dataset_id)
+            logger.info(f"Number of dataset images: {len(dataset_images)}")
+            
+            for i, scene in enumerate(scenes):
+                image_url = dataset_images[i]['url'] if i < len(dataset_images) else ''
+                scene_images.append({
+                    'scene': scene,
+                    'image_url': image_url,
+                    'index': i  # 添加索引
+                })
         
         logger.info(f"Final scene_images length: {len(scene_images)}")
         
         return render(request, 'image_generator/display_diary_scenes.html', {
             'scene_images': scene_images,
-            'dataset_id': dataset_id
+            'dataset_id': dataset_id,
+            'job_id': request.GET.get('job_id', '') if request.GET.get('job_id', '').isdigit() else '',
         })
         
     except Exception as e:
@@ -822,8 +875,42 @@ def display_diary_scenes(request, dataset_id):
 #         logger.error(f"Critical error in background generation: {str(e)}")
 
 
+def create_scene_rows(dataset_id, scenes):
+    """为所有场景建好 PENDING 记录，展示页马上就能知道总数和顺序；已存在的记录保持不变"""
+    SceneImage.objects.bulk_create([
+        SceneImage(dataset_id=dataset_id, scene_index=index, scene=scene)
+        for index, scene in enumerate(scenes)
+    ], ignore_conflicts=True)
+
+
+@transaction.atomic
+def enqueue_scene_job(scenes, dataset_id, model_id, username, use_cache=True):
+    """场景记录、任务和进度记录一起写入"""
+    create_scene_rows(dataset_id, scenes)
+    job = jobs.enqueue('generate_scenes', {
+        'scenes': scenes,
+        'dataset_id': dataset_id,
+        'model_id': model_id,
+        'username': username,
+        'use_cache': use_cache,
+    })
+    progress_store.create(job, total=len(scenes), dataset_id=dataset_id)
+    return job
+
+
 #备用的
-def generate_images_background(scenes, dataset_id, model_id, username):
+@metrics.background_task("generate_scenes")
+def generate_images_background(scenes, dataset_id, model_id, username, use_cache=True, progress=None, cancel=None,
+                               checkpoints=None):
+    """并发渲染日记场景（最多 SCENE_RENDER_CONCURRENCY 个同时进行）
+    每个场景完成时把 scene_index -> 图片 写入 SceneImage，展示页据此配对，与完成顺序无关
+    场景之间和轮询期间检查 cancel（jobs.CancelToken），取消后未完成的场景标记为 CANCELLED
+    每一步写入 checkpoints（Checkpoints），任务重新执行时跳过已上传的场景，已提交的生成按 generation_id 继续等待；
+    有场景没有完成时抛出 jobs.Incomplete，任务重试时从检查点继续
+    """
+    progress = progress or ProgressReporter()
+    cancel = cancel or jobs.CancelToken()
+    checkpoints = checkpoints or Checkpoints()
     try:
         logger.info(f"Starting background generation for {len(scenes)} scenes")
         logger.info(f"Username: {username}, Dataset ID: {dataset_id}, Model ID: {model_id}")
@@ -837,68 +924,128 @@ def generate_images_background(scenes, dataset_id, model_id, username):
                 
         except UserProfile.DoesNotExist:
             logger.error(f"User profile not found for username: {username}")
+            progress.update('failed', f"User profile not found for {username}", status='failed')
             return
 
-        # 创建一个列表来存储所有生成的图片ID和它们的顺序
-        generated_images = []
-
-        # 首先生成所有图片
-        for index, scene in enumerate(scenes):
+        create_scene_rows(dataset_id, scenes)
+        if checkpoints.resumed:
+            progress.update('resumed', f"Resuming {len(scenes)} scenes", status='in_progress',
+                            completed=checkpoints.count('UPLOADED'))
+        else:
+            progress.update('started', f"Rendering {len(scenes)} scenes", status='in_progress')
+
+        def render_scene(item):
+            index, scene = item
+            rows = SceneImage.objects.filter(dataset_id=dataset_id, scene_index=index)
+            step = checkpoints.get(index)
+            if step.status == 'UPLOADED':
+                return {'index': index, 'image_id': step.images[0]['id'], 'scene': scene}
             try:
+                cancel.check()
                 full_prompt = f"Highly detailed 3D Disney Pixar-style animation of {describe_user}, {scene}. Disney, Pixar art style, CGI, clean background, high details, 3d animation."
-                logger.info(f"Generating scene {index}: {scene}")
-                logger.info(f"Using prompt: {full_prompt}")
                 
-                generation_id = generate_with_image_id(seed_image_id, full_prompt, 1)
-                if not generation_id:
-                    logger.error(f"Failed to generate image for scene {index}: {scene}")
-                    continue
+                if step.status == 'GENERATED':
+                    images = step.images
+                else:
+                    if step.status == 'GENERATING' and step.generation_id:
+                        # 上一次执行已提交的生成，接着等待，不重新提交
+                        generation_id = step.generation_id
+                        logger.info(f"Re-attaching to generation {generation_id} for scene {index}")
+                    else:
+                        logger.info(f"Generating scene {index}: {scene}")
+                        logger.info(f"Using prompt: {full_prompt}")
+                        
+                        generation_id = generate_with_image_id(seed_image_id, full_prompt, 1, use_cache=use_cache)
+                        if not generation_id:
+                            logger.error(f"Failed to generate image for scene {index}: {scene}")
+                            rows.update(status='FAILED')
+                            checkpoints.save(index, status='FAILED')
+                            progress.update('scene_failed', f"Failed to generate scene {index + 1}")
+                            return None
+                        
+                        logger.info(f"Generated image with ID: {generation_id}")
+                        checkpoints.save(index, status='GENERATING', generation_id=generation_id)
+                    rows.update(status='GENERATING', generation_id=generation_id)
+                    progress.update('generation_started', f"Generation started for scene {index + 1} (ID: {generation_id})")
                     
-                logger.info(f"Generated image with ID: {generation_id}")
-                
-                # 等待生成完成
-                while True:
-                    status = check_generation_status(generation_id)
-                    logger.info(f"Generation status for scene {index}: {status}")
-                    if status == 'COMPLETE':
-                        break
-                    elif status == 'FAILED':
+                    # 等待生成完成，结果里已经带有图片ID
+                    result = wait_for_generation(generation_id, cancel=cancel)
+                    logger.info(f"Generation status for scene {index}: {result.status} ({result.elapsed:.1f}s)")
+                    if not result.complete or not result.images:
                         logger.error(f"Generation failed for scene {index}")
-                        break
-                    time.sleep(2)
-                
-                if status == 'COMPLETE':
-                    # 获取生成的图片ID
-                    image_ids = get_generated_image_ids(generation_id)
-                    logger.info(f"Got image IDs for scene {index}: {image_ids}")
+                        rows.update(status='FAILED')
+                        checkpoints.save(index, status='FAILED')
+                        progress.update('scene_failed', f"Generation for scene {index + 1} ended with status {result.status}")
+                        return None
                     
-                    # 立即尝试上传到数据集
-                    for image_id in image_ids:
-                        try:
-                            upload_success = upload_image_to_dataset(dataset_id, image_id)
-                            logger.info(f"Immediate upload for scene {index}, image {image_id}: {upload_success}")
-                            if upload_success:
-                                generated_images.append({
-                                    'index': index,
-                                    'image_id': image_id,
-                                    'scene': scene
-                                })
-                            else:
-                                logger.error(f"Failed to upload image {image_id} for scene {index}")
-                        except Exception as upload_error:
-                            logger.error(f"Error uploading image {image_id} for scene {index}: {str(upload_error)}")
+                    logger.info(f"Got image IDs for scene {index}: {result.image_ids}")
+                    images = result.images
+                    checkpoints.save(index, status='GENERATED', images=images)
                 
+                # 立即上传到数据集，并记录这个场景对应的图片
+                image = images[0]
+                cancel.check()
+                outcome = upload_images_to_dataset(dataset_id, [image['id']])[0]
+                logger.info(f"Immediate upload for scene {index}, image {outcome.image_id}: {outcome.success}")
+                if not outcome.success:
+                    # 保持 GENERATED，场景记录也不标记完成，任务重试时重新上传
+                    logger.error(f"Failed to upload image {outcome.image_id} for scene {index}: {outcome.error}")
+                    progress.update('scene_failed', f"Failed to upload scene {index + 1}")
+                    return None
+                checkpoints.save(index, status='UPLOADED', uploaded_image_ids=[image['id']])
+                rows.update(status='COMPLETE', image_id=image['id'], url=image['url'])
+                progress.increment('image_uploaded', f"Completed scene {index + 1}")
+                return {'index': index, 'image_id': image['id'], 'scene': scene}
+                
+            except jobs.JobCancelled:
+                raise
             except Exception as e:
                 logger.error(f"Error generating scene {index} '{scene}': {str(e)}")
                 logger.exception("Full traceback:")
+                rows.update(status='FAILED')
+                progress.update('scene_failed', f"Error in scene {index + 1}: {str(e)}")
+                return None
+            finally:
+                # 线程池里的线程各自持有数据库连接，用完即关
+                close_old_connections()
+
+        concurrency = getattr(settings, 'SCENE_RENDER_CONCURRENCY', 4)
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(scenes)))) as executor:
+            generated_images = [image for image in executor.map(render_scene, enumerate(scenes)) if image]
 
         # 记录最终结果
-        logger.info(f"Generation completed. Total successful uploads: {len(generated_images)}")
+        logger.info(f"Generation completed. Total successful scenes: {len(generated_images)}/{len(scenes)}")
         logger.info(f"Generated images details: {generated_images}")
+        if len(generated_images) < len(scenes):
+            raise jobs.Incomplete(f"{len(scenes) - len(generated_images)}/{len(scenes)} scenes not rendered")
+        progress.update('complete', f"Rendered {len(generated_images)}/{len(scenes)} scenes", status='complete')
+        return {'dataset_id': dataset_id, 'completed': len(generated_images)}
                 
+    except jobs.JobCancelled as e:
+        logger.info(f"Scene generation stopped: {str(e)}")
+        SceneImage.objects.filter(dataset_id=dataset_id, status__in=['PENDING', 'GENERATING']).update(status='CANCELLED')
+        _report_stopped(progress, e)
+        raise
+    except jobs.Incomplete:
+        raise
     except Exception as e:
         logger.error(f"Critical error in background generation: {str(e)}")
         logger.exception("Full traceback:")
+        progress.update('failed', f"Critical error: {str(e)}", status='failed')
+
+
+@jobs.register('generate_scenes', max_attempts=3)
+def generate_scenes_job(job):
+    progress = ProgressReporter(job.id)
+    try:
+        return generate_images_background(progress=progress, cancel=jobs.CancelToken.for_job(job),
+                                          checkpoints=Checkpoints(job.id), **job.payload)
+    except jobs.Incomplete as e:
+        _report_incomplete(progress, job, e)
+        if job.attempts >= job.max_attempts:
+            SceneImage.objects.filter(dataset_id=job.payload['dataset_id'],
+                                      status__in=['PENDING', 'GENERATING']).update(status='FAILED')
+        raise
 
         
 
@@ -950,34 +1097,85 @@ def trained_model_view(request, model_id):
         return redirect('image_generator:home')
 
 
+def _diary_owner(request):
+    return request.user if request.user.is_authenticated else None
+
+
+def _wants_async(request):
+    """请求里带 async=1，或打开了 OCR_ASYNC 时，OCR 交给后台 worker，请求立即返回"""
+    flag = request.POST.get('async')
+    if flag is not None:
+        return flag.lower() in ('1', 'true')
+    return getattr(settings, 'OCR_ASYNC', False)
+
+
+def _ocr_payload(results, multi_page):
+    texts = [text for text, _ in results]
+    cache = ['hit' if hit else 'miss' for _, hit in results]
+    if not multi_page:
+        return {'status': 'success', 'text': texts[0], 'cache': cache[0]}
+    return {'status': 'success', 'text': '\n\n'.join(texts), 'pages': texts, 'cache': cache}
+
+
+def _session_owner(request):
+    """OCR 任务的归属：会话里的用户名，还没有用户名（上传页不要求登录）时用会话ID"""
+    username = request.session.get('username')
+    if username:
+        return username
+    if request.session.session_key is None:
+        request.session.save()
+    return f"session:{request.session.session_key}"
+
+
+def _submit_ocr(request, pages, multi_page):
+    """异步模式：全部命中缓存时直接返回文字，否则创建 OCR 任务并返回 202 和任务ID，
+    客户端从 result_url 取结果，或订阅 stream_url 的进度事件
+    """
+    results, digests = ocr_cache.submit(pages, user=_diary_owner(request))
+    if results is not None:
+        return JsonResponse(_ocr_payload(results, multi_page))
+    job = jobs.enqueue('ocr', {'pages': digests, 'backend': ocr.get_backend().name, 'multi_page': multi_page,
+                               'username': _session_owner(request)})
+    progress_store.create(job, total=len(digests))
+    return JsonResponse({
+        'status': 'pending',
+        'job_id': job.id,
+        'result_url': reverse('image_generator:ocr_result', args=[job.id]),
+        'stream_url': reverse('image_generator:progress_stream', args=[job.id]),
+    }, status=202)
+
+
+def _ocr_timed_out(error):
+    logger.error(f"Text extraction timed out: {str(error)}")
+    return JsonResponse({'status': 'error', 'message': 'Text extraction timed out, please try again'}, status=504)
+
+
+@spooled_uploads
 def extract_text_view(request):
     """Extract text from uploaded diary image"""
     try:
+        # 超过 UPLOAD_MAX_SIZE 的文件在解析请求体时就被丢弃了，先于其他字段检查
+        if getattr(request, 'upload_rejected', None):
+            return JsonResponse({'error': request.upload_rejected}, status=413)
         if 'diary_image' not in request.FILES:
             return JsonResponse({'error': 'No image uploaded'}, status=400)
             
+        # 上传文件在内存或匿名临时文件里（见 uploads.SpooledUploadHandler），直接交给 OCR
         image = request.FILES['diary_image']
-        
-        # Save the uploaded image temporarily
-        temp_path = f'temp_{image.name}'
-        with open(temp_path, 'wb+') as destination:
-            for chunk in image.chunks():
-                destination.write(chunk)
                 
         try:
-            # Extract text using Cloud Vision API
-            extracted_text = parse_diary(temp_path)
+            if _wants_async(request):
+                return _submit_ocr(request, [image], multi_page=False)
+            # 同样的图片（重试时很常见）直接返回上次的结果，否则用 Cloud Vision API 提取
+            results = ocr_cache.parse_pages([image], user=_diary_owner(request))
             logger.info("Successfully extracted text from image")
             
-            return JsonResponse({
-                'status': 'success',
-                'text': extracted_text
-            })
+            return JsonResponse(_ocr_payload(results, multi_page=False))
         finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            image.close()
                 
+    except ocr.OCRTimeout as e:
+        return _ocr_timed_out(e)
     except Exception as e:
         logger.error(f"Error extracting text: {str(e)}")
         return JsonResponse({
@@ -986,6 +1184,83 @@ def extract_text_view(request):
         }, status=500)
 
 
+@spooled_uploads
+def extract_pages_view(request):
+    """多页日记的文字提取：所有页面一起 OCR，按上传顺序拼接"""
+    try:
+        pages = request.FILES.getlist('diary_pages')
+        # 有一页超过 UPLOAD_MAX_SIZE 就整体拒绝，不拿剩下的页面拼出不完整的日记
+        if getattr(request, 'upload_rejected', None):
+            for page in pages:
+                page.close()
+            return JsonResponse({'error': request.upload_rejected}, status=413)
+        if not pages:
+            return JsonResponse({'error': 'No pages uploaded'}, status=400)
+        max_pages = getattr(settings, 'DIARY_MAX_PAGES', 10)
+        if len(pages) > max_pages:
+            return JsonResponse({'error': f'At most {max_pages} pages can be uploaded at once'}, status=400)
+        
+        try:
+            if _wants_async(request):
+                return _submit_ocr(request, pages, multi_page=True)
+            results = ocr_cache.parse_pages(pages, user=_diary_owner(request))
+            logger.info(f"Successfully extracted text from {len(pages)} pages")
+            
+            return JsonResponse(_ocr_payload(results, multi_page=True))
+        finally:
+            for page in pages:
+                page.close()
+                
+    except ocr.OCRTimeout as e:
+        return _ocr_timed_out(e)
+    except Exception as e:
+        logger.error(f"Error extracting text from pages: {str(e)}")
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=500)
+
+
+@jobs.register('ocr', timeout=getattr(settings, 'OCR_JOB_TIMEOUT', 120))
+def ocr_job(job):
+    """异步 OCR：识别提交时存下的图片，结果（与同步接口相同的 JSON）写进 Job.result"""
+    progress = ProgressReporter(job.id)
+    digests = job.payload['pages']
+    try:
+        jobs.CancelToken.for_job(job).check()
+        progress.update('started', f"Reading {len(digests)} page(s)", status='in_progress')
+        results = ocr_cache.complete(digests, job.payload['backend'])
+    except (ocr.OCRTimeout, jobs.DeadlineExceeded) as e:
+        progress.update('timeout', f"Text extraction timed out: {str(e)}", status='failed')
+        raise
+    except jobs.JobCancelled as e:
+        _report_stopped(progress, e)
+        raise
+    except Exception as e:
+        progress.update('failed', f"Text extraction failed: {str(e)}", status='failed')
+        raise
+    progress.update('complete', "Text extracted", status='complete', completed=len(digests))
+    return _ocr_payload(results, job.payload['multi_page'])
+
+
+def ocr_result(request, job_id):
+    """异步 OCR 的结果：排队或执行中返回 202，超时返回 504"""
+    job = Job.objects.filter(id=job_id, job_type='ocr').first()
+    # 结果是用户日记的全文，只返回给提交它的用户或会话
+    if not _owns_session_job(job, request.session.get('username'), request.session.session_key):
+        return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+    if job.state == 'SUCCEEDED':
+        return JsonResponse(job.result)
+    if job.state in ('QUEUED', 'RUNNING'):
+        return JsonResponse({'status': 'pending', 'state': job.state}, status=202)
+    if job.state == 'CANCELLED':
+        return JsonResponse({'status': 'error', 'message': 'Cancelled'}, status=409)
+    events = JobProgress.objects.filter(job_id=job_id).values_list('log', flat=True).first() or []
+    if events and events[-1]['event'] == 'timeout':
+        return JsonResponse({'status': 'error', 'message': 'Text extraction timed out, please try again'}, status=504)
+    return JsonResponse({'status': 'error', 'message': 'Text extraction failed'}, status=500)
+
+
 def generate_scenes_view(request):
     """Generate scenes from diary text"""
     try:
@@ -1025,10 +1300,32 @@ def logout_view(request):
     return redirect('image_generator:initial')
 
 
-def check_dataset_progress(request, dataset_id):
+def _scene_progress(dataset_id):
+    """数据集中每个场景的状态，没有 SceneImage 记录时返回 None"""
+    return [
+        {'index': row.scene_index, 'status': row.status, 'url': row.url, 'id': row.image_id}
+        for row in SceneImage.objects.filter(dataset_id=dataset_id)
+    ] or None
+
+
+@closes_async_client
+async def check_dataset_progress(request, dataset_id):
     """检查数据集中的图片生成进度"""
     try:
-        status = check_dataset_status(dataset_id)
+        scenes = await sync_to_async(_scene_progress)(dataset_id)
+        if scenes is not None:
+            # 直接读本地记录，不再请求 Leonardo
+            snapshot = await sync_to_async(_progress_for)(dataset_id=dataset_id)
+            return JsonResponse({
+                'status': 'success',
+                'image_count': sum(scene['status'] == 'COMPLETE' for scene in scenes),
+                'finished_count': sum(scene['status'] in ('COMPLETE', 'FAILED', 'CANCELLED') for scene in scenes),
+                'scenes': scenes,
+                'job_status': snapshot['status'] if snapshot else None,
+                'events': snapshot['events'] if snapshot else [],
+            })
+
+        status = await acheck_dataset_status(dataset_id)
         if status:
             return JsonResponse({
                 'status': 'success',
@@ -1046,11 +1343,18 @@ def check_dataset_progress(request, dataset_id):
         }, status=500)
 
 
-def get_dataset_images(request, dataset_id):
+@closes_async_client
+async def get_dataset_images(request, dataset_id):
     """获取数据集中的图片URL"""
     try:
-        # 使用已有的 display_all_images_in_dataset 函数
-        images = display_all_images_in_dataset(dataset_id)
+        scenes = await sync_to_async(_scene_progress)(dataset_id)
+        if scenes is not None:
+            images = [
+                {'url': scene['url'], 'id': scene['id'], 'index': scene['index']}
+                for scene in scenes if scene['status'] == 'COMPLETE'
+            ]
+        else:
+            images = await adisplay_all_images_in_dataset(dataset_id)
         logger.info(f"Retrieved {len(images)} images for dataset {dataset_id}")
         
         return JsonResponse({
@@ -1065,3 +1369,55 @@ def get_dataset_images(request, dataset_id):
         }, status=500)
 
 
+def metrics_view(request):
+    """Prometheus 文本格式的进程内指标"""
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _owns_job(job, username):
+    """任务是否属于当前会话的用户（创建任务时把 username 写进了 payload）"""
+    return job is not None and bool(username) and job.payload.get('username') == username
+
+
+def _owns_session_job(job, username, session_key):
+    """_owns_job() 加上按会话ID归属的任务：未登录时提交的 OCR 任务记在 session:<key> 名下（见 _session_owner），
+    登录前后提交的任务都属于同一个会话
+    """
+    return _owns_job(job, username) or (session_key is not None and _owns_job(job, f"session:{session_key}"))
+
+
+def cancel_job(request, job_id):
+    """取消后台任务：排队中的任务不再执行，运行中的任务在下一次检查时停止，不再跟进已提交的生成"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=405)
+    # 别人的任务和不存在的任务一样处理，不暴露任务是否存在
+    if not _owns_session_job(Job.objects.filter(id=job_id).first(), request.session.get('username'),
+                             request.session.session_key):
+        return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+    state = jobs.cancel(job_id)
+    if state is None:
+        return JsonResponse({'status': 'error', 'message': 'Job is not running'}, status=409)
+    # 运行中的任务由处理函数自己写入 cancelled，这里只处理没有开始执行的任务，避免两处同时写事件日志
+    if state == 'CANCELLED':
+        ProgressReporter(job_id).update('cancelled', "Cancelled", status='cancelled')
+    return JsonResponse({'status': 'success', 'job_id': job_id, 'state': state})
+
+
+async def progress_stream(request, job_id):
+    """以 Server-Sent Events 推送任务进度
+    同一进程内同一任务的所有连接共用一个 broadcaster，断线重连时按 Last-Event-ID 补发
+    """
+    job = await Job.objects.filter(id=job_id).afirst()
+    if not _owns_session_job(job, await request.session.aget('username'), request.session.session_key):
+        return JsonResponse({'status': 'error', 'message': 'Job not found'}, status=404)
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID') or request.GET.get('last_seq') or 0)
+    except ValueError:
+        last_seq = 0
+    # ASGI 下用异步生成器逐条发送；WSGI 下 Django 只能逐条发送同步迭代器
+    events = broadcast.astream(job_id, last_seq) if isinstance(request, ASGIRequest) else broadcast.stream(job_id, last_seq)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # 让 nginx 之类的反向代理不要缓冲事件
+    response['X-Accel-Buffering'] = 'no'
+    return response
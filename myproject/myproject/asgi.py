@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myproject.settings")
 
 application = get_asgi_application()
+
+# web 服务启动时在后台建好 OCR 后端的连接（VISION_WARM_UP），第一次 OCR 不用再等通道建立和认证
+from image_generator.ocr import warm_up_in_background  # noqa: E402
+
+warm_up_in_background()
@@ -24,6 +24,66 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv("SECRET_KEY")
 DEBUG = os.getenv("DEBUG") == "True"  # Convert to boolean
 LEONARDO_API_KEY = os.getenv("LEONARDO_API_KEY")
+# Override to point the app at a local stand-in (python manage.py leonardo_standin)
+LEONARDO_API_BASE = os.getenv("LEONARDO_API_BASE", "https://cloud.leonardo.ai/api/rest/v1")
+LEONARDO_POOL_SIZE = int(os.getenv("LEONARDO_POOL_SIZE", "10"))  # keep-alive connections per worker
+LEONARDO_TIMEOUT = float(os.getenv("LEONARDO_TIMEOUT", "30"))  # seconds
+LEONARDO_ASYNC_POOL_SIZE = int(os.getenv("LEONARDO_ASYNC_POOL_SIZE", "100"))  # connections per event loop (ASGI)
+LEONARDO_MAX_RETRIES = 3  # retries for 429/502/503/504 responses
+
+# Shared rate limiting for every Leonardo request (token bucket + AIMD concurrency)
+LEONARDO_RATE_LIMIT = float(os.getenv("LEONARDO_RATE_LIMIT", "5"))  # requests per second
+LEONARDO_RATE_BURST = int(os.getenv("LEONARDO_RATE_BURST", "10"))
+LEONARDO_INITIAL_CONCURRENCY = 4
+LEONARDO_MAX_CONCURRENCY = int(os.getenv("LEONARDO_MAX_CONCURRENCY", "16"))
+LEONARDO_INTERACTIVE_SHARE = 0.25  # share of the concurrency limit kept free for interactive requests (avatar previews)
+# Point this at a file to share the request budget between worker processes on one host
+LEONARDO_RATE_LIMIT_DB = os.getenv("LEONARDO_RATE_LIMIT_DB")
+
+# Google Vision OCR
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", "30"))  # per-request deadline in seconds
+VISION_WARM_UP = os.getenv("VISION_WARM_UP") == "True"  # create the Vision client when a web server process starts
+OCR_BACKEND = os.getenv("OCR_BACKEND", "google")  # google, tesseract (local, offline) or fake (benchmarks)
+TESSERACT_CMD = os.getenv("TESSERACT_CMD", "tesseract")
+TESSERACT_LANG = os.getenv("TESSERACT_LANG", "chi_sim")
+OCR_FAKE_LATENCY = float(os.getenv("OCR_FAKE_LATENCY", "0"))  # seconds the fake backend sleeps per call
+OCR_ASYNC = os.getenv("OCR_ASYNC") == "True"  # OCR on the worker pool by default; requests can pass async=1/0
+OCR_JOB_TIMEOUT = 120  # seconds an async OCR job may run
+OCR_PENDING_TTL = 600  # seconds an uploaded photo waits for async OCR before run_workers deletes it
+VISION_BATCH_SIZE = 16  # pages per batch_annotate_images request (API maximum is 16)
+VISION_BATCH_BYTES = 8 * 1024 * 1024  # image bytes per batch request, below Vision's request size limit
+VISION_CONCURRENCY = 4  # pages pre-processed and batches sent at once
+DIARY_MAX_PAGES = 10  # pages accepted by one multi-page upload
+# Pre-processing before OCR: EXIF rotation, grayscale, downscale and re-encode
+VISION_PREPROCESS = os.getenv("VISION_PREPROCESS", "True") == "True"
+VISION_MAX_EDGE = int(os.getenv("VISION_MAX_EDGE", "2048"))  # pixels on the long edge
+VISION_GRAYSCALE = os.getenv("VISION_GRAYSCALE", "True") == "True"
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "JPEG")  # JPEG or PNG
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+
+# OCR uploads (image_generator.uploads.spooled_uploads) stay in memory up to this size, then spill to an anonymous temp file
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2621440  # 2.5 MB
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 20 * 1024 * 1024))  # bytes; larger uploads are rejected while streaming
+
+GENERATION_POLL_TIMEOUT = 300  # seconds before a single generation is abandoned
+TRAINING_POLL_TIMEOUT = 1800  # seconds after training starts before the model is marked FAILED and no longer checked
+GENERATION_RESULT_TTL = 120  # seconds a finished generation response is reused in-process
+DATASET_UPLOAD_CONCURRENCY = 4  # parallel uploads per upload_images_to_dataset call
+DATASET_FANOUT_CONCURRENCY = 5  # activities generated at once while building a dataset
+SCENE_RENDER_CONCURRENCY = 4  # diary scenes rendered at once per job
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "True") == "True"  # reuse identical generations
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))  # jobs each run_workers process runs concurrently
+JOB_POLL_INTERVAL = 1  # seconds between queue polls when idle
+JOB_RETRY_BACKOFF = 30  # seconds before the first retry of a failed job, doubled per attempt
+JOB_LOCK_TIMEOUT = 3600  # seconds before a RUNNING job whose worker vanished is requeued
+JOB_TIMEOUT = 1800  # wall-clock seconds a job may run, counted from its first attempt
+JOB_CANCEL_CHECK_INTERVAL = 2  # seconds between cancellation checks of a running job
+PROGRESS_LOG_SIZE = 50  # progress events kept per job
+PROGRESS_STREAM_INTERVAL = 1  # seconds between progress reads per streamed job
+PROGRESS_STREAM_HEARTBEAT = 15  # seconds between keepalive comments on idle streams
+TRAINING_SCHEDULER_INTERVAL = 10  # seconds between passes over models in training
+TRAINING_SCHEDULER_BATCH = 50  # models checked per pass at most
+TRAINING_SCHEDULER_CONCURRENCY = 4  # status requests in flight per pass
 
 ALLOWED_HOSTS = []
 